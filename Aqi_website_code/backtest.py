@@ -0,0 +1,163 @@
+"""
+Rolling-origin backtests of the recursive forecast: up to `origins`
+forecast origins per station, evenly spread over the history (or a
+start/end window), each run +1..+hours from its origin row and scored
+against what was observed.
+
+The seed rows come out of one feature_matrix call and are split into one
+fold per worker process. Each fold advances all of its origins together,
+so a fold costs `hours` predicts however many origins it holds. Errors
+land in one (origins x hours) array that the RMSE / MAE tables are
+reduced from.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from compact import feature_matrix
+from feature_state import states_at
+from forecasting import resolve_feature_layout, run_origins
+from modeling import direct_targets
+from telemetry import get_logger, StageClock
+
+log = get_logger("backtest")
+
+# Horizons reported per station and in the summary
+CHECKPOINTS = (24, 48, 72)
+
+
+# ---------- worker process side ----------
+_MODEL = None
+
+
+def _init_worker(model):
+    global _MODEL
+    _MODEL = model
+    # One fold per core already; the forest's own threads would oversubscribe
+    if hasattr(model, "n_jobs"):
+        model.n_jobs = 1
+
+
+def _run_fold(task):
+    X, layout, origins, hours, states = task
+    return run_origins(_MODEL, X, layout, origins, hours, states)
+
+
+def _map_folds(model, tasks, workers):
+    if workers == 1 or len(tasks) <= 1:
+        return [run_origins(model, *task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model,)) as pool:
+        return list(pool.map(_run_fold, tasks))
+
+
+# ---------- API ----------
+def pick_origins(df, per_station=24, hours=72, start=None, end=None, warmup=72):
+    """
+    Row positions of up to `per_station` origins per station, evenly spread
+    over the station's rows in [start, end]. The first `warmup` rows are
+    skipped so the lags are filled, and so is the last `hours` of history,
+    which has nothing to score against.
+    """
+    ts = pd.DatetimeIndex(pd.to_datetime(df["Timestamp"], utc=True))
+    lo = ts.min() if start is None else pd.Timestamp(start)
+    hi = ts.max() if end is None else pd.Timestamp(end)
+    lo = lo.tz_localize("UTC") if lo.tz is None else lo
+    hi = hi.tz_localize("UTC") if hi.tz is None else hi
+
+    by = df["station_original"].astype(str).to_numpy() if "station_original" in df.columns else np.zeros(len(df))
+    picks = []
+    for station in pd.unique(by):
+        pos = np.flatnonzero(by == station)[warmup:]
+        last = ts[np.flatnonzero(by == station)[-1]]
+        when = ts[pos]
+        pos = pos[(when >= lo) & (when <= hi) & (when <= last - pd.Timedelta(hours=hours))]
+        if len(pos):
+            picks.append(pos[np.unique(np.linspace(0, len(pos) - 1, min(per_station, len(pos))).astype(int))])
+    return np.sort(np.concatenate(picks)) if picks else np.array([], dtype=int)
+
+
+def horizon_table(errors):
+    """RMSE, MAE and scored-origin count per horizon from an (origins x hours) error array."""
+    known = np.isfinite(errors)
+    n = known.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sq = np.where(known, errors ** 2, 0).sum(axis=0) / n
+        ab = np.where(known, np.abs(errors), 0).sum(axis=0) / n
+    return pd.DataFrame({"rmse": np.sqrt(sq), "mae": ab, "n": n},
+                        index=pd.RangeIndex(1, errors.shape[1] + 1, name="horizon"))
+
+
+def backtest(df, model, hours=72, origins=24, start=None, end=None, workers=None, target_col="PM25",
+             checkpoints=CHECKPOINTS):
+    """
+    Backtest the recursive forecast over many origins per station.
+
+    Returns "table" (RMSE / MAE / n per horizon), "by_station" (RMSE per
+    station at each checkpoint horizon), "summary" (the checkpoints
+    overall) and the raw "errors" array (origins x hours). Runs in
+    `workers` processes (default: all cores).
+    """
+    clock = StageClock("backtest")
+    workers = workers or os.cpu_count() or 1
+    df = df.sort_values("Timestamp", kind="stable").reset_index(drop=True)
+
+    picks = pick_origins(df, origins, hours, start, end)
+    if not len(picks):
+        raise ValueError("❌ No forecast origins with a full horizon of history after them")
+
+    layout = resolve_feature_layout(df, model, target_col)
+    X = feature_matrix(df.iloc[picks], layout["feature_names"], dtype=np.float64)
+    when = pd.DatetimeIndex(pd.to_datetime(df["Timestamp"].iloc[picks], utc=True))
+    states = states_at(df, picks, target_col) if layout["rolling"] else None
+    actual = direct_targets(df, hours, target_col).to_numpy()[picks]
+    clock.lap("prepare")
+
+    folds = [f for f in np.array_split(np.arange(len(picks)), min(workers, len(picks))) if len(f)]
+    tasks = [(X[f], layout, when[f], hours, [states[i] for i in f] if states else None) for f in folds]
+    preds = np.hstack(_map_folds(model, tasks, workers)).T
+    clock.lap("forecast")
+
+    errors = preds - actual
+    table = horizon_table(errors)
+    checkpoints = [h for h in checkpoints if h <= hours]
+    stations = df["station_original"].astype(str).to_numpy()[picks] if "station_original" in df.columns \
+        else np.full(len(picks), "")
+    # One row per origin even when the horizon is shorter than every checkpoint
+    by_station = pd.DataFrame({f"rmse_{h}h": errors[:, h - 1] ** 2 for h in checkpoints},
+                              index=np.arange(len(picks))).groupby(stations).mean() ** 0.5
+    by_station["origins"] = pd.Series(stations).value_counts()
+
+    seconds = clock.done()
+    log.info("✅ Backtest done", extra={"origins": len(picks), "stations": len(by_station),
+                                       "hours": hours, "workers": len(folds), "seconds": round(seconds, 3)})
+    return {
+        "origins": len(picks),
+        "hours": hours,
+        "seconds": seconds,
+        "table": table,
+        "by_station": by_station,
+        "summary": {f"{h}h": {"rmse": _number(table.at[h, "rmse"]), "mae": _number(table.at[h, "mae"]),
+                              "n": int(table.at[h, "n"])} for h in checkpoints},
+        "errors": errors,
+    }
+
+
+def _number(value):
+    return round(float(value), 4) if np.isfinite(value) else None
+
+
+def backtest_report(result):
+    """JSON-friendly view of a backtest result (without the raw errors)."""
+    def clean(values):
+        return [_number(v) for v in values]
+
+    return {
+        "origins": result["origins"],
+        "hours": result["hours"],
+        "seconds": round(result["seconds"], 3),
+        "summary": result["summary"],
+        "rmse_by_horizon": clean(result["table"]["rmse"]),
+        "mae_by_horizon": clean(result["table"]["mae"]),
+        "by_station": {station: {k: int(v) if k == "origins" else _number(v) for k, v in row.items()}
+                       for station, row in result["by_station"].to_dict(orient="index").items()},
+    }
@@ -0,0 +1,115 @@
+"""
+Per-step latency of the recursive forecast loop, before and after the
+array-based core, and the cost of adding per-tree quantile bands. Runs
+offline against pm25_model.pkl with a synthetic frame shaped like the
+preprocessed Mongo data:
+
+    python bench_forecast.py --hours 72 --repeat 3 --quantiles 0.1,0.5,0.9
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from joblib import load
+from forecasting import forecast_next_days
+from compiled_forest import compile_forest
+
+
+def synthetic_frame(feature_cols, rows=500, stations=("Anand Vihar", "ITO"), seed=0):
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2024-01-01", periods=rows, freq="h", tz="UTC")
+    df = pd.DataFrame(rng.gamma(3, 30, size=(rows, len(feature_cols))), columns=feature_cols)
+    df["Timestamp"] = ts
+    df["PM25"] = rng.gamma(3, 40, size=rows)
+    df["station_original"] = [stations[i % len(stations)] for i in range(rows)]
+    for s in stations:
+        df[f"station_{s}"] = df["station_original"] == s
+    return df
+
+
+def legacy_forecast(df, model, target_col="PM25", hours=72, station=None, start_time=None):
+    """The pre-rewrite DataFrame loop, kept here as the comparison baseline."""
+    latest_row = df.iloc[-1:].copy()
+    for c in latest_row.columns:
+        if c.startswith("station_"):
+            latest_row[c] = 0
+    if station is not None:
+        latest_row[f"station_{station}"] = 1
+    last_timestamp = pd.to_datetime(start_time) if start_time is not None else df["Timestamp"].max()
+
+    drop_cols = ["Timestamp", "_id", "city", "timestamp", target_col, "station_original"]
+    feature_names = list(model.feature_names_in_)
+    X_latest = latest_row.drop(columns=drop_cols, errors="ignore")
+    for col in feature_names:
+        if col not in X_latest.columns:
+            X_latest[col] = 0
+    X_latest = X_latest[feature_names]
+
+    forecasts = []
+    for i in range(hours):
+        y_pred = float(model.predict(X_latest)[0])
+        next_timestamp = last_timestamp + pd.Timedelta(hours=i + 1)
+        forecasts.append({"Timestamp": str(next_timestamp), target_col: y_pred, "station": station})
+
+        new_row = latest_row.copy()
+        new_row["Timestamp"] = next_timestamp
+        new_row[target_col] = y_pred
+        new_row["lag_1d"] = y_pred
+        new_row["lag_2d"] = latest_row.get("lag_1d", y_pred)
+        new_row["lag_3d"] = latest_row.get("lag_2d", y_pred)
+
+        latest_row = new_row.copy()
+        X_latest = latest_row.drop(columns=drop_cols, errors="ignore")
+        for col in feature_names:
+            if col not in X_latest.columns:
+                X_latest[col] = 0
+        X_latest = X_latest[feature_names]
+
+    return pd.DataFrame(forecasts)
+
+
+def time_per_step(fn, hours, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best / hours * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="pm25_model.pkl")
+    parser.add_argument("--features", default="feature_cols.pkl")
+    parser.add_argument("--hours", type=int, default=72)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--n-jobs", type=int, default=None,
+                        help="Override the model's n_jobs (e.g. 1 to remove thread dispatch)")
+    parser.add_argument("--quantiles", default="0.1,0.5,0.9")
+    args = parser.parse_args()
+    quantiles = [float(q) for q in args.quantiles.split(",") if q.strip()]
+
+    model = load(args.model)
+    if args.n_jobs is not None and hasattr(model, "n_jobs"):
+        model.set_params(n_jobs=args.n_jobs)
+    df = synthetic_frame(load(args.features))
+
+    run = dict(df=df, model=model, hours=args.hours, station="ITO", start_time="2025-01-01")
+    before = time_per_step(lambda: legacy_forecast(**run), args.hours, args.repeat)
+    after = time_per_step(lambda: forecast_next_days(**run), args.hours, args.repeat)
+    fast = compile_forest(model)
+    compiled = time_per_step(lambda: forecast_next_days(**{**run, "model": fast}), args.hours, args.repeat)
+
+    bands = time_per_step(lambda: forecast_next_days(**run, quantiles=quantiles), args.hours, args.repeat)
+    compiled_bands = time_per_step(lambda: forecast_next_days(**{**run, "model": fast}, quantiles=quantiles),
+                                   args.hours, args.repeat)
+
+    print(f"legacy loop     : {before:8.2f} ms/step")
+    print(f"array core      : {after:8.2f} ms/step  ({before / after:.2f}x)")
+    print(f"compiled forest : {compiled:8.2f} ms/step  ({before / compiled:.2f}x)")
+    print(f"quantile bands  : {bands:8.2f} ms/step  ({bands / after:.2f}x the sklearn point forecast, "
+          f"{compiled_bands / compiled:.2f}x the compiled one, {len(quantiles)} quantiles)")
+
+
+if __name__ == "__main__":
+    main()
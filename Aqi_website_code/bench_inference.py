@@ -0,0 +1,102 @@
+"""
+Latency and throughput of on-demand forecasts under concurrent load, in
+the API process's threadpool (the INFERENCE_WORKERS=0 path) versus the
+process-pool executor with request coalescing:
+
+    python bench_inference.py --clients 32 --requests 4 --workers 2 --window-ms 5
+"""
+import argparse
+import asyncio
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from joblib import load
+from forecasting import forecast_next_days, resolve_feature_layout, seed_features, seed_states, get_station_column
+from inference_pool import InferenceExecutor, Saturated
+from bench_forecast import synthetic_frame
+
+
+STATIONS = ("Anand Vihar", "ITO", "RK Puram", "Punjabi Bagh")
+
+
+async def drive(call, clients, per_client):
+    """Run `clients` concurrent loops of `per_client` calls; (latencies, wall seconds, rejected)."""
+    latencies, rejected = [], 0
+
+    async def client(i):
+        nonlocal rejected
+        for k in range(per_client):
+            station = STATIONS[(i + k) % len(STATIONS)]
+            t0 = time.perf_counter()
+            try:
+                await call(station)
+            except Saturated:
+                rejected += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return np.array(latencies), time.perf_counter() - start, rejected
+
+
+def report(name, latencies, wall, rejected):
+    ms = latencies * 1000
+    print(f"{name:<14} {len(latencies) / wall:8.1f} req/s   p50 {np.percentile(ms, 50):8.1f} ms"
+          f"   p95 {np.percentile(ms, 95):8.1f} ms   rejected {rejected}")
+
+
+async def main_async(args):
+    model = load(args.model)
+    if args.n_jobs is not None and hasattr(model, "n_jobs"):
+        model.set_params(n_jobs=args.n_jobs)
+    df = synthetic_frame(load(args.features), stations=STATIONS)
+    start = pd.Timestamp("2025-01-01 10:17")
+
+    async def threaded(station):
+        return await asyncio.to_thread(forecast_next_days, df, model, hours=args.hours,
+                                       station=station, start_time=start)
+
+    layout = resolve_feature_layout(df, model)
+    executor = InferenceExecutor(args.workers, args.window_ms, args.max_queue, args.max_batch)
+    await executor.start()
+    executor.set_model(model)
+
+    async def pooled(station):
+        station_cols = [get_station_column(df, station)]
+        X = seed_features(df, layout, station_cols)
+        states = seed_states(df, layout, station_cols)
+        return await executor.forecast(X[0], layout, start, args.hours, states[0] if states else None)
+
+    # Both paths must agree before their speed is worth comparing
+    expected = forecast_next_days(df, model, hours=args.hours, station="ITO", start_time=start)["PM25"]
+    np.testing.assert_allclose(await pooled("ITO"), expected.to_numpy())
+
+    print(f"{args.clients} clients x {args.requests} requests, {args.hours}h horizon")
+    report("threadpool", *await drive(threaded, args.clients, args.requests))
+    report("process pool", *await drive(pooled, args.clients, args.requests))
+    print(f"mean batch size {executor.info()['mean_batch']}")
+    await executor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="pm25_model.pkl")
+    parser.add_argument("--features", default="feature_cols.pkl")
+    parser.add_argument("--hours", type=int, default=72)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-queue", type=int, default=256)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--n-jobs", type=int, default=None,
+                        help="Override the model's n_jobs (e.g. 1 to remove thread dispatch)")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Stage timings and peak memory for the ML pipeline on synthetic hourly_data:
+Mongo load → preprocess_data → train_model → forecast_next_days → /forecast.
+Runs offline (in-memory collection by default) and compares against stored
+baselines:
+
+    python bench_pipeline.py --scale small
+    python bench_pipeline.py --scale medium --save-baseline
+    python bench_pipeline.py --source mongo --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from synthetic_data import SCALES, MemoryCollection, scale_docs
+
+
+STAGES = ("load", "preprocess", "train", "forecast", "api")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.json")
+
+
+def get_collection(source, docs, mongo_uri=None):
+    if source == "memory":
+        return MemoryCollection(docs)
+    if source == "mongomock":
+        import mongomock
+        collection = mongomock.MongoClient()["air_quality"]["hourly_data"]
+    elif source == "mongo":
+        from pymongo import MongoClient
+        collection = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)["aqi_bench"]["hourly_data"]
+        collection.drop()
+    else:
+        raise ValueError(f"Unknown source '{source}'")
+    # insert_many adds _id to the dicts it's given
+    collection.insert_many([dict(d) for d in docs])
+    return collection
+
+
+def measure(fn, repeat, track_memory=True):
+    """(best seconds over `repeat` runs, peak traced MB of one extra run, last result)."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - t0)
+
+    peak_mb = None
+    if track_memory:
+        # Separate run: tracemalloc slows allocation-heavy code down a lot
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return best, peak_mb, result
+
+
+def run_stages(collection, stages=STAGES, repeat=3, track_memory=True, hours=72):
+    # Imported lazily so --help doesn't pay for sklearn / fastapi
+    import ml_api
+    from preprocessing import preprocess_data
+    from modeling import train_model
+    from forecasting import forecast_next_days, list_stations
+
+    results, ctx = {}, {}
+
+    def record(stage, fn, runs=repeat):
+        needed = STAGES.index(stage) <= max(STAGES.index(s) for s in stages)
+        if stage not in stages:
+            # Not benchmarked, but later stages need its output
+            if needed:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    ctx[stage] = fn()
+            return
+        seconds, peak_mb, ctx[stage] = measure(fn, runs, track_memory)
+        results[stage] = {"seconds": round(seconds, 4),
+                          "peak_mb": None if peak_mb is None else round(peak_mb, 2)}
+        print(f"   {stage:<11}{seconds * 1000:10.1f} ms" + ("" if peak_mb is None else f"{peak_mb:10.1f} MB peak"))
+
+    record("load", lambda: ml_api.load_data_from_mongo(collection=collection, limit=None))
+    ctx["rows"] = len(ctx["load"])
+    record("preprocess", lambda: preprocess_data(ctx["load"].copy()))
+    record("train", lambda: train_model(ctx["preprocess"].copy()), runs=1)
+
+    df, model = ctx["preprocess"], ctx.get("train", {}).get("model")
+    station = list_stations(df)[0] if "forecast" in stages or "api" in stages else None
+    record("forecast", lambda: forecast_next_days(df, model, hours=hours, station=station,
+                                                  start_time="2030-01-01"))
+
+    if "api" in stages:
+        ml_api.STATE.update(df=df, model=model)
+        req = ml_api.ForecastRequest(station=station, hours=hours)
+        record("api", lambda: asyncio.run(ml_api.forecast(req)))
+
+    return results, ctx["rows"]
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """Lines describing each stage against the baseline, plus whether any regressed."""
+    lines, regressed = [], False
+    for stage, now in results.items():
+        base = baseline.get(stage)
+        if not base:
+            lines.append(f"   {stage:<11} (no baseline)")
+            continue
+        ratio = now["seconds"] / base["seconds"] if base["seconds"] else 1.0
+        mem_ratio = now["peak_mb"] / base["peak_mb"] if now["peak_mb"] and base.get("peak_mb") else None
+        slow = ratio > 1 + threshold
+        fat = mem_ratio is not None and mem_ratio > 1 + memory_threshold
+        regressed |= slow or fat
+        status = "❌ REGRESSION" if slow or fat else "✅"
+        mem = "" if mem_ratio is None else f"  memory x{mem_ratio:.2f}"
+        lines.append(f"   {stage:<11} time x{ratio:.2f}{mem}  {status}")
+    return lines, regressed
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--source", choices=["memory", "mongomock", "mongo"], default="memory")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                        help="Local Mongo to seed with the synthetic docs (--source mongo)")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--hours", type=int, default=72)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory runs")
+    parser.add_argument("--baseline-file", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown vs baseline before a stage counts as a regression")
+    parser.add_argument("--memory-threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages {unknown}; choose from {list(STAGES)}")
+
+    warnings.filterwarnings("ignore")
+    # Keep pipeline logs out of the report unless asked for
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    docs = scale_docs(args.scale, seed=args.seed)
+    collection = get_collection(args.source, docs, args.mongo_uri)
+    print(f"🔹 {args.scale}: {len(docs)} synthetic documents via {args.source}")
+
+    results, rows = run_stages(collection, stages, args.repeat, not args.no_memory, args.hours)
+
+    baselines = load_baselines(args.baseline_file)
+    key = f"{args.scale}/{args.source}"
+    regressed = False
+    if key in baselines and not args.save_baseline:
+        print(f"🔹 vs baseline ({baselines[key]['recorded_at']}):")
+        lines, regressed = compare(results, baselines[key]["stages"], args.threshold, args.memory_threshold)
+        print("\n".join(lines))
+
+    if args.save_baseline:
+        baselines[key] = {
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "machine": f"{platform.machine()} / Python {platform.python_version()}",
+            "documents": len(docs),
+            "rows": rows,
+            "stages": {**baselines.get(key, {}).get("stages", {}), **results},
+        }
+        with open(args.baseline_file, "w") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"✅ Baseline saved for {key}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+
+def compact_frame(df, target_col="PM25"):
+    """
+    Shrink a preprocessed frame for serving.
+
+    Station one-hot columns are dropped in favour of a categorical
+    `station_original` (one small code per row instead of one column per
+    station), float64 features become float32 and the calendar features
+    become small ints. The trees already compare inputs as float32, so
+    predictions don't change; the target stays float64 so retraining on a
+    compact frame fits the same model. Use station_dummies / feature_matrix
+    to get the one-hot layout back at the point a model needs it.
+    """
+    if df is None or df.empty:
+        return df
+
+    station_cols = [c for c in df.columns if c.startswith("station_") and c != "station_original"]
+    out = df.drop(columns=station_cols)
+
+    if "station_original" in out.columns:
+        out["station_original"] = out["station_original"].astype("category")
+    elif station_cols:
+        # No name column to fall back on: rebuild it from the one-hots
+        names = [c[len("station_"):] for c in station_cols]
+        codes = df[station_cols].to_numpy().argmax(axis=1)
+        out["station_original"] = pd.Categorical.from_codes(codes, categories=names)
+
+    if "city" in out.columns:
+        out["city"] = out["city"].astype("category")
+
+    for col in out.select_dtypes(include=["float64"]).columns:
+        if col != target_col:
+            out[col] = out[col].astype(np.float32)
+    for col in ("hour", "day_of_week", "month"):
+        if col in out.columns:
+            out[col] = out[col].astype(np.int8)
+
+    out.attrs = {**df.attrs, "compact": True}
+    return out
+
+
+def station_dummies(df, prefix="station"):
+    """One-hot station columns generated from the categorical codes on demand."""
+    cat = df["station_original"].astype("category")
+    codes = cat.cat.codes.to_numpy()
+    return pd.DataFrame(
+        {f"{prefix}_{name}": codes == i for i, name in enumerate(cat.cat.categories)},
+        index=df.index,
+    )
+
+
+def feature_matrix(df, feature_names, dtype=np.float32):
+    """
+    (n_rows x n_features) model input in `feature_names` order. Station
+    one-hot features are filled from the categorical codes, so they never
+    need to be stored on the frame itself.
+    """
+    X = np.zeros((len(df), len(feature_names)), dtype=dtype)
+    codes = categories = None
+    if "station_original" in df.columns:
+        cat = df["station_original"].astype("category")
+        codes = cat.cat.codes.to_numpy()
+        categories = {f"station_{name}": i for i, name in enumerate(cat.cat.categories)}
+
+    for j, name in enumerate(feature_names):
+        if name in df.columns:
+            X[:, j] = df[name].to_numpy(dtype=dtype, na_value=np.nan)
+        elif categories is not None and name in categories:
+            X[:, j] = codes == categories[name]
+    return X
+
+
+def memory_report(df):
+    if df is None:
+        return {"rows": 0, "bytes": 0}
+    usage = df.memory_usage(deep=True, index=True)
+    by_dtype = {}
+    for col, dtype in df.dtypes.items():
+        by_dtype[str(dtype)] = by_dtype.get(str(dtype), 0) + int(usage[col])
+    return {
+        "rows": len(df),
+        "columns": df.shape[1],
+        "compact": bool(df.attrs.get("compact")),
+        "bytes": int(usage.sum()),
+        "megabytes": round(usage.sum() / 1e6, 2),
+        "bytes_by_dtype": by_dtype,
+    }
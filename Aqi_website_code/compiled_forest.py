@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+from joblib import load
+
+
+class CompiledForest:
+    """
+    Array-based inference for a fitted sklearn tree ensemble.
+
+    Every tree's nodes are concatenated into contiguous arrays (feature,
+    threshold, children, value). predict walks all trees for all rows
+    together, one vectorized step per tree level, so there's no sklearn
+    validation or joblib thread dispatch per call. Leaves point at
+    themselves, and pairs drop out of the walk once they reach one.
+    """
+
+    def __init__(self, model):
+        estimators = getattr(model, "estimators_", None)
+        if estimators is None and hasattr(model, "tree_"):
+            estimators = [model]
+        if not estimators or not all(hasattr(e, "tree_") for e in np.ravel(estimators)):
+            raise TypeError(f"Cannot compile {type(model).__name__}: expected a fitted tree or forest")
+        if hasattr(model, "learning_rate"):
+            raise TypeError("Boosted ensembles are not supported, only averaged forests")
+
+        features, thresholds, lefts, rights, values, missing_left, roots = [], [], [], [], [], [], []
+        offset, max_depth = 0, 0
+        for est in estimators:
+            tree = est.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + n)
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, own, tree.children_left + offset))
+            rights.append(np.where(is_leaf, own, tree.children_right + offset))
+            values.append(tree.value.reshape(n, -1))
+            missing_left.append(_missing_go_to_left(tree, n))
+            roots.append(offset)
+
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.value = np.concatenate(values).astype(np.float64)
+        self.missing_go_to_left = np.concatenate(missing_left)
+        self.is_leaf = self.left == np.arange(offset)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+        self.n_outputs = self.value.shape[1]
+
+        self.n_features_in_ = getattr(model, "n_features_in_", None)
+        if hasattr(model, "feature_names_in_"):
+            self.feature_names_in_ = np.asarray(model.feature_names_in_, dtype=object)
+        self.source_model = model
+
+    _ARRAYS = ("feature", "threshold", "left", "right", "value", "missing_go_to_left", "is_leaf", "roots")
+
+    def save(self, path):
+        """Write the flat arrays to an .npz that loads without sklearn."""
+        extra = {"feature_names_in_": self.feature_names_in_.astype(str)} \
+            if hasattr(self, "feature_names_in_") else {}
+        np.savez(path, max_depth=self.max_depth, **{name: getattr(self, name) for name in self._ARRAYS}, **extra)
+
+    @classmethod
+    def load_arrays(cls, path):
+        data = np.load(path, allow_pickle=False)
+        forest = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(forest, name, data[name])
+        forest.max_depth = int(data["max_depth"])
+        forest.n_outputs = forest.value.shape[1]
+        if "feature_names_in_" in data:
+            forest.feature_names_in_ = data["feature_names_in_"].astype(object)
+            forest.n_features_in_ = len(forest.feature_names_in_)
+        else:
+            forest.n_features_in_ = None
+        forest.source_model = None
+        return forest
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def _as_array(self, X):
+        if isinstance(X, pd.DataFrame):
+            if hasattr(self, "feature_names_in_"):
+                X = X[list(self.feature_names_in_)]
+            X = X.to_numpy(dtype=np.float64)
+        # sklearn trees compare float32-cast inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        return X
+
+    def apply(self, X):
+        """Leaf node index (into the flat arrays) for every tree x row."""
+        X = self._as_array(X)
+        n_rows = X.shape[0]
+        rows = np.tile(np.arange(n_rows), self.n_estimators)
+        node = np.repeat(self.roots, n_rows)
+
+        # Only keep walking (tree, row) pairs that haven't reached a leaf yet
+        active = np.flatnonzero(~self.is_leaf[node])
+        while active.size:
+            cur = node[active]
+            x = X[rows[active], self.feature[cur]]
+            go_left = np.where(np.isnan(x), self.missing_go_to_left[cur], x <= self.threshold[cur])
+            cur = np.where(go_left, self.left[cur], self.right[cur])
+            node[active] = cur
+            active = active[~self.is_leaf[cur]]
+
+        return node.reshape(self.n_estimators, n_rows)
+
+    def predict_trees(self, X):
+        """Per-tree predictions, shape (n_trees, n_rows) or (n_trees, n_rows, n_outputs)."""
+        out = self.value[self.apply(X)]
+        return out[..., 0] if self.n_outputs == 1 else out
+
+    def predict(self, X):
+        return self.predict_trees(X).mean(axis=0)
+
+
+def _missing_go_to_left(tree, n):
+    state = tree.__getstate__()
+    nodes = state.get("nodes")
+    if nodes is not None and "missing_go_to_left" in (nodes.dtype.names or ()):
+        return nodes["missing_go_to_left"].astype(bool)
+    return np.zeros(n, dtype=bool)
+
+
+def compile_forest(model):
+    return CompiledForest(model)
+
+
+def load_compiled(path="pm25_model.pkl"):
+    """Load a persisted forest and flatten it for array-based inference."""
+    return CompiledForest(load(path))
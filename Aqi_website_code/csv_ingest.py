@@ -0,0 +1,197 @@
+"""
+Chunked ingestion of hourly_data CSV exports for offline training.
+
+A full multi-year export doesn't fit in memory as one frame, so the file
+is read `chunk_rows` at a time with explicit dtypes (float32 pollutants,
+string station / city / timestamp) and each chunk is appended to a
+station-partitioned dataset on disk:
+
+    <out_dir>/meta.json        columns, stations, row counts, time range
+    <out_dir>/<nnnn>/<col>.bin one raw little-endian column per station
+
+Headers are normalised like the Mongo path: `pollutants.` prefixes (as
+mongoexport writes them) and unit suffixes are dropped, and spellings map
+onto mongo_loader.POLLUTANT_FIELDS, first non-null wins. A station
+partition reads back as a memory-mapped frame, so preprocessing only ever
+holds one station's raw rows (see preprocessing.preprocess_dataset).
+"""
+import json
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+from mongo_loader import POLLUTANT_FIELDS
+from telemetry import get_logger, StageClock
+
+log = get_logger("csv_ingest")
+
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "200000"))
+
+# Spellings beyond the Mongo sub-fields: the legacy rename_map's "PM2.5"
+EXTRA_ALIASES = {"PM2.5": "PM25"}
+
+_UNIT = re.compile(r"\s*\(.*\)\s*$")
+_TS_DTYPE = np.dtype("<i8")
+_VALUE_DTYPE = np.dtype("<f4")
+
+
+def _bare_name(header):
+    """Header without surrounding spaces, a `pollutants.` prefix or a unit suffix."""
+    name = str(header).strip()
+    if name.startswith("pollutants."):
+        name = name[len("pollutants."):]
+    return _UNIT.sub("", name)
+
+
+def column_plan(headers):
+    """
+    How to read a CSV with these headers: the timestamp / station / city
+    columns and, per output pollutant column, its source headers in
+    POLLUTANT_FIELDS order (then EXTRA_ALIASES).
+    """
+    bare = {}
+    for h in headers:
+        bare.setdefault(_bare_name(h), str(h))
+    ts = bare.get("timestamp") or bare.get("Timestamp")
+    if ts is None:
+        raise ValueError("❌ CSV has no 'timestamp' column.")
+
+    spellings = {col: list(keys) for col, keys in POLLUTANT_FIELDS.items()}
+    for key, col in EXTRA_ALIASES.items():
+        spellings[col].append(key)
+    pollutants = {col: [bare[k] for k in keys if k in bare] for col, keys in spellings.items()}
+    pollutants = {col: hs for col, hs in pollutants.items() if hs}
+    if "PM25" not in pollutants:
+        raise ValueError(f"❌ PM25 column missing from CSV. Columns: {list(headers)}")
+
+    return {"timestamp": ts, "station": bare.get("station"), "city": bare.get("city"), "pollutants": pollutants}
+
+
+def read_chunks(path, chunk_rows=CSV_CHUNK_ROWS, station=None):
+    """
+    Normalised frames of up to chunk_rows rows: Timestamp (UTC), station,
+    city and float32 pollutant columns. Rows without a parseable timestamp,
+    a station or a PM25 reading are dropped, as load_hourly_frame drops
+    them; `station` names the rows of a file without a station column.
+    """
+    plan = column_plan(pd.read_csv(path, nrows=0).columns)
+    if plan["station"] is None and station is None:
+        raise ValueError("❌ CSV has no 'station' column; pass the station its rows belong to.")
+    dtype = {plan["timestamp"]: "string"}
+    for key in ("station", "city"):
+        if plan[key]:
+            dtype[plan[key]] = "string"
+    for hs in plan["pollutants"].values():
+        dtype.update({h: "float32" for h in hs})
+
+    for chunk in pd.read_csv(path, usecols=list(dtype), dtype=dtype, chunksize=chunk_rows):
+        out = pd.DataFrame({
+            "Timestamp": pd.to_datetime(chunk[plan["timestamp"]], errors="coerce", utc=True),
+            "station": chunk[plan["station"]] if plan["station"] else station,
+            "city": chunk[plan["city"]] if plan["city"] else None,
+        })
+        for col, hs in plan["pollutants"].items():
+            values = chunk[hs[0]].to_numpy(dtype=np.float32, na_value=np.nan)
+            for h in hs[1:]:
+                values = np.where(np.isnan(values), chunk[h].to_numpy(dtype=np.float32, na_value=np.nan), values)
+            out[col] = values
+        yield out.dropna(subset=["Timestamp", "station", "PM25"])
+
+
+def ingest_csv(path, out_dir, chunk_rows=CSV_CHUNK_ROWS, station=None):
+    """
+    Stream the CSV at `path` into a station-partitioned dataset at out_dir
+    (replacing it). Peak memory is one chunk. Returns the dataset's meta.
+    """
+    clock = StageClock("csv_ingest")
+    tmp = f"{out_dir}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = list(column_plan(pd.read_csv(path, nrows=0).columns)["pollutants"])
+    stations, seen, chunks = {}, set(), 0
+    first = last = None
+    for chunk in read_chunks(path, chunk_rows, station):
+        chunks += 1
+        if chunk.empty:
+            continue
+        seen.update(c for c in columns if chunk[c].notna().any())
+        first = min(first, chunk["Timestamp"].min()) if first is not None else chunk["Timestamp"].min()
+        last = max(last, chunk["Timestamp"].max()) if last is not None else chunk["Timestamp"].max()
+
+        for name, rows in chunk.groupby("station", sort=False).indices.items():
+            entry = stations.get(name)
+            if entry is None:
+                entry = stations[name] = {"dir": f"{len(stations):04d}", "rows": 0, "city": None}
+                os.makedirs(os.path.join(tmp, entry["dir"]))
+            part = chunk.iloc[rows]
+            if entry["city"] is None and part["city"].notna().any():
+                entry["city"] = str(part["city"].dropna().iloc[0])
+
+            base = os.path.join(tmp, entry["dir"])
+            ts = part["Timestamp"].dt.as_unit("ns").dt.tz_localize(None).to_numpy().astype(_TS_DTYPE)
+            with open(os.path.join(base, "Timestamp.bin"), "ab") as f:
+                ts.tofile(f)
+            for col in columns:
+                with open(os.path.join(base, f"{col}.bin"), "ab") as f:
+                    part[col].to_numpy(dtype=_VALUE_DTYPE).tofile(f)
+            entry["rows"] += len(rows)
+        log.debug("🔹 Ingested chunk %d", chunks, extra={"rows": len(chunk), "stations": len(stations)})
+
+    meta = {
+        "source": os.path.abspath(path),
+        "chunk_rows": chunk_rows,
+        "rows": sum(e["rows"] for e in stations.values()),
+        # Columns that are empty throughout are left out, as the Mongo loader never allocates them
+        "columns": [c for c in columns if c in seen],
+        "stations": stations,
+        "first_timestamp": first.isoformat() if first is not None else None,
+        "last_timestamp": last.isoformat() if last is not None else None,
+        "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp, out_dir)
+    seconds = clock.done()
+    log.info("✅ CSV ingested", extra={"rows": meta["rows"], "stations": len(stations), "chunks": chunks,
+                                      "seconds": round(seconds, 3)})
+    return meta
+
+
+def read_dataset_meta(out_dir):
+    with open(os.path.join(out_dir, "meta.json")) as f:
+        return json.load(f)
+
+
+def read_partition(out_dir, station, meta=None, mmap=True):
+    """
+    One station's raw rows from an ingested dataset in the layout
+    load_data_from_mongo returns (newest first), columns memory-mapped.
+    """
+    meta = meta or read_dataset_meta(out_dir)
+    entry = meta["stations"][station]
+    base = os.path.join(out_dir, entry["dir"])
+
+    def column(name, dtype):
+        file = os.path.join(base, f"{name}.bin")
+        if not entry["rows"]:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file, dtype=dtype, mode="r") if mmap else np.fromfile(file, dtype=dtype)
+
+    data = {"Timestamp": pd.DatetimeIndex(column("Timestamp", _TS_DTYPE).view("datetime64[ns]")).tz_localize("UTC")}
+    data["station"] = station
+    data["city"] = entry["city"]
+    for col in meta["columns"]:
+        data[col] = column(col, _VALUE_DTYPE)
+    df = pd.DataFrame(data)
+    return df.sort_values("Timestamp", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def iter_partitions(out_dir):
+    """(station, raw frame) for every station of an ingested dataset, one at a time."""
+    meta = read_dataset_meta(out_dir)
+    for station in sorted(meta["stations"]):
+        yield station, read_partition(out_dir, station, meta)
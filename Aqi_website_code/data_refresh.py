@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from preprocessing import preprocess_data, preprocess_tail
+from station_store import carry_store
+from telemetry import get_logger, stage
+
+log = get_logger("data_refresh")
+
+
+class DataRefresher:
+    """
+    Keeps STATE["df"] current by pulling only rows from the last seen raw
+    `timestamp` (the watermark) on and appending them with preprocess_tail,
+    which skips the ones already processed.
+
+    `fetch(since)` returns a raw frame like load_data_from_mongo, with the
+    newest raw timestamp in attrs["watermark"]; pass a closure over a local
+    collection (e.g. mongomock) to exercise it without a real Mongo.
+    `postprocess` is applied to every new frame before it is published.
+    """
+
+    def __init__(self, state, fetch, max_rows=None, postprocess=None):
+        self.state = state
+        self.fetch = fetch
+        self.max_rows = max_rows
+        self.postprocess = postprocess
+        self._lock = threading.Lock()
+        self.last_attempt = None
+        self.last_success = None
+        self.last_rows_added = 0
+        self.last_error = None
+
+    def refresh_once(self):
+        """Fetch and append new rows; returns the number of rows added."""
+        with self._lock:
+            self.last_attempt = time.time()
+            try:
+                with stage("data_refresh"):
+                    added = self._refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            self.last_success = time.time()
+            self.last_rows_added = added
+            self.last_error = None
+            return added
+
+    def _refresh(self):
+        current = self.state["df"]
+        watermark = self.state.get("watermark")
+
+        if current is None or current.empty:
+            raw = self.fetch(None)
+            if raw.empty:
+                return 0
+            df = preprocess_data(raw)
+        else:
+            raw = self.fetch(watermark)
+            if raw.empty:
+                return 0
+            df = preprocess_tail(current, raw, max_rows=self.max_rows)
+            if df is current:
+                return 0  # only the watermark hour again, nothing new
+
+        if self.postprocess is not None:
+            df = self.postprocess(df)
+
+        added = len(df) - (0 if current is None else len(current))
+        # Forecast seeds for the new frame: the old ring buffers plus the rows that arrived
+        carry_store(current, df)
+
+        # Single assignments: readers see either the old or the new frame
+        self.state["df"] = df
+        if raw.attrs.get("watermark") is not None:
+            self.state["watermark"] = raw.attrs["watermark"]
+
+        log.info("✅ Data refresh: +%d rows", added, extra={"watermark": self.state.get("watermark")})
+        return added
+
+    def status(self):
+        now = time.time()
+        df = self.state["df"]
+        latest = df["Timestamp"].max() if df is not None and not df.empty else None
+        return {
+            "watermark": str(self.state.get("watermark")) if self.state.get("watermark") is not None else None,
+            "latest_timestamp": str(latest) if latest is not None else None,
+            "last_attempt": datetime.fromtimestamp(self.last_attempt).isoformat() if self.last_attempt else None,
+            "last_success": datetime.fromtimestamp(self.last_success).isoformat() if self.last_success else None,
+            "refresh_lag_seconds": round(now - self.last_success, 1) if self.last_success else None,
+            "rows_added_last": self.last_rows_added,
+            "last_error": self.last_error,
+        }
+
+
+async def run_refresher(refresher, interval_seconds=300, initial_delay=None):
+    """Call refresher.refresh_once every interval until cancelled."""
+    delay = interval_seconds if initial_delay is None else initial_delay
+    while True:
+        await asyncio.sleep(delay)
+        delay = interval_seconds
+        try:
+            await asyncio.to_thread(refresher.refresh_once)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("⚠️ Data refresh failed: %s", e)
@@ -0,0 +1,348 @@
+"""
+Rolling-window PM25 features (rolling mean / max, EWMA) and the per-station
+state behind them.
+
+Training and serving compute the same numbers two ways. preprocess_data
+builds whole columns at once with pandas, and the forecasting loop
+advances one StationState per forecast row, one O(1) push per predicted
+hour. A feature at row t only sees the station's values before t, just as
+the lags do, so a state that has consumed a station's history yields the
+features of its next hour.
+
+The state that preprocessing ends with travels in df.attrs["feature_state"]
+as plain lists, so it survives snapshots and lets preprocess_tail and the
+forecasts carry on from where the batch pass stopped.
+"""
+import math
+from collections import deque
+import numpy as np
+import pandas as pd
+
+
+class RollingMean:
+    """Mean of the last `window` values: running sum over a ring buffer."""
+
+    __slots__ = ("window", "buf", "total", "pushes")
+    # Re-sum the buffer now and then so the running total can't drift
+    RESUM_EVERY = 1024
+
+    def __init__(self, window):
+        self.window = window
+        self.buf = deque(maxlen=window)
+        self.total = 0.0
+        self.pushes = 0
+
+    def push(self, x):
+        if len(self.buf) == self.window:
+            self.total -= self.buf[0]
+        self.buf.append(x)
+        self.total += x
+        self.pushes += 1
+        if self.pushes % self.RESUM_EVERY == 0:
+            self.total = math.fsum(self.buf)
+
+    def value(self):
+        return self.total / len(self.buf) if self.buf else math.nan
+
+    @staticmethod
+    def batch(s, window):
+        return s.shift(1).rolling(window, min_periods=1).mean()
+
+    def dump(self):
+        return list(self.buf)
+
+    def load(self, data):
+        for x in data:
+            self.push(x)
+
+
+class RollingMax:
+    """Max of the last `window` values: monotonic deque, amortised O(1)."""
+
+    __slots__ = ("window", "dq", "t")
+
+    def __init__(self, window):
+        self.window = window
+        self.dq = deque()  # (push number, value), values decreasing
+        self.t = 0
+
+    def push(self, x):
+        self.t += 1
+        while self.dq and self.dq[-1][1] <= x:
+            self.dq.pop()
+        self.dq.append((self.t, x))
+        if self.dq[0][0] <= self.t - self.window:
+            self.dq.popleft()
+
+    def value(self):
+        return self.dq[0][1] if self.dq else math.nan
+
+    @staticmethod
+    def batch(s, window):
+        return s.shift(1).rolling(window, min_periods=1).max()
+
+    def dump(self):
+        # Ages relative to the newest push, so the counter needn't be stored
+        return [[self.t - t, x] for t, x in self.dq]
+
+    def load(self, data):
+        self.t = self.window
+        self.dq = deque((self.t - age, x) for age, x in data)
+
+
+class EWMean:
+    """Exponentially weighted mean with alpha = 2 / (span + 1), pandas' adjust=False."""
+
+    __slots__ = ("alpha", "mean")
+
+    def __init__(self, span):
+        self.alpha = 2.0 / (span + 1)
+        self.mean = math.nan
+
+    def push(self, x):
+        self.mean = x if math.isnan(self.mean) else self.mean + self.alpha * (x - self.mean)
+
+    def value(self):
+        return self.mean
+
+    @staticmethod
+    def batch(s, span):
+        return s.ewm(span=span, adjust=False).mean().shift(1)
+
+    def dump(self):
+        return [self.mean]
+
+    def load(self, data):
+        self.mean = data[0]
+
+
+# feature column → (kernel, window in rows); rows are hours of one station
+ROLLING_FEATURES = {
+    "roll_mean_24h": (RollingMean, 24),
+    "roll_max_24h": (RollingMax, 24),
+    "ewm_12h": (EWMean, 12),
+}
+
+
+class StationState:
+    """One station's kernels; push() the next value, features() for the hour after it."""
+
+    __slots__ = ("kernels",)
+
+    def __init__(self, specs=ROLLING_FEATURES):
+        self.kernels = {name: kernel(param) for name, (kernel, param) in specs.items()}
+
+    def push(self, x):
+        x = float(x)
+        if math.isnan(x):
+            return
+        for kernel in self.kernels.values():
+            kernel.push(x)
+
+    def extend(self, values):
+        for x in values:
+            self.push(x)
+
+    def features(self):
+        return {name: kernel.value() for name, kernel in self.kernels.items()}
+
+    def dump(self):
+        return {name: kernel.dump() for name, kernel in self.kernels.items()}
+
+    @classmethod
+    def restore(cls, data, specs=ROLLING_FEATURES):
+        state = cls(specs)
+        for name, kernel in state.kernels.items():
+            if name in data:
+                kernel.load(data[name])
+        return state
+
+
+class _Shared(dict):
+    """
+    attrs payload handed between frames as is: pandas deep-copies attrs on
+    every derived frame (each column access included), and nothing mutates
+    these dicts in place.
+    """
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FeatureState:
+    """
+    StationState per station, stored as dump() dicts (JSON-friendly) and
+    rebuilt on demand, so each caller of station() gets its own copy to
+    advance. Frames without a station column use the key "".
+    """
+
+    def __init__(self, stations=None, specs=ROLLING_FEATURES):
+        self.specs = specs
+        self.stations = dict(stations or {})
+
+    def station(self, name):
+        return StationState.restore(self.stations.get(_key(name), {}), self.specs)
+
+    def advance(self, name, values):
+        state = self.station(name)
+        state.extend(values)
+        self.stations[_key(name)] = state.dump()
+        return state
+
+    def to_attrs(self):
+        return _Shared(features=list(self.specs), stations=dict(self.stations))
+
+    @classmethod
+    def from_attrs(cls, data):
+        if not data or list(data.get("features", [])) != list(ROLLING_FEATURES):
+            return None
+        return cls(data.get("stations"))
+
+
+def _key(name):
+    return "" if name is None else str(name)
+
+
+def _seed(values, specs):
+    """StationState after a station's whole history, without pushing every value."""
+    state = StationState(specs)
+    for name, (kernel, param) in specs.items():
+        k = state.kernels[name]
+        if isinstance(k, EWMean):
+            if len(values):
+                k.mean = float(pd.Series(values).ewm(span=param, adjust=False).mean().iloc[-1])
+        else:
+            for x in values[-param:]:
+                k.push(float(x))
+    return state
+
+
+def _groups(df, by):
+    if by is not None and by in df.columns:
+        return df.groupby(by, sort=False).indices.items()
+    return [("", np.arange(len(df)))]
+
+
+def add_rolling_features(df, col="PM25", by="station", specs=ROLLING_FEATURES):
+    """
+    Write the rolling feature columns into `df` (rows in time order, grouped
+    by `by` when present) and return the FeatureState after its last row.
+    """
+    values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+    out = {name: np.full(len(df), np.nan) for name in specs}
+    state = FeatureState(specs=specs)
+
+    for station, rows in _groups(df, by):
+        s = pd.Series(values[rows]).dropna()
+        kept = rows[s.index.to_numpy()]
+        for name, (kernel, param) in specs.items():
+            out[name][kept] = kernel.batch(s, param).to_numpy()
+        state.stations[_key(station)] = _seed(s.to_numpy(), specs).dump()
+
+    for name, column in out.items():
+        df[name] = column
+    return state
+
+
+def advance_rows(df, state, col="PM25", by="station"):
+    """
+    Incremental counterpart of add_rolling_features for rows appended after
+    the ones `state` has seen: features come from the state, then each value
+    is pushed. O(1) per row; updates `state` in place.
+    """
+    out = {name: np.full(len(df), np.nan) for name in state.specs}
+    values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+    for station, rows in _groups(df, by):
+        st = state.station(station)
+        for i in rows:
+            for name, value in st.features().items():
+                out[name][i] = value
+            st.push(values[i])
+        state.stations[_key(station)] = st.dump()
+
+    for name, column in out.items():
+        df[name] = column
+    return state
+
+
+def state_for_frame(df, col="PM25"):
+    """
+    FeatureState for a preprocessed frame: from attrs when preprocessing
+    left one, otherwise rebuilt from the frame's history (once; it is then
+    kept in attrs).
+    """
+    data = df.attrs.get("feature_state")
+    state = FeatureState.from_attrs(data)
+    if state is not None and not isinstance(data, _Shared):
+        # Loaded from a snapshot as a plain dict; swap in the shareable form
+        df.attrs["feature_state"] = state.to_attrs()
+    if state is None:
+        state = FeatureState()
+        if col in df.columns:
+            by = "station_original" if "station_original" in df.columns else None
+            for station, rows in _groups(df, by):
+                s = pd.to_numeric(df[col].iloc[rows], errors="coerce").dropna().to_numpy(dtype=np.float64)
+                state.stations[_key(station)] = _seed(s, state.specs).dump()
+        df.attrs["feature_state"] = state.to_attrs()
+    return state
+
+
+def history_state(df, i, col="PM25"):
+    """StationState of row i's station after every value up to and including row i."""
+    mask = np.arange(len(df)) <= i
+    if "station_original" in df.columns:
+        mask &= (df["station_original"] == df["station_original"].iloc[i]).to_numpy()
+    values = pd.to_numeric(df[col][mask], errors="coerce").dropna().to_numpy(dtype=np.float64)
+    return _seed(values, ROLLING_FEATURES)
+
+
+def states_at(df, rows, col="PM25", specs=ROLLING_FEATURES):
+    """
+    history_state for many rows at once. Rolling windows only need the
+    station's last `window` values, and the EWMA before row i is already in
+    the frame's own column, so each state costs O(window) rather than a
+    pass over the station's history.
+    """
+    values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+    by = "station_original" if "station_original" in df.columns else None
+    position = {}
+    for _, pos in _groups(df, by):
+        pos = pos[np.isfinite(values[pos])]
+        for k, r in enumerate(pos):
+            position[r] = (pos, k)
+
+    out = []
+    for r in rows:
+        state = StationState(specs)
+        if r not in position:
+            out.append(state)
+            continue
+        pos, k = position[r]
+        for name, (kernel, param) in specs.items():
+            kern = state.kernels[name]
+            if isinstance(kern, EWMean):
+                before = float(df[name].iat[r]) if k and name in df.columns else math.nan
+                if k and math.isnan(before):
+                    # Column missing: fall back to the full recursion
+                    before = _seed(values[pos[:k]], {name: (kernel, param)}).kernels[name].mean
+                kern.mean = before
+                kern.push(values[r])
+            else:
+                for x in values[pos[max(0, k - param + 1):k + 1]]:
+                    kern.push(float(x))
+        out.append(state)
+    return out
+
+
+def write_features(X, positions, states):
+    """Write each row's current rolling features into X (positions: name → column)."""
+    for r, st in enumerate(states):
+        for name, value in st.features().items():
+            j = positions.get(name)
+            if j is not None:
+                X[r, j] = value
+
+
+def push_all(states, y_pred):
+    for st, y in zip(states, y_pred):
+        st.push(y)
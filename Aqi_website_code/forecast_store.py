@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+import pandas as pd
+from datetime import datetime
+from forecasting import forecast_batch, list_stations, get_station_column
+from telemetry import get_logger, stage
+
+log = get_logger("forecast_store")
+
+
+class ForecastStore:
+    """
+    Versioned in-memory store of precomputed forecasts.
+
+    Each publish replaces the whole snapshot at once, tagged with the df and
+    model objects it was computed from, so readers never see a half-built
+    store and can tell when the snapshot no longer matches STATE.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.version = 0
+
+    def publish(self, forecasts, horizon, base_time, df, model):
+        with self._lock:
+            self.version += 1
+            self._snapshot = {
+                "version": self.version,
+                "forecasts": forecasts,
+                "horizon": horizon,
+                "base_time": base_time,
+                "generated_at": time.time(),
+                "df": df,
+                "model": model,
+            }
+
+    def needs_refresh(self, df, model, now=None):
+        """True when the hour ticked over or STATE's df/model were replaced."""
+        snap = self._snapshot
+        if snap is None:
+            return True
+        if snap["df"] is not df or snap["model"] is not model:
+            return True
+        return _current_hour(now) > snap["base_time"]
+
+    def lookup(self, station_col, hours, df, model, max_age_hours=2, now=None):
+        """
+        Return (records, meta) for station_col sliced to `hours`, or None on a
+        miss (unknown station, horizon too long, or snapshot from other data).
+        """
+        snap = self._snapshot
+        if snap is None or station_col not in snap["forecasts"]:
+            return None
+        if snap["df"] is not df or snap["model"] is not model:
+            return None
+        if hours > snap["horizon"]:
+            return None
+
+        current = _current_hour(now)
+        lag_hours = (current - snap["base_time"]) / pd.Timedelta(hours=1)
+        if lag_hours > max_age_hours:
+            return None
+
+        meta = {
+            "source": "precomputed",
+            "version": snap["version"],
+            "base_time": str(snap["base_time"]),
+            "generated_at": datetime.fromtimestamp(snap["generated_at"]).isoformat(),
+            "age_seconds": round(time.time() - snap["generated_at"], 1),
+            "stale": lag_hours > 0,
+        }
+        return snap["forecasts"][station_col][:hours], meta
+
+    def info(self):
+        snap = self._snapshot
+        if snap is None:
+            return {"version": 0, "stations": 0}
+        return {
+            "version": snap["version"],
+            "stations": len(snap["forecasts"]),
+            "horizon": snap["horizon"],
+            "base_time": str(snap["base_time"]),
+            "age_seconds": round(time.time() - snap["generated_at"], 1),
+        }
+
+
+def _current_hour(now=None):
+    return pd.Timestamp(now if now is not None else datetime.now()).floor("h")
+
+
+def refresh_forecasts(store, state, horizon=72, now=None):
+    """Precompute forecasts for every known station and publish them."""
+    df, model = state["df"], state["model"]
+    if df is None or df.empty or model is None:
+        return False
+
+    base_time = _current_hour(now)
+    stations = list_stations(df)
+    with stage("forecast.precompute"):
+        out = forecast_batch(df, model, stations, target_col="PM25",
+                             hours=horizon, start_time=base_time)
+
+    # Keyed by one-hot column so any alias that resolves to it hits the store
+    forecasts = {}
+    for station in stations:
+        station_col = get_station_column(df, station)
+        forecasts[station_col] = out[station].to_dict(orient="records")
+
+    store.publish(forecasts, horizon, base_time, df, model)
+    log.info("✅ Precomputed forecasts v%d for %d stations", store.version, len(forecasts))
+    return True
+
+
+async def run_scheduler(store, state, horizon=72, poll_seconds=30):
+    """
+    Keep the store current: recompute at the top of each hour and whenever
+    STATE["df"] or STATE["model"] is replaced. Runs until cancelled.
+    """
+    while True:
+        try:
+            if store.needs_refresh(state["df"], state["model"]):
+                await asyncio.to_thread(refresh_forecasts, store, state, horizon)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("⚠️ Forecast precompute failed: %s", e)
+        await asyncio.sleep(poll_seconds)
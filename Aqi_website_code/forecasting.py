@@ -1,128 +1,433 @@
 import pandas as pd
 from datetime import timedelta
-import difflib
+import time
+import warnings
+import weakref
+import numpy as np
+from preprocessing import MONTH_WEIGHTS, HOUR_WEIGHTS
+from station_index import station_index_for
+from compact import feature_matrix
+from telemetry import STAGE_SECONDS
+from feature_state import ROLLING_FEATURES, state_for_frame, history_state, write_features, push_all
+from compiled_forest import compile_forest
+from station_store import store_for
 
-def forecast_next_days(df, model, target_col="PM25", hours=72, station=None, start_time=None):
+
+def get_station_column(df, station_name: str):
+    """Return the one-hot column name matching station_name, or None.
+
+    Matching is case-insensitive and ignores spacing and punctuation; known
+    aliases and close typos resolve through the frame's StationIndex.
     """
-    Forecast next 'hours' of air quality data for a given station.
-    Works with one-hot encoded station columns and preserved 'station_original'.
+    if station_name is None:
+        return None
+    return station_index_for(df).column(station_name)
+
+
+def resolve_feature_layout(df, model, target_col="PM25"):
+    """
+    Resolve the model's feature order once, plus the column positions the
+    recursive loop writes to (lag slots and calendar features).
+    """
+    drop_cols = ["Timestamp", "_id", "city", "timestamp", target_col, "station_original"]
+
+    if hasattr(model, "feature_names_in_"):
+        feature_names = list(model.feature_names_in_)
+    else:
+        feature_names = [c for c in df.drop(columns=drop_cols, errors="ignore")
+                                      .select_dtypes(include=["number"]).columns]
+
+    position = {name: i for i, name in enumerate(feature_names)}
+    slots = ("lag_1d", "lag_2d", "lag_3d", "hour", "day_of_week", "month",
+             "PM25_month_weight", "PM25_hour_weight")
+
+    return {
+        "feature_names": feature_names,
+        "position": position,
+        "drop_cols": drop_cols,
+        # Rolling-window features this model uses; empty for models trained without them
+        "rolling": {name: position[name] for name in ROLLING_FEATURES if name in position},
+        **{slot: position.get(slot) for slot in slots},
+    }
+
+
+def _station_name(station_col):
+    return station_col[len("station_"):] if station_col else None
+
+
+def _seed_matrix(rows, layout, station_cols):
+    """Clear every station one-hot (and dropped column) in `rows`, then switch on each row's own station."""
+    X = np.array(rows, dtype=np.float64, ndmin=2)
+    for i, name in enumerate(layout["feature_names"]):
+        if name.startswith("station_") or name in layout["drop_cols"]:
+            X[:, i] = 0
+    for i, station_col in enumerate(station_cols):
+        j = layout["position"].get(station_col)
+        if j is not None:
+            X[i, j] = 1
+    return X
+
+
+def seed_features(df, layout, station_cols):
+    """
+    Build the (n_stations x n_features) starting matrix, one row per station
+    from that station's newest hour in the frame's StationStore, with every
+    station one-hot cleared and each row's own station switched on. With no
+    station the frame's latest row is used. A station the store has no rows
+    for falls back to the latest row too.
     """
+    store = store_for(df)
+    names = layout["feature_names"]
+    fallback = store.seed(names)
+    if fallback is None:
+        fallback = feature_matrix(df.iloc[-1:], names, dtype=np.float64)[0]
+    if not station_cols:
+        return _seed_matrix([fallback], layout, [])
+    rows = []
+    for station_col in station_cols:
+        row = store.seed(names, _station_name(station_col))
+        rows.append(fallback if row is None else row)
+    return _seed_matrix(rows, layout, station_cols)
 
-    def get_station_column(df, station_name: str):
-        """Return the one-hot column name matching station_name, or None.
-
-        Matching is case-insensitive and ignores extra spaces. Uses difflib
-        to find the closest one-hot column if an exact match is not present.
-        """
-        if station_name is None:
-            return None
-        normalized = " ".join(station_name.strip().split()).lower()
-        if "station_original" in df.columns:
-            candidates = pd.Series(df["station_original"].unique()).astype(str)
-            candidates_norm = candidates.str.strip().str.lower()
-            
-            exact_idx = candidates_norm[candidates_norm == normalized]
-            if not exact_idx.empty:
-                orig = candidates.iloc[exact_idx.index[0]]
-                return f"station_{orig}"
-    
-            best = difflib.get_close_matches(normalized, candidates_norm.tolist(), n=1, cutoff=0.7)
-            if best:
-                
-                idx = candidates_norm[candidates_norm == best[0]].index[0]
-                return f"station_{candidates.iloc[idx]}"
-        
-        col_candidate = f"station_{station_name}"
-        if col_candidate in df.columns:
-            return col_candidate
-        
-        for c in df.columns:
-            if c.lower() == col_candidate.lower():
-                return c
+
+def seed_states(df, layout, station_cols):
+    """
+    One feature_state.StationState per seed row (same order as
+    seed_features), each a private copy the forecast can advance; None when
+    the model uses no rolling features. With no station the latest row's
+    station is used, since that is the row the seed comes from.
+    """
+    if not layout["rolling"]:
         return None
+    state = state_for_frame(df)
+    if not station_cols:
+        last = df["station_original"].iloc[-1] if "station_original" in df.columns and len(df) else None
+        return [state.station(last)]
+    return [state.station(_station_name(col)) for col in station_cols]
+
+
+def _set_time_features(X, layout, ts):
+    """Write the calendar features for target time `ts` into every row of X."""
+    values = {
+        "hour": ts.hour,
+        "day_of_week": ts.dayofweek,
+        "month": ts.month,
+        "PM25_month_weight": MONTH_WEIGHTS[ts.month],
+        "PM25_hour_weight": HOUR_WEIGHTS[ts.hour],
+    }
+    for name, value in values.items():
+        j = layout[name]
+        if j is not None:
+            X[:, j] = value
+
+
+def _shift_lags(X, layout, y_pred):
+    """Feed predictions back into the lag slots, oldest first."""
+    lag_1d, lag_2d, lag_3d = layout["lag_1d"], layout["lag_2d"], layout["lag_3d"]
+    if lag_3d is not None:
+        X[:, lag_3d] = X[:, lag_2d] if lag_2d is not None else y_pred
+    if lag_2d is not None:
+        X[:, lag_2d] = X[:, lag_1d] if lag_1d is not None else y_pred
+    if lag_1d is not None:
+        X[:, lag_1d] = y_pred
+
+
+def _predict(model, X):
+    # X is a bare array in the model's feature order; skip the name check warning
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        return model.predict(X)
+
+
+_COMPILED_CACHE = {}
+
+
+def compiled_for(model):
+    """
+    CompiledForest for `model`, flattened on first use and reused while the
+    model object is alive; the model itself when it already is one. Raises
+    TypeError for models that aren't averaged tree ensembles.
+    """
+    if hasattr(model, "predict_trees"):
+        return model
+    entry = _COMPILED_CACHE.get(id(model))
+    if entry is not None and entry[0]() is model:
+        return entry[1]
+    forest = compile_forest(model)
+    _COMPILED_CACHE[id(model)] = (weakref.ref(model), forest)
+    for key in [k for k, (ref, _) in _COMPILED_CACHE.items() if ref() is None]:
+        del _COMPILED_CACHE[key]
+    return forest
+
+
+def supports_quantiles(model):
+    try:
+        compiled_for(model)
+    except TypeError:
+        return False
+    return True
+
+
+def quantile_columns(target_col, quantiles):
+    """Output column per quantile: 0.1 → PM25_p10, 0.025 → PM25_p2.5."""
+    return [f"{target_col}_p{q * 100:g}" for q in quantiles]
+
+
+def _predict_bands(model, X, quantiles):
+    """Mean and quantiles over every tree's prediction, from one vectorised pass."""
+    trees = compiled_for(model).predict_trees(X)
+    return trees.mean(axis=0), np.quantile(trees, quantiles, axis=0)
+
+
+def run_horizon(model, X, layout, timestamps, states=None):
+    """
+    Recursive forecast core: one predict per step on X, updated in place.
+    `states` (from seed_states) are advanced with each step's predictions
+    to fill the rolling features. Returns a (len(timestamps) x n_rows)
+    array of predictions.
+    """
+    preds = np.empty((len(timestamps), X.shape[0]))
+    for i, (_, y_pred, _) in enumerate(iter_horizon(model, X, layout, timestamps, states)):
+        preds[i] = y_pred
+    return preds
+
+
+def iter_horizon(model, X, layout, timestamps, states=None, quantiles=None):
+    """
+    run_horizon one step at a time: yields (timestamp, predictions, bands)
+    as soon as each step exists. `timestamps` may be a lazy iterable.
+
+    With `quantiles`, each step reads every tree's output in one pass
+    (compiled_for) and bands is their (len(quantiles) x n_rows) quantiles;
+    the mean is what feeds back into the lags, as in the point forecast.
+    Without, bands is None.
+    """
+    bands = None
+    for ts in timestamps:
+        _set_time_features(X, layout, ts)
+        if states:
+            write_features(X, layout["rolling"], states)
+        start = time.perf_counter()
+        if quantiles:
+            y_pred, bands = _predict_bands(model, X, quantiles)
+        else:
+            y_pred = _predict(model, X)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="forecast.predict_step")
+        _shift_lags(X, layout, y_pred)
+        if states:
+            push_all(states, y_pred)
+        yield ts, y_pred, bands
+
+
+def run_origins(model, X, layout, origins, hours, states=None):
+    """
+    run_horizon for rows that each start at their own time: row r of X is
+    the seed at origins[r], so the calendar features differ per row. Still
+    one predict per step for all rows. Returns (hours x n_rows).
+    """
+    origins = pd.DatetimeIndex(origins)
+    month_weight = np.array([MONTH_WEIGHTS[m] for m in range(1, 13)])
+    hour_weight = np.array([HOUR_WEIGHTS[h] for h in range(24)])
+    preds = np.empty((hours, X.shape[0]))
+    for h in range(hours):
+        ts = origins + pd.Timedelta(hours=h + 1)
+        hour, month = ts.hour.to_numpy(), ts.month.to_numpy()
+        values = {
+            "hour": hour,
+            "day_of_week": ts.dayofweek.to_numpy(),
+            "month": month,
+            "PM25_month_weight": month_weight[month - 1],
+            "PM25_hour_weight": hour_weight[hour],
+        }
+        for name, value in values.items():
+            if layout[name] is not None:
+                X[:, layout[name]] = value
+        if states:
+            write_features(X, layout["rolling"], states)
+        y_pred = _predict(model, X)
+        _shift_lags(X, layout, y_pred)
+        if states:
+            push_all(states, y_pred)
+        preds[h] = y_pred
+    return preds
+
+
+def _forecast_start(df, start_time):
+    if start_time is not None:
+        return pd.to_datetime(start_time)
+    if "Timestamp" in df.columns:
+        return df["Timestamp"].max()
+    return pd.Timestamp.now(tz="UTC")
 
-    # if station is not None:
-    #     station_col = get_station_column(df, station)
-    #     if station_col is None:
-    #         raise ValueError(f"Station '{station}' not found in data (no matching one-hot column or station_original entry)")
-        
-    #     df_station = df[df.get(station_col, 0) == 1]
-    #     if df_station.empty:
-    #         raise ValueError(f"No data available for station '{station}' after filtering")
-    #     df = df_station
 
+def forecast_next_days(df, model, target_col="PM25", hours=72, station=None, start_time=None, quantiles=None):
+    """
+    Forecast next 'hours' of air quality data for a given station.
+    Works with one-hot encoded station columns and preserved 'station_original'.
+    With `quantiles` (e.g. [0.1, 0.5, 0.9]) and a tree ensemble, adds a
+    PM25_p10 / _p50 / _p90 column per quantile of the trees' predictions.
+    """
+    station_col = None
     if station is not None:
         station_col = get_station_column(df, station)
         if station_col is None:
             raise ValueError(f"Station '{station}' not found in data")
 
-        
+    if df.empty:
+        raise ValueError("No data available for forecasting.")
+
+    layout = resolve_feature_layout(df, model, target_col)
+    X = seed_features(df, layout, [station_col] if station_col else [])
+    states = seed_states(df, layout, [station_col] if station_col else [])
+
+    last_timestamp = _forecast_start(df, start_time)
+    timestamps = [last_timestamp + pd.Timedelta(hours=i + 1) for i in range(hours)]
+    if not quantiles:
+        preds = run_horizon(model, X, layout, timestamps, states)
+        return pd.DataFrame({
+            "Timestamp": [str(ts) for ts in timestamps],
+            target_col: preds[:, 0].astype(float),
+            "station": station,
+        }, columns=["Timestamp", target_col, "station"])
+
+    steps = list(iter_horizon(model, X, layout, timestamps, states, quantiles))
+    out = pd.DataFrame({
+        "Timestamp": [str(ts) for ts in timestamps],
+        target_col: np.array([y_pred[0] for _, y_pred, _ in steps], dtype=float),
+        "station": station,
+    }, columns=["Timestamp", target_col, "station"])
+    bands = np.array([b[:, 0] for _, _, b in steps], dtype=float)
+    for j, name in enumerate(quantile_columns(target_col, quantiles)):
+        out[name] = bands[:, j]
+    return out
+
+
+def iter_forecast(df, model, target_col="PM25", hours=72, station=None, start_time=None, quantiles=None):
+    """
+    forecast_next_days as a generator of records, one per step, so callers
+    can stream long horizons and stop early without computing the rest.
+    """
+    station_col = None
+    if station is not None:
+        station_col = get_station_column(df, station)
+        if station_col is None:
+            raise ValueError(f"Station '{station}' not found in data")
 
     if df.empty:
         raise ValueError("No data available for forecasting.")
 
-    latest_row = df.iloc[-1:].copy()
-    # ✅ Reset all station one-hot columns
-    for c in latest_row.columns:
-        if c.startswith("station_"):
-            latest_row[c] = 0
+    layout = resolve_feature_layout(df, model, target_col)
+    X = seed_features(df, layout, [station_col] if station_col else [])
+    states = seed_states(df, layout, [station_col] if station_col else [])
+
+    last_timestamp = _forecast_start(df, start_time)
+    # Timestamps are generated lazily too, so an abandoned month-long stream costs nothing
+    timestamps = (last_timestamp + pd.Timedelta(hours=i + 1) for i in range(hours))
+    names = quantile_columns(target_col, quantiles) if quantiles else []
+    for ts, y_pred, bands in iter_horizon(model, X, layout, timestamps, states, quantiles):
+        record = {"Timestamp": str(ts), target_col: float(y_pred[0]), "station": station}
+        for j, name in enumerate(names):
+            record[name] = float(bands[j, 0])
+        yield record
+
 
-    # ✅ Activate requested station
+def forecast_direct(df, model, target_col="PM25", hours=72, station=None, start_time=None):
+    """
+    forecast_next_days for a modeling.DirectForecaster: the whole horizon
+    comes from one predict on the seed row, with the calendar features of
+    the forecast origin (what the direct models were trained on).
+    """
+    if hours > model.hours:
+        raise ValueError(f"Direct model covers {model.hours}h, {hours}h requested")
+
+    station_col = None
     if station is not None:
-        latest_row[station_col] = 1
-        
-    last_timestamp = (
-        pd.to_datetime(start_time)
-        if start_time is not None
-        else df["Timestamp"].max() if "Timestamp" in df.columns else pd.Timestamp.now(tz="UTC")
-    )
+        station_col = get_station_column(df, station)
+        if station_col is None:
+            raise ValueError(f"Station '{station}' not found in data")
 
+    if df.empty:
+        raise ValueError("No data available for forecasting.")
 
-    drop_cols = ["Timestamp", "_id", "city", "timestamp", target_col, "station_original"]
+    layout = resolve_feature_layout(df, model, target_col)
+    X = seed_features(df, layout, [station_col] if station_col else [])
+    origin = _forecast_start(df, start_time)
+    _set_time_features(X, layout, origin)
 
-    if hasattr(model, "feature_names_in_"):
-        feature_names = list(model.feature_names_in_)
-    else:
-        feature_names = latest_row.drop(columns=drop_cols, errors="ignore") \
-                                  .select_dtypes(include=["number"]) \
-                                  .columns.tolist()
+    start = time.perf_counter()
+    preds = model.predict(X)[0, :hours]
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="forecast.direct_predict")
 
-    X_latest = latest_row.drop(columns=drop_cols, errors="ignore")
+    return pd.DataFrame({
+        "Timestamp": [str(origin + pd.Timedelta(hours=i + 1)) for i in range(hours)],
+        target_col: preds.astype(float),
+        "station": station,
+    }, columns=["Timestamp", target_col, "station"])
 
-   
-    for col in feature_names:
-        if col not in X_latest.columns:
-            X_latest[col] = 0
 
-    X_latest = X_latest[feature_names]
+def _row_seed(df, i, layout):
+    """Seed matrix from row i (not the latest row), with that row's own station."""
+    row = df.iloc[i:i + 1]
+    station_cols = []
+    if "station_original" in row.columns:
+        station_cols = [f"station_{row['station_original'].iloc[0]}"]
+    return _seed_matrix(feature_matrix(row, layout["feature_names"], dtype=np.float64), layout, station_cols)
 
 
-    forecasts = []
-    for i in range(hours):
-        y_pred = float(model.predict(X_latest)[0])
-        next_timestamp = last_timestamp + pd.Timedelta(hours=i + 1)
+def forecast_from_row(df, i, model, hours, target_col="PM25"):
+    """Recursive predictions for +1..+hours from row i, for backtests."""
+    layout = resolve_feature_layout(df, model, target_col)
+    origin = pd.Timestamp(df["Timestamp"].iloc[i])
+    timestamps = [origin + pd.Timedelta(hours=h + 1) for h in range(hours)]
+    states = [history_state(df, i, target_col)] if layout["rolling"] else None
+    return run_horizon(model, _row_seed(df, i, layout), layout, timestamps, states)[:, 0]
 
-        forecasts.append({
-            "Timestamp": str(next_timestamp),
-            target_col: y_pred,
-            "station": station if station is not None else None
-        })
 
-       
-        new_row = latest_row.copy()
-        new_row["Timestamp"] = next_timestamp
-        new_row[target_col] = y_pred
-        new_row["lag_1d"] = y_pred
-        new_row["lag_2d"] = latest_row.get("lag_1d", y_pred)
-        new_row["lag_3d"] = latest_row.get("lag_2d", y_pred)
+def forecast_direct_from_row(df, i, model, hours, target_col="PM25"):
+    """Direct-model predictions for +1..+hours from row i, for backtests."""
+    layout = resolve_feature_layout(df, model, target_col)
+    return model.predict(_row_seed(df, i, layout))[0, :hours]
 
-        latest_row = new_row.copy()
-        X_latest = latest_row.drop(columns=drop_cols, errors="ignore")
 
-        for col in feature_names:
-            if col not in X_latest.columns:
-                X_latest[col] = 0
+def list_stations(df):
+    """Return every station name present in the preprocessed frame."""
+    return list(station_index_for(df).stations)
 
-        X_latest = X_latest[feature_names]
 
-    return pd.DataFrame(forecasts)
+def forecast_batch(df, model, stations, target_col="PM25", hours=72, start_time=None):
+    """
+    Forecast next 'hours' for many stations at once.
+
+    All stations move through the recursive horizon together: each step is a
+    single model.predict on an (n_stations x n_features) matrix. Returns a dict
+    of station -> DataFrame with the same records as forecast_next_days.
+    """
+    if df.empty:
+        raise ValueError("No data available for forecasting.")
+    if not stations:
+        return {}
+
+    station_cols = []
+    for station in stations:
+        station_col = get_station_column(df, station)
+        if station_col is None:
+            raise ValueError(f"Station '{station}' not found in data")
+        station_cols.append(station_col)
+
+    layout = resolve_feature_layout(df, model, target_col)
+    X = seed_features(df, layout, station_cols)
+    states = seed_states(df, layout, station_cols)
+
+    last_timestamp = _forecast_start(df, start_time)
+    timestamps = [last_timestamp + pd.Timedelta(hours=i + 1) for i in range(hours)]
+    preds = run_horizon(model, X, layout, timestamps, states)
+    timestamps = [str(ts) for ts in timestamps]
+
+    return {
+        station: pd.DataFrame({
+            "Timestamp": timestamps,
+            target_col: preds[:, j].astype(float),
+            "station": station,
+        })
+        for j, station in enumerate(stations)
+    }
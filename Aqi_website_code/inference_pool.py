@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from forecasting import run_horizon
+from telemetry import get_logger, REGISTRY
+
+log = get_logger("inference")
+
+BATCH_SIZE = REGISTRY.histogram("aqi_inference_batch_size", "Requests coalesced into one batched forecast",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+QUEUE_DEPTH = REGISTRY.gauge("aqi_inference_queue_depth", "Forecast requests waiting for or in a worker")
+REJECTED = REGISTRY.counter("aqi_inference_rejected_total", "Forecast requests turned away with 503")
+
+
+class Saturated(Exception):
+    """Raised when the executor's queue is full; the API answers 503."""
+
+
+# ---------- worker process side ----------
+_MODEL = None
+
+
+def _init_worker(model):
+    global _MODEL
+    _MODEL = model
+
+
+def _run_batch(X, layout, timestamps, states):
+    return run_horizon(_MODEL, X, layout, timestamps, states)
+
+
+# ---------- API process side ----------
+class _Request:
+    __slots__ = ("row", "layout", "start", "hours", "state", "future")
+
+    def __init__(self, row, layout, start, hours, state, future):
+        self.row, self.layout, self.start, self.hours = row, layout, start, hours
+        self.state, self.future = state, future
+
+
+class InferenceExecutor:
+    """
+    Runs recursive forecasts on a pool of worker processes that each hold
+    the model, so concurrent requests aren't serialised on the API
+    process's GIL.
+
+    Requests arriving within `batch_window_ms` of each other are coalesced:
+    every forecast is one seed row, so rows that share a starting hour
+    (the calendar features only depend on that) are stacked and run as a
+    single batched predict per horizon step, to the longest horizon asked
+    for. At most `max_queue` requests may be waiting; beyond that forecast
+    raises Saturated. A new model restarts the pool with the new weights.
+    """
+
+    def __init__(self, workers=2, batch_window_ms=5.0, max_queue=64, max_batch=64):
+        self.workers = workers
+        self.batch_window = batch_window_ms / 1000
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self._pool = None
+        self._model = None
+        self._queue = None
+        self._collector = None
+        self._tasks = set()
+        self._pending = 0
+        self.batches = 0
+        self.requests = 0
+
+    # ---------- lifecycle ----------
+    def set_model(self, model):
+        """Point the workers at `model`; a no-op when it is already loaded."""
+        if model is self._model and self._pool is not None:
+            return
+        old = self._pool
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model,),
+        )
+        self._model = model
+        if old is not None:
+            # Batches already submitted to the old pool still finish there
+            old.shutdown(wait=False)
+        log.info("🔹 Inference pool ready", extra={"workers": self.workers})
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def info(self):
+        return {
+            "workers": self.workers,
+            "batch_window_ms": self.batch_window * 1000,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": round(self.requests / self.batches, 2) if self.batches else None,
+        }
+
+    # ---------- requests ----------
+    async def forecast(self, row, layout, start, hours, state=None):
+        """
+        Predictions for `hours` steps after `start` from one seed row
+        (as built by forecasting.seed_features) and, for models with
+        rolling features, its StationState from forecasting.seed_states.
+        Raises Saturated when full.
+        """
+        if self._pending >= self.max_queue:
+            REJECTED.inc()
+            raise Saturated(f"{self._pending} forecasts already queued")
+        self._pending += 1
+        QUEUE_DEPTH.set(self._pending)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Request(row, layout, pd.Timestamp(start), hours, state, future))
+        try:
+            return await future
+        finally:
+            self._pending -= 1
+            QUEUE_DEPTH.set(self._pending)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Calendar features depend only on the starting hour; layouts must match too
+            groups = {}
+            for req in batch:
+                groups.setdefault((req.start.floor("h"), tuple(req.layout["feature_names"])), []).append(req)
+            for group in groups.values():
+                task = asyncio.create_task(self._dispatch(group))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, group):
+        X = np.vstack([req.row for req in group])
+        states = [req.state for req in group] if group[0].layout["rolling"] else None
+        hours = max(req.hours for req in group)
+        first = group[0].start
+        timestamps = [first + pd.Timedelta(hours=i + 1) for i in range(hours)]
+
+        started = time.perf_counter()
+        try:
+            preds = await asyncio.get_running_loop().run_in_executor(
+                self._pool, _run_batch, X, group[0].layout, timestamps, states)
+        except Exception as e:
+            for req in group:
+                if not req.future.done():
+                    req.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.requests += len(group)
+        BATCH_SIZE.observe(len(group))
+        log.debug("Batched forecast", extra={"size": len(group), "hours": hours,
+                                             "seconds": round(time.perf_counter() - started, 4)})
+        for j, req in enumerate(group):
+            if not req.future.done():
+                req.future.set_result(preds[:req.hours, j])
@@ -1,19 +1,44 @@
 import os
-from fastapi import FastAPI
+import hmac
+import json
+import time
+import threading
+import asyncio
+import warnings
+import numpy as np
+from fastapi import FastAPI, HTTPException, Header, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional, Union
 from contextlib import asynccontextmanager
 import pandas as pd
-from pymongo import MongoClient
 from preprocessing import preprocess_data
-from modeling import train_model
-from forecasting import forecast_next_days
+from forecasting import (forecast_next_days, forecast_batch, list_stations, get_station_column,
+                         resolve_feature_layout, seed_features, seed_states, iter_forecast,
+                         forecast_direct, supports_quantiles)
+from forecast_store import ForecastStore, run_scheduler
+from compiled_forest import compile_forest, CompiledForest
+from station_index import station_index_for
+from station_store import store_for
+from data_refresh import DataRefresher, run_refresher
+from mongo_loader import load_hourly_frame
+from compact import compact_frame, memory_report, feature_matrix
+from model_registry import ModelRegistry, check_feature_layout, watch_registry
+from snapshot import read_snapshot, snapshot_exists
+from inference_pool import InferenceExecutor, Saturated
+from plotting import (PlotCache, actual_vs_pred_figure, feature_importance_figure, figure_png,
+                      PLOT_MAX_POINTS)
+from telemetry import configure_logging, get_logger, stage, REGISTRY, MetricsMiddleware
 from datetime import datetime
 from joblib import load
 from dotenv import load_dotenv
 
 
 load_dotenv()
+configure_logging()
+log = get_logger("api")
 
 
 # ------------------------------
@@ -23,74 +48,202 @@ MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 
-STATE = {"df": None, "model": None, "feature_cols": None}
+# 0 loads the full history; rows stream into float32 buffers either way
+MONGO_LOAD_LIMIT = int(os.getenv("MONGO_LOAD_LIMIT", "0")) or None
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "5000"))
+
+# "sklearn" calls model.predict directly, "compiled" flattens the forest into arrays
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "sklearn").lower()
+FORECAST_HORIZON = int(os.getenv("FORECAST_HORIZON", "72"))
+FORECAST_POLL_SECONDS = float(os.getenv("FORECAST_POLL_SECONDS", "30"))
+# Longest horizon any forecast route will compute (30 days of hourly steps)
+FORECAST_MAX_HOURS = int(os.getenv("FORECAST_MAX_HOURS", "720"))
+
+# On-demand forecasts run on this many worker processes (0 keeps them in the API process);
+# requests within INFERENCE_BATCH_MS are coalesced, and past INFERENCE_MAX_QUEUE get a 503
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_BATCH_MS = float(os.getenv("INFERENCE_BATCH_MS", "5"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "64"))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "64"))
+
+REFRESH_INTERVAL_SECONDS = float(os.getenv("REFRESH_INTERVAL_SECONDS", "300"))
+REFRESH_MAX_ROWS = int(os.getenv("REFRESH_MAX_ROWS", "0")) or None
+
+# Keep STATE["df"] with categorical stations + float32 instead of dense one-hots
+COMPACT_STATE = os.getenv("COMPACT_STATE", "1") == "1"
+
+# Versioned artifacts written by pre_train.py; the watcher hot-swaps new versions
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+MODEL_WATCH_SECONDS = float(os.getenv("MODEL_WATCH_SECONDS", "30"))
+# Required by the /admin/models routes; they answer 403 while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Direct multi-horizon model from pre_train.py (DIRECT_HOURS); enables mode="direct"
+DIRECT_MODEL_PATH = os.getenv("DIRECT_MODEL_PATH", "pm25_direct.pkl")
+
+# Preprocessed frame written by pre_train.py; start from it, then catch up from Mongo
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots/latest")
+
+# /plots/{kind} keeps this many rendered PNGs (least recently used go first) for up to the TTL
+PLOT_CACHE_SIZE = int(os.getenv("PLOT_CACHE_SIZE", "32"))
+PLOT_CACHE_TTL_SECONDS = float(os.getenv("PLOT_CACHE_TTL_SECONDS", "3600"))
+PLOT_DPI = int(os.getenv("PLOT_DPI", "100"))
+
+STATE = {"df": None, "model": None, "feature_cols": None, "watermark": None,
+         "model_version": None, "previous_model": None, "direct_model": None}
+MODEL_REGISTRY = ModelRegistry(MODEL_REGISTRY_DIR)
+MODEL_SWAP_LOCK = threading.Lock()
+FORECAST_STORE = ForecastStore()
+PLOT_CACHE = PlotCache(PLOT_CACHE_SIZE, PLOT_CACHE_TTL_SECONDS)
+INFERENCE = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_BATCH_MS, INFERENCE_MAX_QUEUE, INFERENCE_MAX_BATCH) \
+    if INFERENCE_WORKERS > 0 else None
 
 
 # ------------------------------
 # Load Data from MongoDB
 # ------------------------------
-def load_data_from_mongo():
-    print("🔹 Connecting to MongoDB...")
+def get_collection():
+    # Imported here so a snapshot start doesn't pay for pymongo up front
+    from pymongo import MongoClient
+
     client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    collection = client[DB_NAME][COLLECTION_NAME]
-
-    print("🔹 Fetching limited dataset...")
-    cursor = collection.find(
-        {},
-        {
-            "_id": 0,
-            "station": 1,
-            "city": 1,
-            "timestamp": 1,
-            "pollutants": 1,
-        }
-    ).sort("timestamp", -1).limit(3000)
+    return client[DB_NAME][COLLECTION_NAME]
 
-    df = pd.DataFrame(list(cursor))
-    df["station_original"] = df["station"]
-    print(f"✅ Loaded {len(df)} rows")
 
-    if df.empty:
-        return df
-
-    # Extract pollutant JSON → columns
-    if "pollutants" in df.columns:
-        pollutants_df = pd.json_normalize(df["pollutants"])
-        df = pd.concat([df.drop(columns=["pollutants"]), pollutants_df], axis=1)
-
-    # Normalize column names
-    rename_map = {
-        "PM2.5": "PM25",
-        "pm25": "PM25",
-        "PM10": "PM10",
-        "NO2": "NO2",
-        "O3": "O3",
-        "SO2": "SO2",
-        "CO": "CO",
-        "AQI": "AQI",
-    }
-    df.rename(columns=rename_map, inplace=True)
+def load_data_from_mongo(collection=None, since=None, limit=MONGO_LOAD_LIMIT):
+    """
+    Load hourly rows from Mongo. With `since`, only documents whose raw
+    `timestamp` is at or after that watermark are fetched. The watermark
+    hour is read again on purpose: backend/cron.js stamps a whole hour with
+    one timestamp but saves station by station, so a refresh can land
+    mid-hour. preprocess_tail drops the rows it already has. The newest raw
+    timestamp seen is returned in df.attrs["watermark"].
+    """
+    if collection is None:
+        log.info("🔹 Connecting to MongoDB...")
+        collection = get_collection()
 
-    # Fix timestamp
-    if "timestamp" in df.columns:
-        df.rename(columns={"timestamp": "Timestamp"}, inplace=True)
+    query = {"timestamp": {"$gte": since}} if since is not None else {}
 
-    # df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors="coerce")
+    log.debug("🔹 Fetching rows", extra={"since": since, "limit": limit})
+    with stage("mongo_load"):
+        df = load_hourly_frame(collection, query, limit=limit, batch_size=MONGO_BATCH_SIZE)
+    log.info("✅ Loaded %d rows", len(df), extra={"since": since})
 
-    df["Timestamp"] = pd.to_datetime(
-        df["Timestamp"],
-        errors="coerce",
-        utc=True
-   )
+    return df
 
 
-    # Remove missing target values
-    if "PM25" in df.columns:
-        df.dropna(subset=["PM25"], inplace=True)
-    else:
-        raise ValueError("❌ PM25 column missing from MongoDB data.")
+DATA_REFRESHER = DataRefresher(
+    STATE,
+    fetch=lambda since: load_data_from_mongo(since=since, limit=None if since is not None else MONGO_LOAD_LIMIT),
+    max_rows=REFRESH_MAX_ROWS,
+    postprocess=compact_frame if COMPACT_STATE else None,
+)
 
-    return df
+
+def prepare_model(model):
+    if INFERENCE_BACKEND == "compiled":
+        try:
+            model = compile_forest(model)
+        except TypeError as e:
+            # e.g. a boosted or linear model picked by pre_train's model selection
+            log.warning("⚠️ %s → serving with sklearn", e)
+    elif INFERENCE_BACKEND != "sklearn":
+        raise ValueError(f"❌ Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}'")
+    return model
+
+
+def load_model(path):
+    return prepare_model(load(path))
+
+
+def load_version(version):
+    """
+    (model, feature_cols) for a registry version, or the legacy pickles when
+    version is None. The compiled backend reads the pre-flattened .npz when
+    one was published, which skips unpickling sklearn entirely.
+    """
+    base = os.path.join(MODEL_REGISTRY_DIR, version) if version else "."
+    feature_cols = load(os.path.join(base, "feature_cols.pkl"))
+    compiled = os.path.join(base, "model_compiled.npz" if version else "pm25_model.npz")
+    if INFERENCE_BACKEND == "compiled" and os.path.exists(compiled):
+        return CompiledForest.load_arrays(compiled), feature_cols
+    return load_model(os.path.join(base, "model.pkl" if version else "pm25_model.pkl")), feature_cols
+
+
+def load_initial_model():
+    """Current registry version if there is one, else the legacy pickles."""
+    version = MODEL_REGISTRY.current()
+    model, feature_cols = load_version(version)
+    return model, feature_cols, version
+
+
+def load_initial_data():
+    """
+    Preprocessed serving frame plus whether it came from the snapshot (and
+    so still needs to catch up with Mongo). None when there is no data.
+    """
+    if snapshot_exists(SNAPSHOT_DIR):
+        df, meta = read_snapshot(SNAPSHOT_DIR)
+        STATE["watermark"] = meta.get("watermark")
+        log.info("✅ Loaded snapshot: %d rows", len(df), extra={"watermark": meta.get("watermark")})
+        return (compact_frame(df) if COMPACT_STATE else df), True
+
+    df = load_data_from_mongo()
+    if df.empty:
+        return None, False
+
+    STATE["watermark"] = df.attrs.get("watermark")
+    df = preprocess_data(df)
+    DATA_REFRESHER.last_success = time.time()
+    return (compact_frame(df) if COMPACT_STATE else df), False
+
+
+def activate_model(version):
+    """
+    Load a registry version off the request path, check it can be served
+    from the current data, then swap it in. The old model stays in memory
+    so rollback is immediate.
+    """
+    with MODEL_SWAP_LOCK:
+        if version == STATE["model_version"]:
+            return version
+        if version not in MODEL_REGISTRY.versions():
+            raise KeyError(f"Unknown model version '{version}'")
+
+        with stage("model_load"):
+            model, feature_cols = load_version(version)
+        problems = check_feature_layout(feature_cols, STATE["df"], STATE["feature_cols"])
+        if problems:
+            raise ValueError("; ".join(problems))
+
+        STATE["previous_model"] = (STATE["model"], STATE["feature_cols"], STATE["model_version"])
+        STATE["feature_cols"] = feature_cols
+        STATE["model_version"] = version
+        STATE["model"] = model
+        MODEL_REGISTRY.set_current(version)
+
+    log.info("✅ Activated model %s", version)
+    return version
+
+
+def rollback_model():
+    with MODEL_SWAP_LOCK:
+        previous = STATE["previous_model"]
+        if previous is None or previous[0] is None:
+            raise ValueError("No previous model loaded to roll back to")
+
+        current = (STATE["model"], STATE["feature_cols"], STATE["model_version"])
+        model, feature_cols, version = previous
+        STATE["feature_cols"] = feature_cols
+        STATE["model_version"] = version
+        STATE["model"] = model
+        STATE["previous_model"] = current
+        if version is not None:
+            MODEL_REGISTRY.set_current(version)
+
+    log.info("↩️ Rolled back to model %s", version)
+    return version
 
 
 # ------------------------------
@@ -98,15 +251,16 @@ def load_data_from_mongo():
 # ------------------------------
 @asynccontextmanager
 async def lifespan(app):
-    print("🚀 Starting ML API...")
-    df = load_data_from_mongo()
+    log.info("🚀 Starting ML API...")
+    df, from_snapshot = load_initial_data()
 
-    if df.empty:
-        print("⚠️ Empty DB → Skipping training")
+    if df is None or df.empty:
+        log.warning("⚠️ Empty DB → Skipping training")
         # STATE["df"] = pd.DataFrame()
         # STATE["model"] = None
         # STATE["feature_cols"] = []
-        yield
+        async with background_tasks():
+            yield
         return
 
     # df = preprocess_data(df)
@@ -119,14 +273,52 @@ async def lifespan(app):
     # print("✅ Model trained and ready.")
     # yield
 
-    df = preprocess_data(df)
+    station_index_for(df)
+    store_for(df)
 
     STATE["df"] = df
-    STATE["model"] = load("pm25_model.pkl")
-    STATE["feature_cols"] = load("feature_cols.pkl")
+    STATE["model"], STATE["feature_cols"], STATE["model_version"] = load_initial_model()
+    if os.path.exists(DIRECT_MODEL_PATH):
+        STATE["direct_model"] = load(DIRECT_MODEL_PATH)
+        log.info("✅ Direct model loaded (+1..+%dh)", STATE["direct_model"].hours)
+
+    log.info("✅ Model %s loaded successfully (%s backend)",
+             STATE["model_version"] or "pm25_model.pkl", INFERENCE_BACKEND)
+    async with background_tasks(catch_up=from_snapshot):
+        yield
 
-    print("✅ Model loaded successfully")
-    yield
+
+@asynccontextmanager
+async def background_tasks(catch_up=False):
+    """
+    Run the refresher, model watcher and forecast precompute loops for the
+    app's lifetime. With catch_up the first refresh runs immediately.
+    """
+    tasks = [
+        asyncio.create_task(
+            watch_registry(MODEL_REGISTRY, lambda: STATE["model_version"], activate_model, MODEL_WATCH_SECONDS)
+        ),
+        asyncio.create_task(
+            run_refresher(DATA_REFRESHER, REFRESH_INTERVAL_SECONDS, initial_delay=0 if catch_up else None)
+        ),
+        asyncio.create_task(
+            run_scheduler(FORECAST_STORE, STATE, FORECAST_HORIZON, FORECAST_POLL_SECONDS)
+        ),
+    ]
+    if INFERENCE is not None:
+        await INFERENCE.start()
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if INFERENCE is not None:
+            await INFERENCE.stop()
 
 # ------------------------------
 # FastAPI App
@@ -144,6 +336,41 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True,
 )
+app.add_middleware(MetricsMiddleware)
+
+
+# ------------------------------
+# METRICS
+# ------------------------------
+MODEL_INFO = REGISTRY.gauge("aqi_model_info", "Model currently served (always 1)", ("version", "backend"))
+DATA_ROWS = REGISTRY.gauge("aqi_data_rows", "Rows in the serving frame")
+DATA_WATERMARK = REGISTRY.gauge("aqi_data_watermark_timestamp_seconds", "Newest raw timestamp loaded from Mongo")
+DATA_LATEST = REGISTRY.gauge("aqi_data_latest_timestamp_seconds", "Newest Timestamp in the serving frame")
+DATA_REFRESH_AGE = REGISTRY.gauge("aqi_data_refresh_age_seconds", "Seconds since the last successful refresh")
+FORECAST_STORE_VERSION = REGISTRY.gauge("aqi_forecast_store_version", "Version of the precomputed forecasts")
+
+
+def _timestamp_seconds(value):
+    ts = pd.to_datetime(value, utc=True, errors="coerce")
+    return None if pd.isna(ts) else ts.timestamp()
+
+
+@REGISTRY.on_collect
+def collect_state():
+    MODEL_INFO.clear()
+    if STATE["model"] is not None:
+        MODEL_INFO.set(1, version=STATE["model_version"] or "pm25_model.pkl", backend=INFERENCE_BACKEND)
+
+    df = STATE["df"]
+    DATA_ROWS.set(0 if df is None else len(df))
+    for gauge, value in ((DATA_WATERMARK, STATE["watermark"]),
+                         (DATA_LATEST, None if df is None or df.empty else df["Timestamp"].max())):
+        seconds = None if value is None else _timestamp_seconds(value)
+        if seconds is not None:
+            gauge.set(seconds)
+    if DATA_REFRESHER.last_success:
+        DATA_REFRESH_AGE.set(time.time() - DATA_REFRESHER.last_success)
+    FORECAST_STORE_VERSION.set(FORECAST_STORE.version)
 
 
 # ------------------------------
@@ -159,31 +386,402 @@ def root():
 def health():
     return {
         "model_loaded": STATE["model"] is not None,
-        "rows": len(STATE["df"]) if STATE["df"] is not None else 0
+        "model_version": STATE["model_version"],
+        "direct_model_hours": STATE["direct_model"].hours if STATE["direct_model"] is not None else None,
+        "inference_backend": INFERENCE_BACKEND,
+        "rows": len(STATE["df"]) if STATE["df"] is not None else 0,
+        "forecast_store": FORECAST_STORE.info(),
+        "data_refresh": DATA_REFRESHER.status(),
+        "memory": memory_report(STATE["df"]),
+        "station_store_bytes": store_for(STATE["df"]).nbytes() if STATE["df"] is not None else 0,
+        "inference": INFERENCE.info() if INFERENCE is not None else {"workers": 0},
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def require_admin(token):
+    # Fail closed: without a configured token nobody may swap models
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled: ADMIN_TOKEN is not set")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+def list_models(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    previous = STATE["previous_model"]
+    return {
+        "loaded": STATE["model_version"],
+        "previous_loaded": previous[2] if previous else None,
+        "registry_current": MODEL_REGISTRY.current(),
+        "versions": [MODEL_REGISTRY.manifest(v) for v in MODEL_REGISTRY.versions()],
+    }
+
+
+@app.post("/admin/models/{version}/activate")
+async def activate(version: str, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    try:
+        await asyncio.to_thread(activate_model, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"loaded": STATE["model_version"]}
+
+
+@app.post("/admin/models/rollback")
+def rollback(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    try:
+        version = rollback_model()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"loaded": version}
+
+
+@app.get("/stations")
+def stations(q: Optional[str] = None):
+    df = STATE["df"]
+    if df is None:
+        return {"stations": [], "match": None}
+
+    index = station_index_for(df)
+    return {
+        "stations": index.catalogue(),
+        "match": index.resolve(q) if q is not None else None,
     }
 
 
 class ForecastRequest(BaseModel):
     station: str
-    hours: int = 72
+    hours: int = Field(72, ge=1, le=FORECAST_MAX_HOURS)
+    # "recursive" steps one hour at a time; "direct" predicts the whole horizon at once
+    mode: str = Field("recursive", pattern="^(recursive|direct)$")
+    # e.g. [0.1, 0.5, 0.9] adds PM25_p10 / _p50 / _p90 bands from the forest's trees
+    quantiles: Optional[List[Annotated[float, Field(gt=0, lt=1)]]] = Field(None, max_length=9)
+
+
+def require_direct_model(hours):
+    direct = STATE["direct_model"]
+    if direct is None:
+        raise HTTPException(status_code=400, detail="No direct model loaded; use mode='recursive'")
+    if hours > direct.hours:
+        raise HTTPException(status_code=400, detail=f"Direct model covers at most {direct.hours} hours")
+    return direct
+
+
+def require_quantiles(req, model):
+    """The request's quantiles, sorted; 400 when the served model can't provide them."""
+    if not req.quantiles:
+        return None
+    if req.mode != "recursive":
+        raise HTTPException(status_code=400, detail="quantiles are only available with mode='recursive'")
+    if not supports_quantiles(model):
+        raise HTTPException(status_code=400,
+                            detail=f"{type(model).__name__} has no per-tree outputs to take quantiles from")
+    return sorted(set(req.quantiles))
 
 
 # 
 
+async def forecast_in_pool(df, model, station, hours, start_time):
+    """forecast_next_days, with the horizon run on the inference workers."""
+    station_col = get_station_column(df, station)
+    if station_col is None:
+        raise ValueError(f"Station '{station}' not found in data")
+
+    layout = resolve_feature_layout(df, model)
+    X = seed_features(df, layout, [station_col])
+    states = seed_states(df, layout, [station_col])
+    INFERENCE.set_model(model)
+    preds = await INFERENCE.forecast(X[0], layout, start_time, hours, states[0] if states else None)
+
+    timestamps = [start_time + pd.Timedelta(hours=i + 1) for i in range(hours)]
+    return pd.DataFrame({
+        "Timestamp": [str(ts) for ts in timestamps],
+        "PM25": preds.astype(float),
+        "station": station,
+    }, columns=["Timestamp", "PM25", "station"])
+
+
 @app.post("/forecast")
-def forecast(req: ForecastRequest):
-    print(f"🔮 Forecast → {req.station} ({req.hours}h)")
+async def forecast(req: ForecastRequest):
+    log.debug("🔮 Forecast → %s (%dh)", req.station, req.hours)
+
+    df, model = STATE["df"], STATE["model"]
+    quantiles = require_quantiles(req, model)
+
+    if req.mode == "direct":
+        direct = require_direct_model(req.hours)
+        out = await run_in_threadpool(forecast_direct, df, direct, "PM25", req.hours, req.station,
+                                      pd.Timestamp(datetime.now()))
+        return {
+            "station": req.station,
+            "forecast": out.to_dict(orient="records"),
+            "meta": {"source": "direct", "stale": False},
+        }
+
+    # Bands come from the trees in-process; the store and the workers only hold means
+    if quantiles:
+        out = await run_in_threadpool(forecast_next_days, df, model, "PM25", req.hours, req.station,
+                                      pd.Timestamp(datetime.now()), quantiles)
+        return {
+            "station": req.station,
+            "forecast": out.to_dict(orient="records"),
+            "meta": {"source": "on_demand", "stale": False, "quantiles": quantiles},
+        }
+
+    # Serve from the precomputed store when it covers this station + horizon
+    station_col = get_station_column(df, req.station) if df is not None else None
+    hit = FORECAST_STORE.lookup(station_col, req.hours, df, model) if station_col else None
+    if hit is not None:
+        records, meta = hit
+        return {
+            "station": req.station,
+            "forecast": [{**r, "station": req.station} for r in records],
+            "meta": meta,
+        }
+
+    start_time = pd.Timestamp(datetime.now())
+    if INFERENCE is not None:
+        try:
+            out = await forecast_in_pool(df, model, req.station, req.hours, start_time)
+        except Saturated:
+            raise HTTPException(status_code=503, detail="Forecast workers are saturated, retry shortly",
+                                headers={"Retry-After": "1"})
+    else:
+        out = await run_in_threadpool(
+            forecast_next_days,
+            df=df,
+            model=model,
+            target_col="PM25",
+            hours=req.hours,
+            station=req.station,
+            start_time=start_time
+        )
+
+    return {
+        "station": req.station,
+        "forecast": out.to_dict(orient="records"),
+        "meta": {"source": "on_demand", "stale": False},
+    }
+
+
+class StreamForecastRequest(ForecastRequest):
+    format: str = Field("ndjson", pattern="^(ndjson|sse)$")
+
+
+def _stream_line(fmt, event, data):
+    payload = json.dumps(data)
+    return f"event: {event}\ndata: {payload}\n\n" if fmt == "sse" else payload + "\n"
+
+
+@app.post("/forecast/stream")
+async def forecast_stream(req: StreamForecastRequest, request: Request):
+    """
+    Same forecast as /forecast, streamed one step at a time as NDJSON lines
+    or Server-Sent Events: a meta record, one record per hour, then an end
+    record. Each step is computed only when the previous one has been
+    sent, and computing stops as soon as the client goes away.
+    """
+    df, model = STATE["df"], STATE["model"]
+    if df is None or model is None:
+        raise HTTPException(status_code=503, detail="No model or data loaded yet")
+
+    station_col = get_station_column(df, req.station)
+    if station_col is None:
+        raise HTTPException(status_code=404, detail=f"Station '{req.station}' not found in data")
+
+    quantiles = require_quantiles(req, model)
+    hit = FORECAST_STORE.lookup(station_col, req.hours, df, model) \
+        if req.mode == "recursive" and not quantiles else None
+    if req.mode == "direct":
+        # One predict covers the horizon; streaming just paces the records out
+        out = await run_in_threadpool(forecast_direct, df, require_direct_model(req.hours), "PM25", req.hours,
+                                      req.station, pd.Timestamp(datetime.now()))
+        meta = {"source": "direct", "stale": False}
+        steps = iter(out.to_dict(orient="records"))
+    elif hit is not None:
+        records, meta = hit
+        steps = ({**r, "station": req.station} for r in records)
+    else:
+        meta = {"source": "on_demand", "stale": False, **({"quantiles": quantiles} if quantiles else {})}
+        steps = iter_forecast(df, model, target_col="PM25", hours=req.hours, station=req.station,
+                              start_time=pd.Timestamp(datetime.now()), quantiles=quantiles)
+
+    async def body():
+        yield _stream_line(req.format, "meta", {"station": req.station, "hours": req.hours, "meta": meta})
+        sent = 0
+        while True:
+            # One predict step per hop to the threadpool keeps the event loop free
+            record = await run_in_threadpool(next, steps, None)
+            if record is None:
+                break
+            yield _stream_line(req.format, "point", record)
+            sent += 1
+            if await request.is_disconnected():
+                log.debug("Forecast stream closed by client", extra={"station": req.station, "sent": sent})
+                return
+        yield _stream_line(req.format, "end", {"points": sent})
+
+    media_type = "text/event-stream" if req.format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+class BatchForecastRequest(BaseModel):
+    stations: Union[List[str], str] = "all"
+    hours: int = Field(72, ge=1, le=FORECAST_MAX_HOURS)
+
+
+@app.post("/forecast/batch")
+def forecast_many(req: BatchForecastRequest):
+    df = STATE["df"]
+
+    if isinstance(req.stations, str):
+        if req.stations.lower() != "all":
+            raise HTTPException(status_code=400, detail="stations must be a list or 'all'")
+        stations = list_stations(df)
+    else:
+        stations = req.stations
+
+    known = [s for s in stations if get_station_column(df, s) is not None]
+    unknown = [s for s in stations if s not in known]
+
+    log.debug("🔮 Batch forecast → %d stations (%dh)", len(known), req.hours)
 
-    out = forecast_next_days(
-        df=STATE["df"],
+    out = forecast_batch(
+        df=df,
         model=STATE["model"],
+        stations=known,
         target_col="PM25",
         hours=req.hours,
-        station=req.station,
         start_time=pd.Timestamp(datetime.now())
     )
 
     return {
-        "station": req.station,
-        "forecast": out.to_dict(orient="records")
-    }
\ No newline at end of file
+        "hours": req.hours,
+        "unknown_stations": unknown,
+        "forecasts": [
+            {"station": s, "forecast": out[s].to_dict(orient="records")}
+            for s in known
+        ]
+    }
+
+
+# ------------------------------
+# Diagnostic plots
+# ------------------------------
+PLOT_KINDS = ("actual_vs_pred", "feature_importance")
+PLOT_LOOKUPS = REGISTRY.counter("aqi_plot_cache_total", "Plot requests by cache result", ("result",))
+
+
+def _utc(value, name):
+    try:
+        ts = pd.Timestamp(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} '{value}'")
+    return ts.tz_localize("UTC") if ts.tz is None else ts.tz_convert("UTC")
+
+
+def plot_model(version):
+    """(model, feature names) for a registry version; the served model by default."""
+    if version is None or version == STATE["model_version"]:
+        model, feature_cols = STATE["model"], STATE["feature_cols"]
+    elif version in MODEL_REGISTRY.versions():
+        model, feature_cols = load_version(version)
+    else:
+        raise HTTPException(status_code=404, detail=f"Unknown model version '{version}'")
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    names = getattr(model, "feature_names_in_", None)
+    return model, list(names) if names is not None else list(feature_cols or [])
+
+
+def plot_rows(df, start, end, station):
+    """
+    Rows of the serving frame in [start, end], for one station if given.
+    The frame is time-ordered, so the range is found by binary search and
+    only its rows are read.
+    """
+    ts = df["Timestamp"]
+    naive = getattr(ts.dtype, "tz", None) is None
+    lo, hi = 0, len(df)
+    if start is not None:
+        bound = _utc(start, "start")
+        lo = int(ts.searchsorted(bound.tz_localize(None) if naive else bound, side="left"))
+    if end is not None:
+        bound = _utc(end, "end")
+        hi = int(ts.searchsorted(bound.tz_localize(None) if naive else bound, side="right"))
+    rows = df.iloc[lo:max(lo, hi)]
+    if station is not None:
+        station_col = get_station_column(df, station)
+        if station_col is None:
+            raise HTTPException(status_code=404, detail=f"Station '{station}' not found")
+        rows = rows[(rows["station_original"].astype(str) == station_col[len("station_"):]).to_numpy()]
+    if rows.empty:
+        raise HTTPException(status_code=404, detail="No rows in the requested range")
+    return rows
+
+
+def render_plot(kind, model, names, rows, points, top_n):
+    if kind == "feature_importance":
+        importances = getattr(model, "feature_importances_", None)
+        if importances is None:
+            raise ValueError(f"{type(model).__name__} has no feature importances")
+        return figure_png(feature_importance_figure(names, importances, top_n), PLOT_DPI)
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        predicted = model.predict(feature_matrix(rows, names))
+    ts = pd.DatetimeIndex(pd.to_datetime(rows["Timestamp"], utc=True)).tz_localize(None).to_numpy()
+    stations = rows["station_original"].astype(str).unique() if "station_original" in rows.columns else []
+    label = stations[0] if len(stations) == 1 else "all stations"
+    fig = actual_vs_pred_figure([(f"PM25 {label}: Actual vs Predicted", "PM25", ts,
+                                  rows["PM25"].to_numpy(), predicted)], points)
+    return figure_png(fig, PLOT_DPI)
+
+
+@app.get("/plots/{kind}")
+async def plot(kind: str, version: Optional[str] = None, start: Optional[str] = None,
+               end: Optional[str] = None, station: Optional[str] = None,
+               points: int = Query(PLOT_MAX_POINTS, ge=10, le=50000), top_n: int = Query(20, ge=1, le=200)):
+    """
+    PNG diagnostics for a model version over a date range of the serving
+    frame: actual vs predicted PM25 (LTTB-downsampled to `points` per
+    line) or feature importances. Renders are cached per inputs, and the
+    range's row count and last timestamp are part of the key, so new data
+    in an open-ended range renders afresh.
+    """
+    if kind not in PLOT_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown plot '{kind}', choose from {list(PLOT_KINDS)}")
+    df = STATE["df"]
+    if df is None or df.empty:
+        raise HTTPException(status_code=503, detail="No data loaded")
+
+    model_key = version or STATE["model_version"] or "pm25_model.pkl"
+    if kind == "feature_importance":
+        rows, key = None, (kind, model_key, top_n)
+    else:
+        # Off the event loop: a station filter still reads every row of the range
+        rows = await run_in_threadpool(plot_rows, df, start, end, station)
+        key = (kind, model_key, station, points, len(rows), str(rows["Timestamp"].iloc[0]),
+               str(rows["Timestamp"].iloc[-1]))
+
+    png = PLOT_CACHE.get(key)
+    PLOT_LOOKUPS.inc(result="miss" if png is None else "hit")
+    if png is None:
+        model, names = await run_in_threadpool(plot_model, version)
+        try:
+            with stage(f"plot.{kind}"):
+                png = await run_in_threadpool(render_plot, kind, model, names, rows, points, top_n)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        PLOT_CACHE.put(key, png)
+        return Response(png, media_type="image/png", headers={"X-Plot-Cache": "miss"})
+    return Response(png, media_type="image/png", headers={"X-Plot-Cache": "hit"})
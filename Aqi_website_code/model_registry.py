@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from joblib import dump, load
+from telemetry import get_logger
+
+log = get_logger("model_registry")
+
+
+def schema_hash(feature_cols):
+    """Stable hash of the model's feature layout (names and order)."""
+    return hashlib.sha256(json.dumps(list(feature_cols)).encode()).hexdigest()[:16]
+
+
+class ModelRegistry:
+    """
+    Versioned model artifacts on local disk.
+
+        <root>/registry.json        {"current": "v0003", "previous": "v0002"}
+        <root>/v0003/model.pkl
+        <root>/v0003/feature_cols.pkl
+        <root>/v0003/manifest.json  version, created_at, schema_hash, metrics...
+
+    Each version directory is written under a temporary name and renamed
+    into place, and registry.json is replaced atomically, so a reader
+    never sees half an artifact.
+    """
+
+    def __init__(self, root="model_registry"):
+        self.root = root
+        self._lock = threading.Lock()
+
+    # ---------- reading ----------
+    def _read_pointer(self):
+        path = os.path.join(self.root, "registry.json")
+        if not os.path.exists(path):
+            return {"current": None, "previous": None}
+        with open(path) as f:
+            return json.load(f)
+
+    def current(self):
+        return self._read_pointer().get("current")
+
+    def pointer(self):
+        """(current, updated_at) of registry.json; changes whenever the pointer is rewritten."""
+        pointer = self._read_pointer()
+        return pointer.get("current"), pointer.get("updated_at")
+
+    def previous(self):
+        return self._read_pointer().get("previous")
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root)
+                      if d.startswith("v") and os.path.exists(os.path.join(self.root, d, "manifest.json")))
+
+    def manifest(self, version):
+        with open(os.path.join(self.root, version, "manifest.json")) as f:
+            return json.load(f)
+
+    def model_path(self, version):
+        return os.path.join(self.root, version, "model.pkl")
+
+    def load(self, version):
+        """Return (model, feature_cols, manifest) for a version."""
+        base = os.path.join(self.root, version)
+        return load(os.path.join(base, "model.pkl")), load(os.path.join(base, "feature_cols.pkl")), \
+            self.manifest(version)
+
+    # ---------- writing ----------
+    def _write_pointer(self, current, previous):
+        path = os.path.join(self.root, "registry.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"current": current, "previous": previous, "updated_at": time.time()}, f)
+        os.replace(tmp, path)
+
+    def publish(self, model, feature_cols, metrics=None, activate=True, extra=None, writers=None):
+        """
+        Store a new version; with activate, point `current` at it. `writers`
+        maps extra artifact filenames to callables that write them to a path.
+        """
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            existing = self.versions()
+            number = int(existing[-1][1:]) + 1 if existing else 1
+            version = f"v{number:04d}"
+
+            tmp = os.path.join(self.root, f".{version}.tmp")
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            dump(model, os.path.join(tmp, "model.pkl"))
+            dump(list(feature_cols), os.path.join(tmp, "feature_cols.pkl"))
+            for filename, write in (writers or {}).items():
+                write(os.path.join(tmp, filename))
+            manifest = {
+                "version": version,
+                "created_at": datetime.now().isoformat(),
+                "model_type": type(model).__name__,
+                "n_features": len(feature_cols),
+                "schema_hash": schema_hash(feature_cols),
+                "metrics": metrics or {},
+                **(extra or {}),
+            }
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2, default=str)
+            os.replace(tmp, os.path.join(self.root, version))
+
+            if activate:
+                self._write_pointer(version, self.current())
+            return version
+
+    def set_current(self, version):
+        with self._lock:
+            current = self.current()
+            if version != current:
+                self._write_pointer(version, current)
+
+
+def check_feature_layout(feature_cols, df, current_cols=None):
+    """
+    Problems that would stop a model with `feature_cols` from being served
+    off `df`; an empty list means it's safe to swap in. A layout identical
+    to the one being served is accepted as is.
+    """
+    if current_cols is not None and schema_hash(feature_cols) == schema_hash(current_cols):
+        return []
+    if df is None:
+        return ["no data loaded to check the feature layout against"]
+
+    stations = set()
+    if "station_original" in df.columns:
+        stations = {f"station_{s}" for s in df["station_original"].dropna().astype(str).unique()}
+
+    missing = [c for c in feature_cols
+               if c not in df.columns and not (c.startswith("station_") and (c in stations or not stations))]
+    return [f"features not available in serving data: {missing}"] if missing else []
+
+
+async def watch_registry(registry, get_loaded, activate, interval_seconds=30):
+    """
+    Poll registry.json and, whenever the pointer is rewritten (e.g. after
+    pre_train.py publishes), activate its `current` if that isn't already
+    loaded. Only pointer changes count, so a model swapped in outside the
+    registry (a rollback to the legacy pickles) stays until the pointer
+    moves, and a version that failed to activate isn't retried until then.
+    """
+    try:
+        seen = registry.pointer()
+    except Exception as e:
+        seen = None
+        log.warning("⚠️ Model watcher could not read the registry: %s", e)
+    while True:
+        await asyncio.sleep(interval_seconds)
+        version = None
+        try:
+            pointer = registry.pointer()
+            if pointer == seen:
+                continue
+            seen = pointer
+            version = pointer[0]
+            if version and version != get_loaded():
+                await asyncio.to_thread(activate, version)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("⚠️ Model watcher could not %s: %s",
+                        f"activate {version}" if version else "read the registry", e)
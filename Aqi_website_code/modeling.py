@@ -1,11 +1,172 @@
+import io
+import time
+import warnings
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from joblib import Parallel, delayed, dump
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import r2_score, mean_squared_error
 from pandas.api.types import is_datetime64_any_dtype
 
 
-def train_model(df, target_col=None):
+# Candidate models for latency-budgeted selection (train_model(candidates=...)).
+# "rf_full" is the model train_model fits by default, kept for comparison.
+DEFAULT_CANDIDATES = {
+    "rf_full": lambda: RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=-1, max_depth=None),
+    "rf_100_d16": lambda: RandomForestRegressor(n_estimators=100, max_depth=16, min_samples_leaf=2, random_state=42),
+    "rf_50_d10": lambda: RandomForestRegressor(n_estimators=50, max_depth=10, min_samples_leaf=4, random_state=42),
+    "hgb": lambda: HistGradientBoostingRegressor(max_iter=300, learning_rate=0.05, random_state=42),
+    "ridge": lambda: make_pipeline(SimpleImputer(), StandardScaler(), Ridge(alpha=1.0)),
+    "linear": lambda: make_pipeline(SimpleImputer(), LinearRegression()),
+}
+
+
+def resolve_candidates(candidates):
+    """
+    {name: unfitted estimator} from "all", a list of DEFAULT_CANDIDATES
+    names, or a dict that already maps names to estimators.
+    """
+    if candidates == "all":
+        candidates = list(DEFAULT_CANDIDATES)
+    if isinstance(candidates, dict):
+        return {name: clone(est) for name, est in candidates.items()}
+    unknown = [c for c in candidates if c not in DEFAULT_CANDIDATES]
+    if unknown:
+        raise ValueError(f"❌ Unknown model candidates: {unknown} (choose from {list(DEFAULT_CANDIDATES)})")
+    return {name: DEFAULT_CANDIDATES[name]() for name in candidates}
+
+
+def _fit_candidate(name, estimator, X_train, y_train):
+    start = time.perf_counter()
+    estimator.fit(X_train, y_train)
+    return name, estimator, time.perf_counter() - start
+
+
+def _median_ms(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+def profile_model(model, X_test, y_test, repeats=50, batch_rows=1000):
+    """
+    Serving cost and accuracy of a fitted model: pickled size, median
+    single-row and batch predict latency (on bare arrays, as the forecast
+    loop calls it) and test RMSE / R².
+    """
+    buf = io.BytesIO()
+    dump(model, buf)
+    X = np.asarray(X_test, dtype=np.float64)
+    row, batch = X[:1], X[:batch_rows]
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        model.predict(row)  # warm up
+        single_ms = _median_ms(lambda: model.predict(row), repeats)
+        batch_ms = _median_ms(lambda: model.predict(batch), max(3, repeats // 10))
+        y_pred = model.predict(X)
+
+    return {
+        "size_mb": round(buf.getbuffer().nbytes / 1e6, 3),
+        "single_row_ms": round(single_ms, 3),
+        "batch_ms": round(batch_ms, 3),
+        "batch_rows": len(batch),
+        "rmse": float(np.sqrt(mean_squared_error(y_test, y_pred))),
+        "test_r2": float(r2_score(y_test, y_pred)),
+    }
+
+
+def select_model(X_train, y_train, X_test, y_test, candidates="all",
+                 max_latency_ms=None, max_size_mb=None, n_jobs=-1):
+    """
+    Fit every candidate (in parallel processes), profile each one in turn
+    and return (model, report) for the lowest-RMSE candidate whose
+    single-row latency and artifact size are within budget. If nothing
+    fits the budget the fastest candidate is returned, flagged in the report.
+    """
+    if len(y_test) == 0:
+        raise ValueError("❌ Model selection needs a non-empty test split")
+
+    estimators = resolve_candidates(candidates)
+    print(f"📌 Fitting {len(estimators)} candidate models: {list(estimators)}")
+    fitted = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_candidate)(name, est, X_train, y_train) for name, est in estimators.items()
+    )
+
+    # Profiled sequentially so candidates don't compete for cores while timed
+    rows, models = [], {}
+    for name, model, fit_seconds in fitted:
+        entry = {"name": name, "model_type": type(model).__name__, "fit_seconds": round(fit_seconds, 3)}
+        entry.update(profile_model(model, X_test, y_test))
+        entry["within_budget"] = (max_latency_ms is None or entry["single_row_ms"] <= max_latency_ms) and \
+                                 (max_size_mb is None or entry["size_mb"] <= max_size_mb)
+        print(f"   {name:<12} rmse={entry['rmse']:.3f} r2={entry['test_r2']:.3f} "
+              f"1-row={entry['single_row_ms']:.2f}ms size={entry['size_mb']:.2f}MB fit={fit_seconds:.1f}s")
+        rows.append(entry)
+        models[name] = model
+
+    eligible = [r for r in rows if r["within_budget"]]
+    if eligible:
+        chosen = min(eligible, key=lambda r: r["rmse"])
+    else:
+        chosen = min(rows, key=lambda r: r["single_row_ms"])
+        print(f"⚠️ No candidate meets the budget → using the fastest ({chosen['name']})")
+
+    print(f"✅ Selected model: {chosen['name']}")
+    report = {
+        "selected": chosen["name"],
+        "budget": {"max_latency_ms": max_latency_ms, "max_size_mb": max_size_mb},
+        "budget_met": bool(eligible),
+        "candidates": rows,
+    }
+    return models[chosen["name"]], report
+
+
+def split_features(df, target_col):
+    """(X, y): numeric feature columns and the target, as train_model uses them."""
+    drop_cols = ["Timestamp", "_id", "city", target_col, "timestamp"]
+    X = df.drop(columns=[c for c in drop_cols if c in df], errors="ignore")
+    # Keep only numeric columns
+    return X.select_dtypes(include=["number"]), df[target_col]
+
+
+def time_split(df):
+    """Train on every year but the last and test on the last; 80/20 by time if there's one year."""
+    years = sorted(df["Timestamp"].dt.year.unique())
+    print("📌 Years available in data:", years)
+
+    if len(years) >= 2:
+        # Train on all years except last
+        last_year = years[-1]
+        print(f"📌 Training on years < {last_year}, testing on year {last_year}")
+
+        train_df = df[df["Timestamp"].dt.year < last_year]
+        test_df = df[df["Timestamp"].dt.year == last_year]
+    else:
+        # Only one year → 80/20 time split
+        print("⚠️ Only one year in dataset — using 80/20 time split")
+        df = df.sort_values("Timestamp")
+        split_idx = int(len(df) * 0.8)
+        train_df = df.iloc[:split_idx]
+        test_df = df.iloc[split_idx:]
+    return train_df, test_df
+
+
+def train_model(df, target_col=None, candidates=None, max_latency_ms=None, max_size_mb=None):
+    """
+    Fit the PM25 model. By default this is a single RandomForest; pass
+    candidates ("all", a list of DEFAULT_CANDIDATES names or a dict of
+    estimators) to pick the best model within the latency / size budget
+    instead, with the comparison in results["selection"].
+    """
     print("\n================== MODEL TRAINING START ==================\n")
 
     # 1️⃣ Basic checks
@@ -32,23 +193,7 @@ def train_model(df, target_col=None):
     print(f"✅ Using target column: {target_col}")
 
     # 4️⃣ Multi-year or fallback split
-    years = sorted(df["Timestamp"].dt.year.unique())
-    print("📌 Years available in data:", years)
-
-    if len(years) >= 2:
-        # Train on all years except last
-        last_year = years[-1]
-        print(f"📌 Training on years < {last_year}, testing on year {last_year}")
-
-        train_df = df[df["Timestamp"].dt.year < last_year]
-        test_df = df[df["Timestamp"].dt.year == last_year]
-    else:
-        # Only one year → 80/20 time split
-        print("⚠️ Only one year in dataset — using 80/20 time split")
-        df = df.sort_values("Timestamp")
-        split_idx = int(len(df) * 0.8)
-        train_df = df.iloc[:split_idx]
-        test_df = df.iloc[split_idx:]
+    train_df, test_df = time_split(df)
 
     print("📌 Train size:", train_df.shape, " Test size:", test_df.shape)
 
@@ -56,16 +201,8 @@ def train_model(df, target_col=None):
         raise ValueError("❌ No training data found after split")
 
     # 5️⃣ Remove non-feature columns
-    drop_cols = ["Timestamp", "_id", "city", target_col, "timestamp"]
-    X_train = train_df.drop(columns=[c for c in drop_cols if c in train_df], errors="ignore")
-    y_train = train_df[target_col]
-
-    X_test = test_df.drop(columns=[c for c in drop_cols if c in test_df], errors="ignore")
-    y_test = test_df[target_col]
-
-    # Keep only numeric columns
-    X_train = X_train.select_dtypes(include=["number"])
-    X_test = X_test.select_dtypes(include=["number"])
+    X_train, y_train = split_features(train_df, target_col)
+    X_test, y_test = split_features(test_df, target_col)
 
     if X_train.shape[1] == 0:
         raise ValueError("❌ No numeric columns available to train")
@@ -74,13 +211,18 @@ def train_model(df, target_col=None):
     print("📌 Final Training Features:", list(X_train.columns))
     print("📌 X_train:", X_train.shape, " X_test:", X_test.shape)
 
-    model = RandomForestRegressor(
-        n_estimators=200,
-        random_state=42,
-        n_jobs=-1,
-        max_depth=None
-    )
-    model.fit(X_train, y_train)
+    selection = None
+    if candidates is None:
+        model = RandomForestRegressor(
+            n_estimators=200,
+            random_state=42,
+            n_jobs=-1,
+            max_depth=None
+        )
+        model.fit(X_train, y_train)
+    else:
+        model, selection = select_model(X_train, y_train, X_test, y_test, candidates,
+                                        max_latency_ms=max_latency_ms, max_size_mb=max_size_mb)
 
     # Predictions
     y_pred_train = model.predict(X_train)
@@ -113,4 +255,233 @@ def train_model(df, target_col=None):
         "train_r2": train_r2,
         "test_r2": test_r2,
         "rmse": rmse,
+        "selection": selection,
+    }
+
+
+def evaluate_model(model, X, y):
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        y_pred = model.predict(X)
+    return {
+        "rows": len(y),
+        "rmse": float(np.sqrt(mean_squared_error(y, y_pred))),
+        "r2": float(r2_score(y, y_pred)) if len(y) > 1 else None,
+    }
+
+
+def update_model(model, df, since, feature_cols, reference_rmse=None, target_col="PM25",
+                 drift_threshold=0.2, new_trees=25, max_trees=400, window_days=90, min_rows=24):
+    """
+    Bring a persisted model up to date with the rows after `since` (the
+    raw timestamp watermark of its last training run) instead of refitting
+    on the whole history.
+
+    The current model is scored on those fresh rows first; they are
+    unseen, so that RMSE is an honest drift check against `reference_rmse`
+    (the test RMSE of the last full retrain). If it has degraded by more
+    than drift_threshold the model is retrained from scratch with
+    train_model. Otherwise a RandomForest grows `new_trees` trees on the
+    fresh rows via warm_start and any other model is refit on the last
+    window_days of data. The forest's base trees (those of the last full
+    retrain, fitted on the whole history) are always kept; only the added
+    trees slide, the oldest dropped once the forest passes max_trees.
+
+    Returns a train_model-style results dict plus "mode" ("incremental",
+    "full" or "skipped", the latter when fewer than min_rows are new) and
+    "validation".
+    """
+    df = df.copy()
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], utc=True, errors="coerce")
+    fresh = df[df["Timestamp"] > pd.to_datetime(since, utc=True)]
+
+    X_fresh, y_fresh = split_features(fresh, target_col)
+    missing = [c for c in feature_cols if c not in X_fresh.columns]
+    if missing:
+        print(f"⚠️ Features {missing} no longer in the data → full retrain")
+        return {**train_model(df, target_col), "mode": "full", "validation": {"reason": "schema"}}
+    X_fresh = X_fresh[list(feature_cols)]
+
+    if len(X_fresh) < min_rows:
+        print(f"📌 Only {len(X_fresh)} new rows since {since} → nothing to update")
+        return {"model": model, "mode": "skipped", "validation": {"rows": len(X_fresh)}}
+
+    validation = evaluate_model(model, X_fresh.to_numpy(dtype=np.float64), y_fresh)
+    validation["reference_rmse"] = reference_rmse
+    validation["drift"] = None if not reference_rmse else validation["rmse"] / reference_rmse - 1
+    print(f"📌 Fresh-data RMSE {validation['rmse']:.3f} on {len(X_fresh)} rows "
+          f"(reference {reference_rmse}, drift {validation['drift']})")
+
+    if validation["drift"] is not None and validation["drift"] > drift_threshold:
+        print(f"⚠️ Drift {validation['drift']:.1%} > {drift_threshold:.0%} → full retrain")
+        return {**train_model(df, target_col), "mode": "full", "validation": {**validation, "reason": "drift"}}
+
+    start = time.perf_counter()
+    if isinstance(model, RandomForestRegressor):
+        # Trees of the last full retrain; a model that was never updated has only those
+        base = getattr(model, "n_base_estimators_", len(model.estimators_))
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+        model.fit(X_fresh, y_fresh)
+        keep = max(max_trees - base, new_trees)
+        if len(model.estimators_) - base > keep:
+            # Sliding forest over the added trees: the oldest describe the oldest fresh rows
+            model.estimators_ = model.estimators_[:base] + model.estimators_[-keep:]
+            model.set_params(n_estimators=len(model.estimators_))
+        model.n_base_estimators_ = base
+        print(f"✅ Added {new_trees} trees on {len(X_fresh)} fresh rows "
+              f"({len(model.estimators_)} total, {base} base)")
+        X_train, y_train = X_fresh, y_fresh
+    else:
+        recent = df[df["Timestamp"] > df["Timestamp"].max() - pd.Timedelta(days=window_days)]
+        X_train, y_train = split_features(recent, target_col)
+        X_train = X_train[list(feature_cols)]
+        model = clone(model).fit(X_train, y_train)
+        print(f"✅ Refit {type(model).__name__} on the last {window_days} days ({len(X_train)} rows)")
+    validation["update_seconds"] = round(time.perf_counter() - start, 3)
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        y_pred_train = model.predict(X_train)
+    return {
+        "model": model,
+        "mode": "incremental",
+        "validation": validation,
+        "X_train": X_train,
+        "y_train": y_train,
+        "y_pred_train": y_pred_train,
+        "train_r2": r2_score(y_train, y_pred_train),
+        # Scores of the pre-update model on data it hadn't seen
+        "test_r2": validation["r2"],
+        "rmse": validation["rmse"],
+        "selection": None,
     }
+
+
+# ------------------------------
+# Direct multi-horizon models
+# ------------------------------
+class DirectForecaster:
+    """
+    One multi-output model per block of horizons (+1h..+6h, +7h..+12h, ...)
+    fitted on the same features as the recursive model, so the whole
+    horizon for a seed row comes out of one predict call per block with no
+    step depending on the previous one. predict returns (n_rows x hours).
+    """
+
+    def __init__(self, blocks, feature_names, target_col="PM25"):
+        self.blocks = blocks  # [(first_hour, last_hour, fitted model), ...]
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.n_features_in_ = len(feature_names)
+        self.hours = blocks[-1][1]
+        self.target_col = target_col
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="X does not have valid feature names")
+            parts = [np.asarray(model.predict(X)).reshape(len(X), -1) for _, _, model in self.blocks]
+        return np.hstack(parts)
+
+
+def direct_targets(df, hours, target_col="PM25"):
+    """
+    (n_rows x hours) frame of the target `h` hours after each row, matched on
+    Timestamp (and station when the frame has one); NaN where it isn't known.
+    """
+    ts = pd.DatetimeIndex(pd.to_datetime(df["Timestamp"], utc=True))
+    station = df["station_original"].astype(str).to_numpy() if "station_original" in df.columns else None
+
+    def index(times):
+        return pd.MultiIndex.from_arrays([station, times]) if station is not None else pd.Index(times)
+
+    observed = pd.Series(df[target_col].to_numpy(dtype=np.float64), index=index(ts))
+    observed = observed[~observed.index.duplicated(keep="first")]
+    return pd.DataFrame(
+        {h: observed.reindex(index(ts + pd.Timedelta(hours=h))).to_numpy() for h in range(1, hours + 1)},
+        index=df.index,
+    )
+
+
+def default_direct_estimator():
+    return RandomForestRegressor(n_estimators=100, max_depth=16, min_samples_leaf=2, random_state=42, n_jobs=-1)
+
+
+def train_direct_model(df, hours=72, block=6, target_col="PM25", estimator=None):
+    """
+    Fit a DirectForecaster for +1..+hours. block=None (or >= hours) fits a
+    single multi-output model for the whole horizon. Uses the same time
+    split and feature columns as train_model; results carry the test RMSE
+    per horizon.
+    """
+    print("\n================== DIRECT MODEL TRAINING START ==================\n")
+    df = df.copy()
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], utc=True, errors="coerce")
+    df = df.dropna(subset=["Timestamp"])
+
+    targets = direct_targets(df, hours, target_col)
+    train_df, test_df = time_split(df)
+    X_train, _ = split_features(train_df, target_col)
+    X_test, _ = split_features(test_df, target_col)
+    Y_train, Y_test = targets.loc[train_df.index], targets.loc[test_df.index]
+
+    block = hours if not block or block >= hours else block
+    blocks = []
+    for first in range(1, hours + 1, block):
+        cols = list(range(first, min(first + block - 1, hours) + 1))
+        known = Y_train[cols].notna().all(axis=1).to_numpy()
+        if not known.any():
+            raise ValueError(f"❌ No training rows with targets for +{cols[0]}h..+{cols[-1]}h")
+        model = clone(estimator) if estimator is not None else default_direct_estimator()
+        y = Y_train.loc[known, cols].to_numpy()
+        model.fit(X_train[known], y if len(cols) > 1 else y.ravel())
+        blocks.append((cols[0], cols[-1], model))
+        print(f"✅ Fitted +{cols[0]}h..+{cols[-1]}h on {known.sum()} rows")
+
+    direct = DirectForecaster(blocks, list(X_train.columns), target_col)
+
+    rmse_by_horizon = None
+    if not X_test.empty:
+        pred = direct.predict(X_test)
+        actual = Y_test.to_numpy()
+        rmse_by_horizon = [
+            float(np.sqrt(np.nanmean((pred[:, h] - actual[:, h]) ** 2))) if np.isfinite(actual[:, h]).any() else None
+            for h in range(hours)
+        ]
+        print(f"📌 Test RMSE +1h={rmse_by_horizon[0]}  +{hours}h={rmse_by_horizon[-1]}")
+
+    print("\n================== DIRECT MODEL TRAINING END ==================\n")
+    return {"model": direct, "X_train": X_train, "X_test": X_test, "Y_test": Y_test,
+            "rmse_by_horizon": rmse_by_horizon}
+
+
+def compare_horizon_modes(df, recursive_model, direct_model, origins=24, hours=None, target_col="PM25"):
+    """
+    Backtest both serving modes from the same forecast origins (evenly
+    spread over the last 20% of the frame): recursive forecasts seeded from
+    the origin row versus one direct predict. Returns RMSE per horizon for
+    each mode plus their averages.
+    """
+    # Imported here: forecasting depends on this module's callers, not the reverse
+    from forecasting import forecast_from_row, forecast_direct_from_row
+
+    hours = hours or direct_model.hours
+    df = df.sort_values("Timestamp").reset_index(drop=True)
+    targets = direct_targets(df, hours, target_col).to_numpy()
+
+    candidates = np.arange(int(len(df) * 0.8), len(df))
+    candidates = candidates[np.isfinite(targets[candidates]).any(axis=1)]
+    picks = candidates[np.linspace(0, len(candidates) - 1, min(origins, len(candidates))).astype(int)]
+
+    errors = {"recursive": [], "direct": []}
+    for i in picks:
+        actual = targets[i]
+        errors["recursive"].append(forecast_from_row(df, i, recursive_model, hours) - actual)
+        errors["direct"].append(forecast_direct_from_row(df, i, direct_model, hours) - actual)
+
+    report = {"origins": len(picks), "hours": hours}
+    for mode, errs in errors.items():
+        sq = np.vstack(errs) ** 2
+        per_h = np.sqrt(np.nanmean(sq, axis=0))
+        report[mode] = {"rmse_by_horizon": [None if np.isnan(v) else float(v) for v in per_h],
+                        "rmse": float(np.sqrt(np.nanmean(sq)))}
+    return report
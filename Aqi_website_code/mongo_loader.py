@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+
+# Output column → pollutant sub-fields that feed it; the first non-null in
+# this order wins, whatever order the document's keys come in.
+# Covers the backend's HourlyData schema plus spellings from older imports.
+# ("PM2.5" can't be addressed in a projection; cron.js writes PM25.)
+POLLUTANT_FIELDS = {
+    "PM25": ["PM25", "pm25", "pm2_5"],
+    "PM10": ["PM10"],
+    "NO": ["NO"],
+    "NO2": ["NO2"],
+    "NOx": ["NOx"],
+    "NH3": ["NH3"],
+    "SO2": ["SO2"],
+    "CO": ["CO"],
+    "CO2": ["CO2"],
+    "Ozone": ["Ozone"],
+    "O3": ["O3"],
+    "AQI": ["AQI"],
+    "Benzene": ["Benzene"],
+    "Toluene": ["Toluene"],
+    "Xylene": ["Xylene"],
+    "O-Xylene": ["O-Xylene"],
+    "O_Xylene": ["O_Xylene"],
+    "EthBenzene": ["EthBenzene"],
+    "MPXylene": ["MPXylene"],
+    "AT": ["AT"],
+    "Temp": ["Temp"],
+    "RH": ["RH"],
+    "WS": ["WS"],
+    "WD": ["WD"],
+    "VWS": ["VWS"],
+    "Gust": ["Gust"],
+    "RF": ["RF"],
+    "TOTRF": ["TOTRF"],
+    "SR": ["SR"],
+    "BP": ["BP"],
+    "Power": ["Power"],
+    "Variance": ["Variance"],
+}
+
+
+def _grow(buf, size, fill):
+    out = np.full(size, fill, dtype=buf.dtype)
+    out[:len(buf)] = buf
+    return out
+
+
+def _to_array(values, dtype):
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        # A stray string somewhere in the batch; coerce like pd.to_numeric
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=dtype)
+
+
+def load_hourly_frame(collection, query=None, limit=None, batch_size=5000,
+                      fields=POLLUTANT_FIELDS, dtype=np.float32):
+    """
+    Stream `hourly_data` documents into typed column buffers.
+
+    Pollutant sub-fields are projected server-side. Each cursor batch is
+    gathered into per-column value lists and flushed into float32 arrays
+    (allocated the first time a field shows up), so the whole result never
+    exists as a list of documents or goes through json_normalize; peak
+    memory is the column buffers plus one batch. Returns the same layout as load_data_from_mongo, newest
+    first, with the newest raw timestamp in attrs["watermark"].
+    """
+    projection = {"_id": 0, "station": 1, "city": 1, "timestamp": 1}
+    for keys in fields.values():
+        for key in keys:
+            projection[f"pollutants.{key}"] = 1
+
+    cursor = collection.find(query or {}, projection, batch_size=batch_size)
+    if limit:
+        # Only a capped load needs the server to pick the newest rows
+        cursor = cursor.sort("timestamp", -1).limit(limit)
+
+    source = {key: (col, rank) for col, keys in fields.items() for rank, key in enumerate(keys)}
+    cap = limit or batch_size
+    columns = {}
+    stations = np.empty(cap, dtype=object)
+    cities = np.empty(cap, dtype=object)
+    raw_ts = np.empty(cap, dtype=object)
+    n = 0
+
+    def flush(rows, values, meta):
+        nonlocal cap, stations, cities, raw_ts, n
+        size = len(meta)
+        if n + size > cap:
+            cap = max(cap * 2, n + size)
+            for col in columns:
+                columns[col] = _grow(columns[col], cap, np.nan)
+            stations, cities, raw_ts = (_grow(a, cap, None) for a in (stations, cities, raw_ts))
+
+        stations[n:n + size], cities[n:n + size], raw_ts[n:n + size] = zip(*meta)
+        for col in values:
+            # Buffers are only allocated for fields that actually occur
+            if col not in columns:
+                columns[col] = np.full(cap, np.nan, dtype=dtype)
+            columns[col][n + np.asarray(rows[col])] = _to_array(values[col], dtype)
+        n += size
+
+    # Per batch: for each column, the row offsets that carry it and their values
+    # (and the rank of the spelling that filled each column's latest row)
+    rows, values, meta, ranks = {}, {}, [], {}
+    for doc in cursor:
+        i = len(meta)
+        meta.append((doc.get("station"), doc.get("city"), doc.get("timestamp")))
+        for key, value in (doc.get("pollutants") or {}).items():
+            hit = source.get(key)
+            if hit is None or value is None:
+                continue
+            col, rank = hit
+            col_rows = rows.setdefault(col, [])
+            if col_rows and col_rows[-1] == i:
+                # Another spelling already filled this column; the one listed first wins
+                if rank < ranks[col]:
+                    values[col][-1], ranks[col] = value, rank
+                continue
+            col_rows.append(i)
+            values.setdefault(col, []).append(value)
+            ranks[col] = rank
+
+        if len(meta) == batch_size:
+            flush(rows, values, meta)
+            rows, values, meta = {}, {}, []
+    if meta:
+        flush(rows, values, meta)
+
+    if n == 0:
+        return pd.DataFrame()
+
+    raw_ts = raw_ts[:n]
+    data = {
+        "station": stations[:n],
+        "city": cities[:n],
+        "Timestamp": pd.to_datetime(pd.Series(raw_ts), errors="coerce", utc=True),
+    }
+    data["station_original"] = data["station"]
+    for col in fields:
+        if col in columns:
+            data[col] = columns[col][:n]
+
+    df = pd.DataFrame(data)
+    df = df.sort_values("Timestamp", ascending=False, kind="stable", na_position="last")
+    if "PM25" not in df.columns:
+        raise ValueError("❌ PM25 column missing from MongoDB data.")
+    df = df.dropna(subset=["PM25"]).reset_index(drop=True)
+
+    valid = [t for t in raw_ts if t is not None]
+    df.attrs["watermark"] = max(valid) if valid else None
+    return df
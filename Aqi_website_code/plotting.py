@@ -1,37 +1,139 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-import os 
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+import numpy as np
+from matplotlib.figure import Figure
 
 os.makedirs("plots", exist_ok=True)
 
-def plot_feature_importance(model, X, top_n=20):
-    importances = model.feature_importances_
-    feat_imp_df = pd.DataFrame({
-        'Feature': X.columns,
-        'Importance': importances
-    }).sort_values(by='Importance', ascending=False)
-
-    plt.figure(figsize=(10, 6))
-    sns.barplot(data=feat_imp_df.head(top_n), x='Importance', y='Feature')
-    plt.title("Top Feature Importances")
-    plt.tight_layout()
-    plt.savefig("feature_importance.png", dpi=300, bbox_inches="tight")
-    plt.close()
-
-def plot_actual_vs_pred(y_train, y_pred_train, y_test, y_pred_test):
-    fig, axes = plt.subplots(2, 1, figsize=(12, 8), sharex=True)
-
-    axes[0].plot(y_train.values, label="Actual Train", alpha=0.7)
-    axes[0].plot(y_pred_train, label="Predicted Train", alpha=0.7)
-    axes[0].set_title("Train Data: Actual vs Predicted")
-    axes[0].legend()
-
-    axes[1].plot(y_test.values, label="Actual Test", alpha=0.7)
-    axes[1].plot(y_pred_test, label="Predicted Test", alpha=0.7)
-    axes[1].set_title("Test Data: Actual vs Predicted")
-    axes[1].legend()
-
-    plt.tight_layout()
-    plt.savefig("plots/actual_vs_predicted.png", dpi=300, bbox_inches="tight")
-    plt.close()
+# Points per plotted line; LTTB keeps the peaks and troughs of longer series
+PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "2000"))
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of a Largest-Triangle-Three-Buckets downsample of (x, y) to
+    n_out points. The first and last points are kept; every bucket in
+    between contributes the point forming the largest triangle with the
+    previously kept point and the next bucket's average, so spikes survive
+    where plain striding would drop them.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def downsample(x, y, max_points=PLOT_MAX_POINTS):
+    """(x, y) reduced to at most max_points with lttb; non-finite y values are dropped."""
+    x, y = np.asarray(x), np.asarray(y, dtype=np.float64)
+    keep = np.isfinite(y)
+    x, y = x[keep], y[keep]
+    xs = x.astype("datetime64[ns]").astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x
+    idx = lttb(xs, y, max_points)
+    return x[idx], y[idx]
+
+
+def actual_vs_pred_figure(panels, max_points=PLOT_MAX_POINTS, sharex=False):
+    """
+    One subplot per (title, label, x, actual, predicted) panel, each line
+    downsampled to max_points. Built on a bare Figure (no pyplot), so it
+    can render from API worker threads.
+    """
+    fig = Figure(figsize=(12, 4 * len(panels)))
+    axes = fig.subplots(len(panels), 1, sharex=sharex, squeeze=False)[:, 0]
+    for ax, (title, label, x, actual, predicted) in zip(axes, panels):
+        ax.plot(*downsample(x, actual, max_points), label=f"Actual {label}", alpha=0.7)
+        if predicted is not None:
+            ax.plot(*downsample(x, predicted, max_points), label=f"Predicted {label}", alpha=0.7)
+        ax.set_title(title)
+        ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def feature_importance_figure(names, importances, top_n=20):
+    """Horizontal bars for the top_n importances, largest at the top."""
+    importances = np.asarray(importances, dtype=np.float64)
+    top = np.argsort(importances)[::-1][:top_n]
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.barh([str(names[i]) for i in top[::-1]], importances[top[::-1]])
+    ax.set_xlabel("Importance")
+    ax.set_title("Top Feature Importances")
+    fig.tight_layout()
+    return fig
+
+
+def figure_png(fig, dpi=100):
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight")
+    return buf.getvalue()
+
+
+def plot_feature_importance(model, X, top_n=20, dpi=300, path="feature_importance.png"):
+    fig = feature_importance_figure(list(X.columns), model.feature_importances_, top_n)
+    fig.savefig(path, dpi=dpi, bbox_inches="tight")
+
+
+def plot_actual_vs_pred(y_train, y_pred_train, y_test, y_pred_test, dpi=300, max_points=PLOT_MAX_POINTS,
+                        path="plots/actual_vs_predicted.png"):
+    fig = actual_vs_pred_figure([
+        ("Train Data: Actual vs Predicted", "Train", np.arange(len(y_train)), y_train, y_pred_train),
+        ("Test Data: Actual vs Predicted", "Test", np.arange(len(y_test)), y_test, y_pred_test),
+    ], max_points, sharex=True)
+    fig.savefig(path, dpi=dpi, bbox_inches="tight")
+
+
+class PlotCache:
+    """
+    Rendered PNGs keyed by whatever determines them (kind, model version,
+    date range...). Least recently used entries go once there are more than
+    max_entries, and anything older than ttl_seconds is re-rendered.
+    """
+
+    def __init__(self, max_entries=32, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,18 +1,166 @@
 import pandas as pd
 from ml_api import load_data_from_mongo
-from preprocessing import preprocess_data
-from modeling import train_model
+from preprocessing import preprocess_data, preprocess_tail
+from modeling import train_model, update_model, train_direct_model, compare_horizon_modes
+from model_registry import ModelRegistry
+from compiled_forest import compile_forest
+from compact import compact_frame
+from snapshot import write_snapshot, read_snapshot, snapshot_exists
+from plotting import plot_actual_vs_pred, plot_feature_importance
+from backtest import backtest, backtest_report
 from joblib import dump
+import json
+import os
+import sys
 
-# Load & preprocess data
-df = load_data_from_mongo()
-df = preprocess_data(df)
+# Comma-separated modeling.DEFAULT_CANDIDATES names (or "all") turns on
+# latency-budgeted model selection; empty keeps the single RandomForest
+MODEL_CANDIDATES = os.getenv("MODEL_CANDIDATES", "")
+MODEL_MAX_LATENCY_MS = float(os.getenv("MODEL_MAX_LATENCY_MS", "0")) or None
+MODEL_MAX_SIZE_MB = float(os.getenv("MODEL_MAX_SIZE_MB", "0")) or None
 
-# Train model
-results = train_model(df)
+# "incremental" updates the current registry model with rows past its watermark
+# (falling back to a full retrain on drift); "full" always retrains from scratch
+TRAIN_MODE = os.getenv("TRAIN_MODE", "full")
+MODEL_DRIFT_THRESHOLD = float(os.getenv("MODEL_DRIFT_THRESHOLD", "0.2"))
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots/latest")
 
-# Save model + feature columns
+# >0 also fits a direct multi-horizon model (one multi-output model per DIRECT_BLOCK hours)
+DIRECT_HOURS = int(os.getenv("DIRECT_HOURS", "0"))
+DIRECT_BLOCK = int(os.getenv("DIRECT_BLOCK", "6"))
+
+# Publish downsampled actual-vs-predicted / feature-importance PNGs with every version
+TRAIN_PLOTS = os.getenv("TRAIN_PLOTS", "1") == "1"
+PLOT_DPI = int(os.getenv("PLOT_DPI", "100"))
+
+# Rolling-origin backtest of the recursive forecast (origins per station; 0 skips it)
+BACKTEST_ORIGINS = int(os.getenv("BACKTEST_ORIGINS", "24"))
+BACKTEST_HOURS = int(os.getenv("BACKTEST_HOURS", "72"))
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", "0")) or None
+
+registry = ModelRegistry(os.getenv("MODEL_REGISTRY_DIR", "model_registry"))
+current = registry.current()
+manifest = registry.manifest(current) if current else {}
+
+incremental = TRAIN_MODE == "incremental" and manifest.get("watermark") \
+    and snapshot_exists(SNAPSHOT_DIR)
+
+if incremental:
+    # Only rows past the snapshot's watermark are pulled and preprocessed
+    df, meta = read_snapshot(SNAPSHOT_DIR)
+    new_raw = load_data_from_mongo(since=meta["watermark"], limit=None)
+    watermark = new_raw.attrs.get("watermark") or meta["watermark"]
+    df = preprocess_tail(df, new_raw)
+
+    model, feature_cols, _ = registry.load(current)
+    reference_rmse = manifest.get("reference_rmse") or manifest.get("metrics", {}).get("rmse")
+    results = update_model(model, df, manifest["watermark"], feature_cols,
+                           reference_rmse=reference_rmse, drift_threshold=MODEL_DRIFT_THRESHOLD)
+    if results["mode"] == "skipped":
+        # A quiet hour is a normal outcome for the hourly retrain, not a failure
+        print(f"✅ {current} is up to date, nothing published")
+        sys.exit(0)
+else:
+    # Load & preprocess data
+    df = load_data_from_mongo()
+    watermark = df.attrs.get("watermark")
+    df = preprocess_data(df)
+
+    # Train model
+    candidates = None
+    if MODEL_CANDIDATES:
+        candidates = "all" if MODEL_CANDIDATES == "all" else [c.strip() for c in MODEL_CANDIDATES.split(",") if c.strip()]
+    results = train_model(df, candidates=candidates,
+                          max_latency_ms=MODEL_MAX_LATENCY_MS, max_size_mb=MODEL_MAX_SIZE_MB)
+    results["mode"] = "full"
+
+selection = results["selection"]
+
+# Save model + feature columns (+ the selection report next to them)
 dump(results["model"], "pm25_model.pkl")
 dump(list(results["X_train"].columns), "feature_cols.pkl")
 
-print("✅ Model and feature columns saved")
+
+def write_report(path):
+    with open(path, "w") as f:
+        json.dump(selection, f, indent=2)
+
+
+writers = {}
+if selection is not None:
+    write_report("model_selection.json")
+    writers["model_selection.json"] = write_report
+try:
+    # Pre-flattened trees let INFERENCE_BACKEND=compiled start without unpickling sklearn
+    writers["model_compiled.npz"] = compile_forest(results["model"]).save
+except TypeError:
+    pass  # selected model isn't a forest; the compiled backend will serve it via sklearn
+
+if TRAIN_PLOTS:
+    if results.get("y_test") is not None:
+        writers["actual_vs_predicted.png"] = lambda path: plot_actual_vs_pred(
+            results["y_train"], results["y_pred_train"], results["y_test"], results["y_pred_test"],
+            dpi=PLOT_DPI, path=path)
+    if hasattr(results["model"], "feature_importances_"):
+        writers["feature_importance.png"] = lambda path: plot_feature_importance(
+            results["model"], results["X_train"], dpi=PLOT_DPI, path=path)
+
+backtest_summary = None
+if BACKTEST_ORIGINS > 0:
+    # Origins from the test period on, so the forecasts are scored out of sample
+    X_test = results.get("X_test")
+    start = df.loc[X_test.index, "Timestamp"].min() if X_test is not None and len(X_test) else None
+    try:
+        report = backtest_report(backtest(df, results["model"], hours=BACKTEST_HOURS, origins=BACKTEST_ORIGINS,
+                                          start=start, workers=BACKTEST_WORKERS))
+    except ValueError as e:
+        print(f"⚠️ Backtest skipped: {e}")
+    else:
+        backtest_summary = report["summary"]
+
+        def write_backtest(path):
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+        write_backtest("backtest.json")
+        writers["backtest.json"] = write_backtest
+        print(f"✅ Backtest over {report['origins']} origins: " +
+              "  ".join(f"{h} RMSE={v['rmse']}" for h, v in backtest_summary.items()))
+
+# Drift is always measured against the last full retrain's test RMSE
+if results["mode"] != "incremental":
+    reference_rmse = None if results["rmse"] is None else float(results["rmse"])
+
+# Publish a new registry version; a running ml_api picks it up and hot-swaps
+version = registry.publish(
+    results["model"],
+    list(results["X_train"].columns),
+    metrics={k: None if results[k] is None else float(results[k]) for k in ("train_r2", "test_r2", "rmse")},
+    extra={
+        "rows": len(df),
+        "selected": selection and selection["selected"],
+        "training": results["mode"],
+        "parent": current if results["mode"] == "incremental" else None,
+        "watermark": watermark,
+        "reference_rmse": reference_rmse,
+        "validation": results.get("validation"),
+        "backtest": backtest_summary,
+    },
+    writers=writers,
+)
+
+# Direct multi-horizon model + backtest against the recursive model
+if DIRECT_HOURS > 0:
+    direct = train_direct_model(df, hours=DIRECT_HOURS, block=DIRECT_BLOCK)
+    dump(direct["model"], os.getenv("DIRECT_MODEL_PATH", "pm25_direct.pkl"))
+    comparison = compare_horizon_modes(df, results["model"], direct["model"])
+    with open("direct_backtest.json", "w") as f:
+        json.dump(comparison, f, indent=2)
+    print(f"✅ Direct model saved — backtest RMSE direct={comparison['direct']['rmse']:.2f} "
+          f"recursive={comparison['recursive']['rmse']:.2f}")
+
+# Serving snapshot: ml_api starts from this and only pulls rows after the watermark
+os.makedirs(os.path.dirname(SNAPSHOT_DIR) or ".", exist_ok=True)
+write_snapshot(compact_frame(df), SNAPSHOT_DIR, watermark=watermark)
+
+print(f"✅ Model and feature columns saved (registry version {version}, {results['mode']} training)")
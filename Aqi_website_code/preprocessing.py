@@ -1,6 +1,27 @@
+import logging
+import os
+from collections import deque
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from telemetry import get_logger, StageClock
+from feature_state import FeatureState, add_rolling_features, advance_rows, state_for_frame
+from compact import compact_frame
+from csv_ingest import read_dataset_meta, iter_partitions
 
+log = get_logger("preprocessing")
+
+
+# Seasonal weights
+MONTH_WEIGHTS = {1: 1.0, 2: 0.8, 3: 0.6, 4: 0.4, 5: 0.2, 6: 0.1,
+                 7: 0.1, 8: 0.1, 9: 0.2, 10: 0.6, 11: 0.9, 12: 1.0}
+HOUR_WEIGHTS = {i: 0.9 - abs(12 - i) * 0.05 for i in range(24)}
+
+POLLUTANT_COLS = ["PM25", "PM10", "NO2", "O3", "SO2", "CO", "AQI"]
+
+# Opt into per-station preprocessing everywhere preprocess_data is called
+PREPROCESS_PARTITIONED = os.getenv("PREPROCESS_PARTITIONED", "0") == "1"
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "0")) or None
 
 
 def fill_future(ts, col, lookup, max_years=7):
@@ -17,12 +38,57 @@ def fill_future(ts, col, lookup, max_years=7):
     return np.nan
 
 
+def _shift_years(index, years):
+    """Return `index` moved forward by whole years, NaT where that date doesn't exist.
 
+    Mirrors `Timestamp.replace(year=...)`: Feb 29 only maps onto leap years.
+    """
+    naive = index.tz_localize(None) if index.tz is not None else index
+    shifted = pd.to_datetime(
+        pd.DataFrame({"year": naive.year + years, "month": naive.month, "day": naive.day}),
+        errors="coerce",
+    )
+    shifted = pd.DatetimeIndex(shifted) + (naive - naive.normalize())
+    if index.tz is not None:
+        shifted = shifted.tz_localize(index.tz)
+    return shifted
 
-def preprocess_data(df):
 
-    print("🔹 Starting preprocessing...")
-    print(f"📌 Initial DF shape: {df.shape}")
+def fill_future_frame(df, cols, max_years=7):
+    """Columnar version of `fill_future` for a frame indexed by unique timestamps.
+
+    Each missing cell takes the first non-null value found at the same
+    timestamp 1..max_years later, looked up in the unfilled frame, exactly
+    like calling `fill_future` cell by cell against `df.to_dict("index")`.
+    """
+    cols = [c for c in cols if df[c].isna().any()]
+    if not cols:
+        return df
+
+    source = df[cols]
+    filled = source.copy()
+    for year_offset in range(1, max_years + 1):
+        missing = filled.isna()
+        if not missing.to_numpy().any():
+            break
+        future = source.reindex(_shift_years(df.index, year_offset))
+        future.index = df.index
+        filled = filled.mask(missing, future)
+
+    df[cols] = filled
+    return df
+
+
+def preprocess_data(df, partitioned=None, workers=None):
+
+    if partitioned is None:
+        partitioned = PREPROCESS_PARTITIONED
+    if partitioned and "station" in df.columns:
+        return preprocess_partitioned(df, workers=workers or PREPROCESS_WORKERS)
+
+    clock = StageClock("preprocess")
+    log.info("🔹 Starting preprocessing...", extra={"rows": len(df)})
+    log.debug("📌 Initial DF shape: %s", df.shape)
 
     df1 = df.copy()
 
@@ -40,7 +106,7 @@ def preprocess_data(df):
 
 
     if "pollutants" in df1.columns:
-        print("🔧 Extracting nested pollutant fields...")
+        log.debug("🔧 Extracting nested pollutant fields...")
         pollutants_df = df1["pollutants"].apply(lambda x: x if isinstance(x, dict) else {})
         pollutants_df = pd.json_normalize(pollutants_df)
 
@@ -64,7 +130,7 @@ def preprocess_data(df):
         
         df1 = df1.drop(columns=["pollutants"], errors="ignore")
     else:
-        print("⚠️ No 'pollutants' column found! Pollutant values will be missing.")
+        log.debug("No nested 'pollutants' column; using flat pollutant columns")
 
     
     pollutant_cols = ["PM25", "PM10", "NO2", "O3", "SO2", "CO", "AQI"]
@@ -78,15 +144,11 @@ def preprocess_data(df):
 
 
     numeric_cols = df1.select_dtypes(include="number").columns
+    clock.lap("extract")
 
 
-    lookup = df1.to_dict(orient="index")
-
-    for col in numeric_cols:
-        df1[col] = [
-            v if pd.notna(v) else fill_future(ts, col, lookup)
-            for ts, v in zip(df1.index, df1[col])
-        ]
+    df1 = fill_future_frame(df1, numeric_cols)
+    clock.lap("fill_future")
 
 
     if len(numeric_cols) > 0:
@@ -97,28 +159,23 @@ def preprocess_data(df):
     else:
         raise ValueError("❌ No numeric columns available for interpolation.")
 
-    print(f"✅ After interpolation: {df1.shape}")
+    log.debug("✅ After interpolation: %s", df1.shape)
+    clock.lap("interpolate")
 
 
+    clip_bounds = {}
     for col in numeric_cols:
         Q1, Q3 = df1[col].quantile([0.25, 0.75])
         IQR = Q3 - Q1
         lower, upper = Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
         df1[col] = df1[col].clip(lower, upper)
+        clip_bounds[col] = (lower, upper)
 
-    df1 = df1.reset_index().sort_values("Timestamp")
+    clock.lap("clip")
 
-    df1["hour"] = df1["Timestamp"].dt.hour
-    df1["day_of_week"] = df1["Timestamp"].dt.dayofweek
-    df1["month"] = df1["Timestamp"].dt.month
-
-    # Seasonal weights
-    month_weights = {1: 1.0, 2: 0.8, 3: 0.6, 4: 0.4, 5: 0.2, 6: 0.1,
-                     7: 0.1, 8: 0.1, 9: 0.2, 10: 0.6, 11: 0.9, 12: 1.0}
-    hour_weights = {i: 0.9 - abs(12 - i) * 0.05 for i in range(24)}
+    df1 = df1.reset_index().sort_values("Timestamp")
 
-    df1["PM25_month_weight"] = df1["month"].map(month_weights)
-    df1["PM25_hour_weight"] = df1["hour"].map(hour_weights)
+    df1 = add_time_features(df1)
 
 
     if "PM25" not in df1.columns:
@@ -130,13 +187,369 @@ def preprocess_data(df):
 
     df1 = df1.dropna(subset=["PM25"])
 
+    feature_state = add_rolling_features(df1, "PM25", by="station")
+
 
     if "station" in df1.columns:
         df1["station_original"] = df1["station"]
         df1 = pd.get_dummies(df1, columns=["station"], prefix="station")
 
-    print("✅ Final shape:", df1.shape)
-    print("📌 Final columns:", df1.columns.tolist())
-    print(df1.head())
+    clock.lap("features")
+    seconds = clock.done()
+    log.info("✅ Preprocessing done", extra={"shape": list(df1.shape), "seconds": round(seconds, 3)})
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("📌 Final columns: %s\n%s", df1.columns.tolist(), df1.head())
+
+    # Kept so preprocess_tail can clip appended rows with the same bounds
+    # and carry the rolling features on from where this pass stopped
+    df1.attrs["clip_bounds"] = clip_bounds
+    df1.attrs["feature_state"] = feature_state.to_attrs()
+
+    return df1
+
+
+def add_time_features(df):
+    df["hour"] = df["Timestamp"].dt.hour
+    df["day_of_week"] = df["Timestamp"].dt.dayofweek
+    df["month"] = df["Timestamp"].dt.month
+    df["PM25_month_weight"] = df["month"].map(MONTH_WEIGHTS)
+    df["PM25_hour_weight"] = df["hour"].map(HOUR_WEIGHTS)
+    return df
+
+
+def preprocess_tail(processed, new_raw, max_rows=None):
+    """
+    Append freshly loaded raw rows to an already preprocessed frame.
+
+    Only the new rows go through interpolation, clipping and lag creation:
+    interpolation is anchored on the last processed row, clipping reuses the
+    IQR bounds from the full preprocess_data pass, and lags read the last 72
+    processed PM25 values so they line up with the row-based shifts there.
+    Returns a new frame; `processed` is left untouched.
+    """
+    if new_raw is None or new_raw.empty:
+        return processed
+
+    new = new_raw.copy()
+    if "timestamp" in new.columns and "Timestamp" not in new.columns:
+        new["Timestamp"] = new["timestamp"]
+    new["Timestamp"] = pd.to_datetime(new["Timestamp"], errors="coerce", utc=True)
+    new = new.dropna(subset=["Timestamp"])
+
+    if processed.attrs.get("partitioned"):
+        return _tail_partitioned(processed, new, max_rows)
+
+    # Same dedup rule as preprocess_data: one row per Timestamp, first wins
+    new = new[~new["Timestamp"].isin(processed["Timestamp"])]
+    new = new.drop_duplicates("Timestamp", keep="first").sort_values("Timestamp")
+    if new.empty:
+        return processed
+
+    bounds = processed.attrs.get("clip_bounds")
+    if bounds is None:
+        bounds = {}
+        for col in ["PM25", "PM10", "NO2", "O3", "SO2", "CO", "AQI"]:
+            if col in processed.columns:
+                Q1, Q3 = processed[col].quantile([0.25, 0.75])
+                IQR = Q3 - Q1
+                bounds[col] = (Q1 - 1.5 * IQR, Q3 + 1.5 * IQR)
+    numeric_cols = list(bounds)
+
+    for col in numeric_cols:
+        new[col] = pd.to_numeric(new[col], errors="coerce") if col in new.columns else np.nan
+
+    context = processed[numeric_cols].tail(1)
+    combined = pd.concat([context, new[numeric_cols]], ignore_index=True)
+    combined = combined.interpolate(method="linear", limit_direction="both")
+    new[numeric_cols] = combined.iloc[len(context):].to_numpy()
+
+    for col, (lower, upper) in bounds.items():
+        new[col] = new[col].clip(lower, upper)
+
+    new = add_time_features(new)
+
+    pm = pd.concat([processed["PM25"].tail(72), new["PM25"]], ignore_index=True)
+    for name, periods in (("lag_1d", 24), ("lag_2d", 48), ("lag_3d", 72)):
+        new[name] = pm.shift(periods).iloc[-len(new):].to_numpy()
+
+    new = new.dropna(subset=["PM25"])
+
+    feature_state = state_for_frame(processed)
+    feature_state = FeatureState(dict(feature_state.stations))
+    advance_rows(new, feature_state, "PM25", by="station")
+
+    if "station" in new.columns:
+        new["station_original"] = new["station"]
+        new = pd.get_dummies(new, columns=["station"], prefix="station")
+
+    # Keep the processed layout; a station seen for the first time gets a new column
+    station_cols = [c for c in new.columns if c.startswith("station_") and c not in processed.columns
+                    and c != "station_original"]
+    out = pd.concat([processed, new[[c for c in processed.columns if c in new.columns] + station_cols]],
+                    ignore_index=True)
+    for c in out.columns:
+        if c.startswith("station_") and c != "station_original":
+            out[c] = out[c].fillna(False).astype(bool)
+
+    if max_rows is not None and len(out) > max_rows:
+        out = out.iloc[-max_rows:].reset_index(drop=True)
+
+    out.attrs["clip_bounds"] = bounds
+    out.attrs["feature_state"] = feature_state.to_attrs()
+    return out
+
+
+def _prepare_raw(df):
+    """Parse timestamps and flatten/convert pollutant columns, row-aligned."""
+    df1 = df.copy()
+    if "timestamp" in df1.columns and "Timestamp" not in df1.columns:
+        df1["Timestamp"] = df1["timestamp"]
+    if "Timestamp" not in df1.columns:
+        raise ValueError("❌ MongoDB data missing 'Timestamp' column.")
+
+    df1["Timestamp"] = pd.to_datetime(df1["Timestamp"], errors="coerce", utc=True)
+    df1 = df1.dropna(subset=["Timestamp"]).reset_index(drop=True)
+
+    if "pollutants" in df1.columns:
+        pollutants_df = pd.json_normalize(
+            df1["pollutants"].apply(lambda x: x if isinstance(x, dict) else {}).tolist()
+        ).rename(columns={"PM2.5": "PM25", "pm25": "PM25", "pm2_5": "PM25"})
+        pollutants_df.index = df1.index
+        df1 = pd.concat([df1.drop(columns=["pollutants"]), pollutants_df], axis=1)
+
+    for col in POLLUTANT_COLS:
+        if col in df1.columns:
+            df1[col] = pd.to_numeric(df1[col], errors="coerce")
+    if not any(c in df1.columns for c in POLLUTANT_COLS):
+        raise ValueError("❌ No pollutant columns found after extraction.")
+    if "PM25" not in df1.columns:
+        raise ValueError(f"❌ PM25 column missing. Final columns: {df1.columns.tolist()}")
+
+    return df1
+
+
+def _station_grid(part):
+    """One row per hour from the station's first to last reading."""
+    part = part.assign(Timestamp=part["Timestamp"].dt.floor("h"))
+    part = part.drop_duplicates("Timestamp", keep="first").set_index("Timestamp").sort_index()
+    grid = pd.date_range(part.index.min(), part.index.max(), freq="h", name="Timestamp")
+    return part.reindex(grid)
+
+
+def _preprocess_station(task):
+    """Gap fill, interpolate, clip and lag a single station's hourly series."""
+    station, part, numeric_cols = task
+    part = _station_grid(part)
+    part["station"] = station
+    if "city" in part.columns:
+        part["city"] = part["city"].ffill().bfill()
+
+    part = fill_future_frame(part, numeric_cols)
+    part[numeric_cols] = part[numeric_cols].interpolate(method="linear", limit_direction="both")
+
+    bounds = {}
+    for col in numeric_cols:
+        Q1, Q3 = part[col].quantile([0.25, 0.75])
+        IQR = Q3 - Q1
+        bounds[col] = (Q1 - 1.5 * IQR, Q3 + 1.5 * IQR)
+        part[col] = part[col].clip(*bounds[col])
+
+    part = add_time_features(part.reset_index())
+    part["lag_1d"] = part["PM25"].shift(24)
+    part["lag_2d"] = part["PM25"].shift(48)
+    part["lag_3d"] = part["PM25"].shift(72)
+    part = part.dropna(subset=["PM25"])
+    feature_state = add_rolling_features(part, "PM25", by=None)
+    return station, part, bounds, feature_state.stations[""]
+
+
+def _map_stations(tasks, workers):
+    if workers == 1 or len(tasks) <= 1:
+        return [_preprocess_station(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_preprocess_station, tasks))
+
+
+def preprocess_partitioned(df, workers=None):
+    """
+    Per-station variant of preprocess_data.
+
+    Each station is deduplicated on its own timestamps, put on a regular
+    hourly grid, then gap filled, interpolated, IQR clipped and lagged in
+    isolation — so lag_1d really is the same station 24 hours earlier.
+    Stations run in parallel on a process pool (`workers`, default all
+    cores); one-hot encoding happens once on the concatenated result.
+    """
+    clock = StageClock("preprocess_partitioned")
+    log.info("🔹 Starting partitioned preprocessing (%s workers)...", workers or os.cpu_count())
+    df1 = _prepare_raw(df)
+    df1 = df1.dropna(subset=["station"])
+
+    numeric_cols = list(df1.drop(columns=["Timestamp"]).select_dtypes(include="number").columns)
+    if not numeric_cols:
+        raise ValueError("❌ No numeric columns available for interpolation.")
+
+    keep = ["Timestamp", "city"] + numeric_cols
+    tasks = [
+        (station, part[[c for c in keep if c in part.columns]], numeric_cols)
+        for station, part in df1.groupby("station", sort=True)
+    ]
+    results = _map_stations(tasks, workers)
+    clock.lap("stations")
+
+    out = pd.concat([part for _, part, _, _ in results], ignore_index=True)
+    out = out.sort_values(["Timestamp", "station"], kind="stable").reset_index(drop=True)
+    out["station_original"] = out["station"]
+    out = pd.get_dummies(out, columns=["station"], prefix="station")
+
+    out.attrs["partitioned"] = True
+    out.attrs["station_clip_bounds"] = {station: bounds for station, _, bounds, _ in results}
+    out.attrs["feature_state"] = FeatureState({station: st for station, _, _, st in results}).to_attrs()
+    seconds = clock.done()
+    log.info("✅ Partitioned preprocessing done",
+             extra={"shape": list(out.shape), "stations": len(results), "seconds": round(seconds, 3)})
+    return out
+
+
+def _map_stations_lazy(tasks, workers):
+    """_map_stations over a lazy task iterator, with at most 2 x workers stations in flight."""
+    if workers == 1:
+        yield from map(_preprocess_station, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(_preprocess_station, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def preprocess_dataset(path, workers=None):
+    """
+    preprocess_partitioned for a station-partitioned dataset written by
+    csv_ingest.ingest_csv, with bounded memory: stations are read off disk
+    one at a time and each result is compacted (compact.compact_frame
+    layout) before the next is read, so the raw export never exists as one
+    frame. Returns the compact frame with the usual partitioned attrs.
+    """
+    clock = StageClock("preprocess_dataset")
+    meta = read_dataset_meta(path)
+    numeric_cols = list(meta["columns"])
+    workers = workers or PREPROCESS_WORKERS or os.cpu_count() or 1
+    log.info("🔹 Preprocessing dataset %s (%d stations, %s workers)...", path, len(meta["stations"]), workers,
+             extra={"rows": meta["rows"]})
+
+    tasks = ((station, raw[["Timestamp"] + numeric_cols], numeric_cols) for station, raw in iter_partitions(path))
+    stations, parts, bounds, states = [], [], {}, {}
+    for station, part, station_bounds, state in _map_stations_lazy(tasks, workers):
+        stations.append(station)
+        parts.append(compact_frame(part.drop(columns=["station"])))
+        bounds[station], states[station] = station_bounds, state
+    if not parts:
+        raise ValueError(f"❌ Dataset {path} has no rows.")
+    clock.lap("stations")
+
+    # Station / city come back as categoricals built from per-part codes
+    codes = np.repeat(np.arange(len(stations)), [len(p) for p in parts]).astype(np.int32)
+    out = pd.concat(parts, ignore_index=True)
+    out["station_original"] = pd.Categorical.from_codes(codes, categories=stations)
+    cities = [meta["stations"][s]["city"] for s in stations]
+    if any(c is not None for c in cities):
+        out["city"] = pd.Categorical(np.array(cities, dtype=object)[codes])
+    out = out.take(np.lexsort((codes, out["Timestamp"].to_numpy()))).reset_index(drop=True)
+
+    out.attrs = {
+        "partitioned": True,
+        "compact": True,
+        "station_clip_bounds": bounds,
+        "feature_state": FeatureState(states).to_attrs(),
+    }
+    seconds = clock.done()
+    log.info("✅ Dataset preprocessing done",
+             extra={"shape": list(out.shape), "stations": len(stations), "seconds": round(seconds, 3)})
+    return out
+
+
+def _tail_partitioned(processed, new, max_rows=None):
+    """preprocess_tail for frames built by preprocess_partitioned."""
+    all_bounds = dict(processed.attrs.get("station_clip_bounds", {}))
+    numeric_cols = sorted({c for b in all_bounds.values() for c in b}) or \
+        [c for c in POLLUTANT_COLS if c in processed.columns]
+
+    feature_state = FeatureState(dict(state_for_frame(processed).stations))
+
+    new = _prepare_raw(new).dropna(subset=["station"])
+    # Row positions per station, in time order: one pass instead of a mask per station
+    positions = processed.groupby("station_original", sort=False, observed=True).indices
+    parts = []
+    for station, part in new.groupby("station", sort=True):
+        for col in numeric_cols:
+            if col not in part.columns:
+                part = part.assign(**{col: np.nan})
+        rows = positions.get(station)
+
+        if rows is None or not len(rows):
+            # First rows ever for this station: process it from scratch
+            cols = ["Timestamp"] + (["city"] if "city" in part.columns else []) + numeric_cols
+            _, fresh, bounds, station_state = _preprocess_station((station, part[cols], numeric_cols))
+            all_bounds[station] = bounds
+            feature_state.stations[station] = station_state
+            parts.append(fresh)
+            continue
+
+        context = processed.iloc[rows[-72:]]
+        last_ts = context["Timestamp"].max()
+        part = part[part["Timestamp"].dt.floor("h") > last_ts]
+        if part.empty:
+            continue
 
-    return df1
\ No newline at end of file
+        cols = ["Timestamp"] + (["city"] if "city" in part.columns else []) + numeric_cols
+        grid = _station_grid(part[cols])
+        grid = grid.reindex(pd.date_range(last_ts + pd.Timedelta(hours=1), grid.index.max(),
+                                          freq="h", name="Timestamp"))
+
+        # Interpolate anchored on the last processed hour, clip with this station's bounds
+        combined = pd.concat([context[numeric_cols].tail(1), grid[numeric_cols]], ignore_index=True)
+        combined = combined.interpolate(method="linear", limit_direction="both")
+        grid[numeric_cols] = combined.iloc[1:].to_numpy()
+        for col, (lower, upper) in all_bounds.get(station, {}).items():
+            if col in grid.columns:
+                grid[col] = grid[col].clip(lower, upper)
+
+        grid = add_time_features(grid.reset_index())
+        grid["station"] = station
+        if "city" in grid.columns:
+            grid["city"] = grid["city"].ffill().bfill()
+
+        pm = pd.concat([context["PM25"], grid["PM25"]], ignore_index=True)
+        for name, periods in (("lag_1d", 24), ("lag_2d", 48), ("lag_3d", 72)):
+            grid[name] = pm.shift(periods).iloc[-len(grid):].to_numpy()
+        grid = grid.dropna(subset=["PM25"]).reset_index(drop=True)
+        advance_rows(grid, feature_state, "PM25", by="station")
+        parts.append(grid)
+
+    if not parts:
+        return processed
+
+    new = pd.concat(parts, ignore_index=True)
+    new["station_original"] = new["station"]
+    new = pd.get_dummies(new, columns=["station"], prefix="station")
+
+    station_cols = [c for c in new.columns if c.startswith("station_") and c not in processed.columns
+                    and c != "station_original"]
+    out = pd.concat([processed, new[[c for c in processed.columns if c in new.columns] + station_cols]],
+                    ignore_index=True)
+    for c in out.columns:
+        if c.startswith("station_") and c != "station_original":
+            out[c] = out[c].fillna(False).astype(bool)
+    out = out.sort_values(["Timestamp", "station_original"], kind="stable").reset_index(drop=True)
+
+    if max_rows is not None and len(out) > max_rows:
+        out = out.iloc[-max_rows:].reset_index(drop=True)
+
+    out.attrs["partitioned"] = True
+    out.attrs["station_clip_bounds"] = all_bounds
+    out.attrs["feature_state"] = feature_state.to_attrs()
+    return out
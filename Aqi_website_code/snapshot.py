@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+def write_snapshot(df, path, watermark=None):
+    """
+    Write a preprocessed frame as one .npy file per column plus meta.json.
+
+    Numbers and bools are stored as-is, timestamps as int64 ticks in their own unit and
+    text columns as categorical codes, so reading it back is a set of
+    np.load calls (memory-mapped) with no parsing. The data watermark and
+    the frame's attrs (clip bounds etc.) travel in meta.json.
+    """
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        entry = {"name": col, "file": f"{i:04d}.npy"}
+        if isinstance(s.dtype, pd.DatetimeTZDtype) or pd.api.types.is_datetime64_any_dtype(s):
+            tz = s.dt.tz
+            values = s.dt.tz_convert("UTC").dt.tz_localize(None) if tz is not None else s
+            entry["kind"] = "datetime"
+            entry["tz"] = "UTC" if tz is not None else None
+            entry["unit"] = s.dt.unit
+            arr = values.to_numpy().astype(np.int64)
+        elif pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+            entry["kind"] = "array"
+            arr = s.to_numpy()
+        else:
+            cat = s.astype("category")
+            entry["kind"] = "category"
+            entry["categories"] = [str(c) for c in cat.cat.categories]
+            arr = cat.cat.codes.to_numpy()
+        np.save(os.path.join(tmp, entry["file"]), arr)
+        columns.append(entry)
+
+    meta = {
+        "rows": len(df),
+        "columns": columns,
+        "watermark": watermark,
+        "attrs": df.attrs,
+        "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, default=_jsonable)
+
+    # Swap by renames only: at every point either `path` or `path.old` is a whole snapshot
+    old = f"{path}.old"
+    if os.path.exists(path):
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+def _resolve(path):
+    # A crash between write_snapshot's two renames leaves only the previous snapshot, at path.old
+    old = f"{path}.old"
+    if not os.path.exists(os.path.join(path, "meta.json")) and os.path.exists(os.path.join(old, "meta.json")):
+        return old
+    return path
+
+
+def snapshot_exists(path):
+    """Whether read_snapshot(path) has a complete snapshot to read."""
+    return os.path.exists(os.path.join(_resolve(path), "meta.json"))
+
+
+def _jsonable(value):
+    # numpy scalars in attrs (e.g. float32 clip bounds) → plain Python numbers
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def read_snapshot(path, mmap=True):
+    """Return (df, meta) for a snapshot written by write_snapshot."""
+    path = _resolve(path)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    data = {}
+    for entry in meta["columns"]:
+        arr = np.load(os.path.join(path, entry["file"]), mmap_mode="r" if mmap else None)
+        if entry["kind"] == "datetime":
+            values = pd.DatetimeIndex(np.asarray(arr).view(f"datetime64[{entry.get('unit', 'ns')}]"))
+            data[entry["name"]] = values.tz_localize(entry["tz"]) if entry["tz"] else values
+        elif entry["kind"] == "category":
+            data[entry["name"]] = pd.Categorical.from_codes(np.asarray(arr), categories=entry["categories"])
+        else:
+            data[entry["name"]] = arr
+
+    df = pd.DataFrame(data)
+    df.attrs = meta.get("attrs") or {}
+    return df, meta
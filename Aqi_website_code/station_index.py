@@ -0,0 +1,158 @@
+import re
+import weakref
+from collections import Counter, OrderedDict
+
+
+# Alternate spellings seen from the dashboard and the Node mappers,
+# keyed by compact form (see compact_name) → canonical station name
+STATION_ALIASES = {
+    "anand": "Anand Vihar",
+    "ashok": "Ashok Vihar",
+    "aya": "Aya Nagar",
+    "burari": "Burari Crossing",
+    "crri": "CRRI Mathura Road",
+    "chandni": "Chandni Chowk",
+    "drkarnisingh": "Dr. Karni Singh Shooting Range",
+    "dwarkasector8": "Dwarka-Sector 8",
+    "igi": "IGI Airport (T3)",
+    "igiairport": "IGI Airport (T3)",
+    "ihbas": "IHBAS, Dilshad Garden",
+    "dilshadgarden": "IHBAS, Dilshad Garden",
+    "jawaharlal": "Jawaharlal Nehru Stadium",
+    "jlnstadium": "Jawaharlal Nehru Stadium",
+    "lodhi": "Lodhi Road IMD",
+    "lodhiroad": "Lodhi Road IMD",
+    "majordhyanchand": "Major Dhyan Chand National Stadium",
+    "nsit": "NSIT Dwarka",
+    "okhla": "Okhla Phase-2",
+    "punjabi": "Punjabi Bagh",
+    "siri": "Sirifort",
+    "sonia": "Sonia Vihar",
+    "sriaurobindo": "Sri Aurobindo Marg",
+}
+
+
+def normalize_name(name):
+    """Lowercase and collapse whitespace — the matching key used historically."""
+    return " ".join(str(name).strip().split()).lower()
+
+
+def compact_name(name):
+    """Lowercase alphanumerics only, so 'R.K. Puram' and 'rk puram' agree."""
+    return re.sub(r"[^0-9a-z]", "", str(name).lower())
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StationIndex:
+    """
+    Station name → one-hot column lookup, built once per loaded frame.
+
+    Exact, compact and alias lookups are plain dict hits. Typos fall back to
+    a trigram inverted index scored by Dice similarity, which only touches
+    candidates sharing at least one trigram with the query.
+    """
+
+    def __init__(self, stations, aliases=None, rows=None, cutoff=0.5):
+        self.stations = sorted(set(stations))
+        self.rows = rows or {}
+        self.cutoff = cutoff
+        self._keys = {}
+        self._aliases = {s: [] for s in self.stations}
+
+        for s in self.stations:
+            self._keys.setdefault(normalize_name(s), s)
+        for s in self.stations:
+            self._keys.setdefault(compact_name(s), s)
+
+        by_compact = {compact_name(s): s for s in self.stations}
+        for alias, target in (aliases or {}).items():
+            station = by_compact.get(compact_name(target))
+            if station is not None and compact_name(alias) not in self._keys:
+                self._keys[compact_name(alias)] = station
+                self._aliases[station].append(alias)
+
+        self._grams = {}
+        self._gram_index = {}
+        for s in self.stations:
+            grams = _trigrams(compact_name(s))
+            self._grams[s] = len(grams)
+            for g in grams:
+                self._gram_index.setdefault(g, []).append(s)
+
+        self._fuzzy_cache = OrderedDict()
+
+    @classmethod
+    def from_frame(cls, df, aliases=STATION_ALIASES):
+        if "station_original" in df.columns:
+            counts = df["station_original"].dropna().astype(str).value_counts()
+            return cls(counts.index.tolist(), aliases, rows=counts.to_dict())
+        stations = [c[len("station_"):] for c in df.columns if c.startswith("station_")]
+        return cls(stations, aliases)
+
+    def _fuzzy(self, key):
+        if key in self._fuzzy_cache:
+            return self._fuzzy_cache[key]
+
+        grams = _trigrams(key)
+        shared = Counter()
+        for g in grams:
+            shared.update(self._gram_index.get(g, ()))
+
+        best, best_score = None, self.cutoff
+        for station, n in shared.items():
+            score = 2 * n / (len(grams) + self._grams[station])
+            if score >= best_score:
+                best, best_score = station, score
+
+        self._fuzzy_cache[key] = best
+        if len(self._fuzzy_cache) > 1024:
+            self._fuzzy_cache.popitem(last=False)
+        return best
+
+    def resolve(self, name):
+        """Return the canonical station name for `name`, or None."""
+        if name is None:
+            return None
+        for key in (normalize_name(name), compact_name(name)):
+            if key in self._keys:
+                return self._keys[key]
+        key = compact_name(name)
+        return self._fuzzy(key) if key else None
+
+    def column(self, name):
+        station = self.resolve(name)
+        return f"station_{station}" if station is not None else None
+
+    def catalogue(self):
+        return [
+            {
+                "station": s,
+                "column": f"station_{s}",
+                "aliases": self._aliases[s],
+                "rows": int(self.rows.get(s, 0)),
+            }
+            for s in self.stations
+        ]
+
+
+_INDEX_CACHE = OrderedDict()
+
+
+def station_index_for(df):
+    """
+    StationIndex for `df`, built on first use and reused while the same frame
+    object is alive; replacing STATE["df"] naturally triggers a rebuild.
+    """
+    entry = _INDEX_CACHE.get(id(df))
+    if entry is not None and entry[0]() is df:
+        return entry[1]
+
+    index = StationIndex.from_frame(df)
+    _INDEX_CACHE[id(df)] = (weakref.ref(df), index)
+    while len(_INDEX_CACHE) > 4:
+        _INDEX_CACHE.popitem(last=False)
+    return index
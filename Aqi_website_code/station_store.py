@@ -0,0 +1,225 @@
+"""
+Per-station ring buffers of the latest feature rows, so a forecast can be
+seeded from its own station's newest hour (real lags included) in constant
+time instead of filtering the whole frame per request.
+
+The buffers are preallocated (stations x hours x columns) arrays. Building
+one reads only the last `hours` rows of each station; after that every new
+row is a single O(1) write. store_for() keeps one store per live frame like
+station_index_for, and carry_store() hands it on to the frame a refresh
+produces, pushing only the rows that arrived.
+"""
+import os
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from compact import feature_matrix
+
+# Hours of feature rows kept per station (the lags reach back 72h)
+STATION_STORE_HOURS = int(os.getenv("STATION_STORE_HOURS", "72"))
+
+# Never stored: identifiers, raw timestamps and the one-hots seeding sets itself
+_SKIP = {"Timestamp", "_id", "city", "timestamp", "station_original"}
+
+
+def store_columns(df):
+    """Numeric columns worth storing: everything a model may read except station one-hots."""
+    return [c for c in df.select_dtypes(include=["number", "bool"]).columns
+            if c not in _SKIP and not c.startswith("station_")]
+
+
+def _station_rows(df):
+    if "station_original" in df.columns:
+        return df.groupby("station_original", sort=False, observed=True).indices.items()
+    return [("", np.arange(len(df)))]
+
+
+def _key(name):
+    return "" if name is None else str(name)
+
+
+class StationStore:
+    """
+    Last `hours` rows of `columns` per station. Slot s of a station holds
+    push number s modulo hours; head[i] is where station i's next row goes.
+    """
+
+    def __init__(self, columns, hours=STATION_STORE_HOURS, capacity=8):
+        self.columns = list(columns)
+        self.hours = hours
+        self.index = {}
+        self.values = np.full((capacity, hours, len(self.columns)), np.nan)
+        self.times = np.zeros((capacity, hours), dtype=np.int64)
+        self.head = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.newest = None
+        self._positions = {}
+
+    @classmethod
+    def from_frame(cls, df, hours=STATION_STORE_HOURS):
+        """Store holding each station's last `hours` rows of a time-ordered frame."""
+        groups = [(station, rows[-hours:]) for station, rows in _station_rows(df)]
+        store = cls(store_columns(df), hours, capacity=max(len(groups), 1))
+        if df.empty:
+            return store
+
+        picked = _bare(df.iloc[np.concatenate([rows for _, rows in groups])])
+        values = feature_matrix(picked, store.columns, dtype=np.float64)
+        times = _ns(picked["Timestamp"])
+        offset = 0
+        for station, rows in groups:
+            i, n = store._slot(station), len(rows)
+            store.values[i, :n] = values[offset:offset + n]
+            store.times[i, :n] = times[offset:offset + n]
+            store.head[i], store.count[i] = n % hours, n
+            offset += n
+        store.newest = _key(df["station_original"].iloc[-1]) if "station_original" in df.columns else ""
+        return store
+
+    def _slot(self, station):
+        key = _key(station)
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.index)
+            if i == len(self.head):
+                # Stations appear rarely; doubling keeps each one amortised O(1)
+                grow = len(self.head)
+                self.values = np.concatenate([self.values, np.full_like(self.values[:grow], np.nan)])
+                self.times = np.concatenate([self.times, np.zeros_like(self.times[:grow])])
+                self.head = np.concatenate([self.head, np.zeros(grow, dtype=np.int64)])
+                self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+        return i
+
+    def push(self, station, row, ts):
+        """Write one feature row (in `columns` order) as the station's newest hour."""
+        i = self._slot(station)
+        h = self.head[i]
+        self.values[i, h] = row
+        self.times[i, h] = ts
+        self.head[i] = (h + 1) % self.hours
+        self.count[i] = min(self.count[i] + 1, self.hours)
+        self.newest = _key(station)
+
+    def advance(self, df):
+        """
+        Push the rows of a time-ordered frame that are newer than what each
+        station already holds. Only rows within `hours` of the newest stored
+        hour onwards are read, so the cost follows the new rows rather than
+        the frame; rows older than that could never be a station's newest.
+        """
+        if df.empty or not self.index:
+            return self
+        floor = pd.Timestamp(self.latest_times().max() - self.hours * 3_600_000_000_000, tz="UTC")
+        if getattr(df["Timestamp"].dtype, "tz", None) is None:
+            floor = floor.tz_localize(None)
+        start = int(df["Timestamp"].searchsorted(floor, side="right"))
+        if start == len(df):
+            return self
+
+        tail = _bare(df.iloc[start:])
+        ts = _ns(tail["Timestamp"])
+        values = feature_matrix(tail, self.columns, dtype=np.float64)
+        stations = tail["station_original"].astype(str).to_numpy() if "station_original" in tail.columns \
+            else np.full(len(tail), "")
+        for r, station in enumerate(stations):
+            i = self.index.get(station)
+            if i is None or not self.count[i] or ts[r] > self.times[i, (self.head[i] - 1) % self.hours]:
+                self.push(station, values[r], ts[r])
+        return self
+
+    def latest_times(self):
+        """Newest stored timestamp (ns) per station slot."""
+        n = len(self.index)
+        return self.times[np.arange(n), (self.head[:n] - 1) % self.hours]
+
+    def latest(self, station=None):
+        """The station's newest row (a copy), or None when it has none. No station: the newest row of any."""
+        i = self.index.get(_key(self.newest if station is None else station))
+        if i is None or not self.count[i]:
+            return None
+        return self.values[i, (self.head[i] - 1) % self.hours].copy()
+
+    def window(self, station):
+        """(rows x columns) of the station's stored hours, oldest first, plus their timestamps."""
+        i = self.index.get(_key(station))
+        if i is None:
+            return np.empty((0, len(self.columns))), np.empty(0, dtype="datetime64[ns]")
+        n, h = self.count[i], self.head[i]
+        order = (np.arange(h - n, h)) % self.hours
+        return self.values[i, order].copy(), self.times[i, order].astype("datetime64[ns]")
+
+    def seed(self, feature_names, station=None):
+        """
+        The station's newest row laid out in `feature_names` order (features
+        the store doesn't hold are 0), or None when the station has no rows.
+        """
+        row = self.latest(station)
+        if row is None:
+            return None
+        key = tuple(feature_names)
+        take = self._positions.get(key)
+        if take is None:
+            where = {c: j for j, c in enumerate(self.columns)}
+            take = self._positions[key] = np.array([where.get(name, -1) for name in feature_names])
+        return np.where(take >= 0, row[take], 0.0)
+
+    def copy(self):
+        other = StationStore.__new__(StationStore)
+        other.columns, other.hours = self.columns, self.hours
+        other.index = dict(self.index)
+        other.values, other.times = self.values.copy(), self.times.copy()
+        other.head, other.count = self.head.copy(), self.count.copy()
+        other.newest, other._positions = self.newest, {}
+        return other
+
+    def nbytes(self):
+        return self.values.nbytes + self.times.nbytes
+
+
+def _bare(part):
+    # pandas deep-copies attrs into every column pulled out of a frame; the rows read here don't need them
+    part.attrs = {}
+    return part
+
+
+def _ns(timestamps):
+    return pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).as_unit("ns").asi8
+
+
+_STORE_CACHE = OrderedDict()
+
+
+def _lookup(df):
+    entry = _STORE_CACHE.get(id(df))
+    if entry is not None and entry[0]() is df:
+        return entry[1]
+    return None
+
+
+def _remember(df, store):
+    _STORE_CACHE[id(df)] = (weakref.ref(df), store)
+    while len(_STORE_CACHE) > 4:
+        _STORE_CACHE.popitem(last=False)
+    return store
+
+
+def store_for(df):
+    """
+    StationStore for `df`, built on first use and reused while the same
+    frame object is alive (see station_index.station_index_for).
+    """
+    return _lookup(df) or _remember(df, StationStore.from_frame(df))
+
+
+def carry_store(previous, df):
+    """
+    Give `df` (a refresh of `previous`) a store without rebuilding it: a
+    copy of the previous frame's store, advanced by the rows that arrived.
+    Falls back to a fresh build when the previous frame never had one or
+    its columns changed.
+    """
+    store = _lookup(previous) if previous is not None else None
+    if store is None or store.columns != store_columns(df):
+        return store_for(df)
+    return _remember(df, store.copy().advance(df))
@@ -0,0 +1,165 @@
+"""
+Synthetic `hourly_data` documents for offline benchmarks and experiments.
+
+Documents follow the shape the importers and cron.js write:
+
+    {"station": "ITO", "city": "Delhi", "timestamp": "2024-01-01 05:00:00",
+     "pollutants": {"PM25": 87.2, "PM10": 140.1, "NO2": 31.0, ...}}
+
+with the untidiness real data has: hours missing per station, multi-hour
+outages, duplicated documents and null pollutant readings. MemoryCollection
+serves them through the same find() calls load_data_from_mongo makes, so
+the whole pipeline runs without a Mongo server.
+"""
+import numpy as np
+import pandas as pd
+
+
+# name → (stations, days)
+SCALES = {
+    "tiny": (3, 14),
+    "small": (5, 60),
+    "medium": (20, 180),
+    "large": (40, 365),
+}
+
+# pollutant → (gamma shape, scale); roughly Delhi-like magnitudes
+POLLUTANT_PROFILES = {
+    "PM25": (3.0, 40.0),
+    "PM10": (3.0, 65.0),
+    "NO": (2.0, 12.0),
+    "NO2": (2.0, 20.0),
+    "NOx": (2.0, 25.0),
+    "NH3": (2.5, 12.0),
+    "SO2": (2.0, 8.0),
+    "CO": (2.0, 0.8),
+    "Ozone": (2.0, 15.0),
+    "Benzene": (1.5, 2.0),
+    "AT": (9.0, 3.0),
+    "RH": (6.0, 10.0),
+    "WS": (2.0, 0.8),
+    "WD": (4.0, 45.0),
+    "SR": (1.5, 60.0),
+    "BP": (400.0, 2.5),
+}
+
+
+def station_names(n):
+    base = ["Anand Vihar", "ITO", "RK Puram", "Punjabi Bagh", "Dwarka Sector 8",
+            "Mandir Marg", "Rohini", "Okhla Phase 2", "Jahangirpuri", "Wazirpur"]
+    return [base[i] if i < len(base) else f"Station {i + 1}" for i in range(n)]
+
+
+def generate_hourly_docs(stations=5, days=30, start="2024-01-01", seed=0, gap_rate=0.03,
+                         outage_rate=0.002, outage_hours=12, duplicate_rate=0.01, null_rate=0.05,
+                         pollutants=POLLUTANT_PROFILES):
+    """
+    List of hourly_data documents for `stations` stations over `days` days.
+
+    PM25 follows a daily cycle with station-level offsets and noise so the
+    models have something to fit. gap_rate drops single hours, outage_rate
+    starts outages of `outage_hours`, duplicate_rate re-inserts documents
+    and null_rate blanks individual pollutant readings.
+    """
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(start, periods=days * 24, freq="h")
+    stamps = hours.strftime("%Y-%m-%d %H:%M:%S")
+    daily = 1 + 0.35 * np.cos((hours.hour.to_numpy() - 8) / 24 * 2 * np.pi)
+    seasonal = 1 + 0.4 * np.cos((hours.dayofyear.to_numpy() - 10) / 365 * 2 * np.pi)
+
+    docs = []
+    for name in station_names(stations) if isinstance(stations, int) else stations:
+        keep = rng.random(len(hours)) >= gap_rate
+        for start_idx in np.flatnonzero(rng.random(len(hours)) < outage_rate):
+            keep[start_idx:start_idx + outage_hours] = False
+
+        level = rng.uniform(0.7, 1.3)
+        values = {
+            p: rng.gamma(shape, scale, size=len(hours)) * (daily * seasonal * level if p in ("PM25", "PM10") else 1)
+            for p, (shape, scale) in pollutants.items()
+        }
+        nulls = {p: rng.random(len(hours)) < null_rate for p in pollutants}
+
+        for i in np.flatnonzero(keep):
+            doc = {
+                "station": name,
+                "city": "Delhi",
+                "timestamp": stamps[i],
+                "pollutants": {p: None if nulls[p][i] else round(float(values[p][i]), 2) for p in pollutants},
+            }
+            docs.append(doc)
+            if rng.random() < duplicate_rate:
+                docs.append({**doc, "pollutants": dict(doc["pollutants"])})
+    return docs
+
+
+def scale_docs(scale="small", seed=0, **kwargs):
+    stations, days = SCALES[scale]
+    return generate_hourly_docs(stations=stations, days=days, seed=seed, **kwargs)
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        self._docs = sorted(self._docs, key=lambda d: d.get(key) or "", reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+class MemoryCollection:
+    """
+    Just enough of a pymongo Collection for load_hourly_frame: find() with
+    a `timestamp` $gt/$gte/$lt/$lte filter and a dotted projection, plus
+    sort and limit on the cursor.
+    """
+
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    def insert_many(self, docs):
+        self.docs.extend(docs)
+
+    def count_documents(self, query=None):
+        return sum(1 for _ in self._match(query or {}))
+
+    def _match(self, query):
+        bounds = query.get("timestamp", {})
+        ops = {"$gt": str.__gt__, "$gte": str.__ge__, "$lt": str.__lt__, "$lte": str.__le__}
+        for doc in self.docs:
+            ts = doc.get("timestamp")
+            if all(ts is not None and ops[op](ts, value) for op, value in bounds.items()):
+                yield doc
+
+    def find(self, query=None, projection=None, batch_size=None):
+        wanted = None
+        if projection:
+            wanted = {}
+            for key, on in projection.items():
+                if on and key != "_id":
+                    top, _, sub = key.partition(".")
+                    wanted.setdefault(top, set()).add(sub)
+
+        out = []
+        for doc in self._match(query or {}):
+            if wanted is None:
+                out.append(doc)
+                continue
+            row = {}
+            for top, subs in wanted.items():
+                if top not in doc:
+                    continue
+                if "" in subs or not isinstance(doc[top], dict):
+                    row[top] = doc[top]
+                else:
+                    row[top] = {k: v for k, v in doc[top].items() if k in subs}
+            out.append(row)
+        return _Cursor(out)
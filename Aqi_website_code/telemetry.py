@@ -0,0 +1,268 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ------------------------------
+# Logging
+# ------------------------------
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" writes one object per line; "text" is the human-readable form for local runs
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; anything passed via extra= becomes a field."""
+
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                out[key] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str, ensure_ascii=False)
+
+
+def configure_logging(level=None, fmt=None):
+    """Attach a single stderr handler to the "aqi" logger tree (idempotent)."""
+    logger = logging.getLogger("aqi")
+    logger.setLevel(level or LOG_LEVEL)
+    handler = next((h for h in logger.handlers if getattr(h, "_aqi", False)), None)
+    if handler is None:
+        handler = logging.StreamHandler(sys.stderr)
+        handler._aqi = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    if (fmt or LOG_FORMAT) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+    return logger
+
+
+def get_logger(name):
+    return logging.getLogger(f"aqi.{name}")
+
+
+# ------------------------------
+# Prometheus metrics
+# ------------------------------
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # per-bucket (non-cumulative) counts, sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(k, (list(c), s, n)) for k, (c, s, n) in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            running = 0
+            for bound, c in zip(self.buckets, counts):
+                running += c
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {running}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def on_collect(self, fn):
+        """Run fn() before every render, e.g. to refresh gauges from app state."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                get_logger("telemetry").warning("metrics collector failed: %s", e)
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "aqi_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+# Unlabelled: the route template isn't known until the router has matched
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("aqi_http_requests_in_flight", "Requests currently being handled")
+STAGE_SECONDS = REGISTRY.histogram(
+    "aqi_stage_duration_seconds", "Time spent in pipeline stages (load, preprocessing, predict...)", ("stage",))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block into aqi_stage_duration_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+class StageClock:
+    """
+    Times consecutive sub-steps of one stage without re-indenting it:
+    lap("x") records the span since the previous lap as "<prefix>.x",
+    done() records the whole run as "<prefix>".
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.start = self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        STAGE_SECONDS.observe(now - self._last, stage=f"{self.prefix}.{name}")
+        self._last = now
+
+    def done(self):
+        seconds = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(seconds, stage=self.prefix)
+        return seconds
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the in-flight count and latency per route
+    template (/admin/models/{version}/activate, not the concrete path).
+    Plain ASGI rather than BaseHTTPMiddleware so streamed responses are
+    timed to their last chunk and not buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        REQUESTS_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # The router fills in scope["route"] once it has matched
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope.get("method", ""),
+                                    route=route, status=str(status["code"]))
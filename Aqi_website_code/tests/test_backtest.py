@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+import ml_api
+import preprocessing
+from backtest import backtest, pick_origins
+from forecasting import forecast_from_row
+from modeling import split_features
+from synthetic_data import MemoryCollection, generate_hourly_docs
+
+HOURS = 12
+
+
+def test_backtest_matches_forecast_from_row_per_origin():
+    docs = generate_hourly_docs(stations=["Anand Vihar", "ITO"], days=8)
+    raw = ml_api.load_data_from_mongo(collection=MemoryCollection(docs), limit=None)
+    df = preprocessing.preprocess_data(raw, partitioned=True, workers=1)
+    X, y = split_features(df, "PM25")
+    model = RandomForestRegressor(n_estimators=5, max_depth=6, random_state=0).fit(X, y)
+
+    result = backtest(df, model, hours=HOURS, origins=4, workers=1)
+
+    # The same origins, each forecast on its own and scored against the station's next hours
+    ordered = df.sort_values("Timestamp", kind="stable").reset_index(drop=True)
+    picks = pick_origins(ordered, 4, HOURS)
+    pm25 = ordered.set_index(["station_original", "Timestamp"])["PM25"]
+    assert result["errors"].shape == (len(picks), HOURS) == (8, HOURS)
+    assert result["by_station"]["origins"].to_dict() == {"Anand Vihar": 4, "ITO": 4}
+    for errors, i in zip(result["errors"], picks):
+        station, origin = ordered.at[i, "station_original"], ordered.at[i, "Timestamp"]
+        actual = [pm25[(station, origin + pd.Timedelta(hours=h + 1))] for h in range(HOURS)]
+        expected = forecast_from_row(ordered, i, model, HOURS) - np.asarray(actual)
+        np.testing.assert_allclose(errors, expected, rtol=1e-9, atol=1e-9)
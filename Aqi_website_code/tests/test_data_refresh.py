@@ -0,0 +1,95 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import ml_api
+import preprocessing
+from data_refresh import DataRefresher
+from synthetic_data import MemoryCollection, generate_hourly_docs
+
+STATIONS = ["Anand Vihar", "ITO", "RK Puram"]
+
+
+def hourly_docs():
+    # Tidy data so every station has exactly one document per hour
+    return generate_hourly_docs(stations=STATIONS, days=5, gap_rate=0, outage_rate=0,
+                                duplicate_rate=0, null_rate=0)
+
+
+@pytest.fixture
+def refresh(monkeypatch):
+    """(collection, refresher, state) with the last hour saved for the first station only."""
+    monkeypatch.setattr(preprocessing, "PREPROCESS_PARTITIONED", True)
+    monkeypatch.setattr(preprocessing, "PREPROCESS_WORKERS", 1)
+
+    docs = hourly_docs()
+    last = max(d["timestamp"] for d in docs)
+    # cron.js mid-loop: the newest hour is stamped but only one station is saved yet
+    early = [d for d in docs if d["timestamp"] < last or d["station"] == STATIONS[0]]
+    late = [d for d in docs if d["timestamp"] == last and d["station"] != STATIONS[0]]
+
+    collection = MemoryCollection(early)
+    state = {"df": None, "watermark": None}
+    refresher = DataRefresher(
+        state, lambda since: ml_api.load_data_from_mongo(collection=collection, since=since, limit=None))
+    return collection, refresher, state, late, last
+
+
+def last_hour_per_station(df):
+    return df.groupby("station_original")["Timestamp"].max()
+
+
+def test_refresh_picks_up_rows_saved_after_the_watermark_hour(refresh):
+    collection, refresher, state, late, last = refresh
+
+    first = refresher.refresh_once()
+    hours = 5 * 24
+    assert first == len(state["df"]) == 3 * hours - 2
+    assert state["watermark"] == last
+    newest = last_hour_per_station(state["df"])
+    assert newest[STATIONS[0]] == pd.Timestamp(last, tz="UTC")
+    assert newest[STATIONS[1]] == pd.Timestamp(last, tz="UTC") - pd.Timedelta(hours=1)
+
+    # The other stations' rows for the watermark hour arrive after the refresh
+    collection.insert_many(late)
+    assert refresher.refresh_once() == 2
+    assert len(state["df"]) == 3 * hours
+    assert state["watermark"] == last
+    assert (last_hour_per_station(state["df"]) == pd.Timestamp(last, tz="UTC")).all()
+
+    # Nothing new: the watermark hour is read again but the frame is left alone
+    df = state["df"]
+    assert refresher.refresh_once() == 0
+    assert state["df"] is df
+
+
+def test_health_reports_refresh_lag(refresh, monkeypatch):
+    collection, refresher, state, late, last = refresh
+    refresher.refresh_once()
+    collection.insert_many(late)
+    refresher.refresh_once()
+
+    monkeypatch.setattr(ml_api, "DATA_REFRESHER", refresher)
+    monkeypatch.setitem(ml_api.STATE, "df", state["df"])
+    status = TestClient(ml_api.app).get("/health").json()["data_refresh"]
+
+    assert status["watermark"] == last
+    assert pd.Timestamp(status["latest_timestamp"]) == pd.Timestamp(last, tz="UTC")
+    assert 0 <= status["refresh_lag_seconds"] < 60
+    assert status["rows_added_last"] == 2
+    assert status["last_error"] is None
+    assert status["last_success"] is not None
+
+
+def test_failed_refresh_is_reported(refresh):
+    collection, refresher, state, late, last = refresh
+    refresher.refresh_once()
+
+    def broken(since):
+        raise RuntimeError("mongo down")
+
+    refresher.fetch = broken
+    with pytest.raises(RuntimeError):
+        refresher.refresh_once()
+    assert refresher.status()["last_error"] == "mongo down"
+    assert refresher.status()["rows_added_last"] == 3 * 5 * 24 - 2
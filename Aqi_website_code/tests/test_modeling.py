@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from modeling import split_features, update_model
+
+
+def hourly_frame(days, seed=0):
+    rng = np.random.default_rng(seed)
+    n = days * 24
+    ts = pd.date_range("2024-01-01", periods=n, freq="h", tz="UTC")
+    hour = ts.hour.to_numpy()
+    no2 = rng.uniform(10, 80, n)
+    return pd.DataFrame({
+        "Timestamp": ts,
+        "hour": hour,
+        "NO2": no2,
+        "PM25": 40 + 20 * np.sin(hour / 24 * 2 * np.pi) + 0.8 * no2 + rng.normal(0, 2, n),
+    })
+
+
+def test_repeated_updates_keep_the_base_trees():
+    df = hourly_frame(days=20)
+    history = df[df["Timestamp"] < df["Timestamp"].iloc[-24 * 6]]
+    X, y = split_features(history, "PM25")
+    model = RandomForestRegressor(n_estimators=10, random_state=0).fit(X, y)
+    base = list(model.estimators_)
+    feature_cols = list(X.columns)
+
+    # Six days of hourly-style updates, each with a day of fresh rows
+    since = history["Timestamp"].max()
+    for day in range(6):
+        seen = df[df["Timestamp"] <= since + pd.Timedelta(days=1)]
+        results = update_model(model, seen, since, feature_cols, new_trees=4, max_trees=18, min_rows=24)
+        assert results["mode"] == "incremental"
+        model, since = results["model"], seen["Timestamp"].max()
+
+    # Base trees survive every update; only the 8 newest added trees remain beside them
+    assert len(model.estimators_) == 18
+    assert model.n_base_estimators_ == 10
+    assert all(a is b for a, b in zip(model.estimators_[:10], base))
+    assert model.n_estimators == len(model.estimators_)
+
+
+def test_update_without_enough_rows_is_skipped():
+    df = hourly_frame(days=3)
+    X, y = split_features(df, "PM25")
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(X, y)
+    since = df["Timestamp"].iloc[-10]
+
+    results = update_model(model, df, since, list(X.columns), min_rows=24)
+    assert results["mode"] == "skipped"
+    assert len(model.estimators_) == 5
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from csv_ingest import read_chunks
+from mongo_loader import load_hourly_frame
+from synthetic_data import MemoryCollection
+
+DOCS = [
+    # Key order differs from POLLUTANT_FIELDS["PM25"] ("PM25", "pm25", "pm2_5")
+    {"station": "ITO", "timestamp": "2024-01-01T00:00:00Z", "pollutants": {"pm25": 1.0, "PM25": 2.0}},
+    {"station": "ITO", "timestamp": "2024-01-01T01:00:00Z", "pollutants": {"pm2_5": 3.0, "pm25": 4.0}},
+    {"station": "ITO", "timestamp": "2024-01-01T02:00:00Z", "pollutants": {"PM25": 5.0, "pm2_5": 6.0}},
+    {"station": "ITO", "timestamp": "2024-01-01T03:00:00Z", "pollutants": {"pm2_5": 7.0, "PM25": None}},
+]
+
+
+def by_hour(df):
+    return df.set_index(df["Timestamp"].dt.hour)["PM25"].to_dict()
+
+
+def test_spellings_resolve_in_field_order():
+    df = load_hourly_frame(MemoryCollection(DOCS), batch_size=3)
+    assert by_hour(df) == {0: 2.0, 1: 4.0, 2: 5.0, 3: 7.0}
+
+
+def test_mongo_and_csv_paths_agree(tmp_path):
+    spellings = ["pm2_5", "pm25", "PM25"]
+    path = tmp_path / "hourly.csv"
+    pd.DataFrame([{"timestamp": d["timestamp"], "station": d["station"],
+                   **{f"pollutants.{k}": d["pollutants"].get(k) for k in spellings}} for d in DOCS]
+                 ).to_csv(path, index=False)
+
+    csv = pd.concat(read_chunks(path))
+    assert by_hour(csv) == by_hour(load_hourly_frame(MemoryCollection(DOCS)))
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from snapshot import read_snapshot, snapshot_exists, write_snapshot
+
+
+def frame(hours, value):
+    return pd.DataFrame({
+        "Timestamp": pd.date_range("2024-01-01", periods=hours, freq="h", tz="UTC"),
+        "station_original": "ITO",
+        "PM25": np.full(hours, value, dtype=np.float32),
+    })
+
+
+def test_rewrite_replaces_snapshot_and_cleans_up(tmp_path):
+    path = str(tmp_path / "latest")
+    write_snapshot(frame(3, 1.0), path, watermark="a")
+    write_snapshot(frame(5, 2.0), path, watermark="b")
+
+    df, meta = read_snapshot(path)
+    assert meta["watermark"] == "b"
+    assert len(df) == 5 and (df["PM25"] == 2.0).all()
+    assert sorted(os.listdir(tmp_path)) == ["latest"]
+
+
+def test_crash_between_renames_keeps_previous_snapshot(tmp_path):
+    path = str(tmp_path / "latest")
+    write_snapshot(frame(3, 1.0), path, watermark="a")
+    # Killed after moving the live snapshot aside, before the new one took its place
+    os.replace(path, f"{path}.old")
+
+    assert snapshot_exists(path)
+    df, meta = read_snapshot(path)
+    assert meta["watermark"] == "a" and len(df) == 3
+
+    # The next write recovers and leaves a single snapshot behind
+    write_snapshot(frame(4, 2.0), path, watermark="b")
+    assert read_snapshot(path)[1]["watermark"] == "b"
+    assert sorted(os.listdir(tmp_path)) == ["latest"]
+
+
+def test_missing_snapshot(tmp_path):
+    assert not snapshot_exists(str(tmp_path / "latest"))
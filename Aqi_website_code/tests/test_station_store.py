@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ml_api
+import preprocessing
+from forecasting import resolve_feature_layout, seed_features
+from station_store import StationStore, carry_store, store_for
+from synthetic_data import MemoryCollection, generate_hourly_docs
+
+STATIONS = ["Anand Vihar", "ITO", "RK Puram"]
+
+
+@pytest.fixture(params=[False, True], ids=["unpartitioned", "partitioned"])
+def refreshed(request):
+    """(previous frame, refreshed frame) with the last 30 hours arriving as a refresh."""
+    docs = generate_hourly_docs(stations=STATIONS, days=5)
+    raw = ml_api.load_data_from_mongo(collection=MemoryCollection(docs), limit=None)
+    cut = raw["Timestamp"].max() - pd.Timedelta(hours=30)
+
+    previous = preprocessing.preprocess_data(raw[raw["Timestamp"] <= cut], partitioned=request.param, workers=1)
+    store_for(previous)
+    df = preprocessing.preprocess_tail(previous, raw[raw["Timestamp"] > cut])
+    assert len(df) > len(previous)
+    return previous, df
+
+
+def test_carried_store_matches_fresh_build(refreshed):
+    previous, df = refreshed
+    carried = carry_store(previous, df)
+    fresh = StationStore.from_frame(df)
+
+    assert carried is not store_for(previous)
+    assert carried.columns == fresh.columns
+    assert sorted(carried.index) == sorted(fresh.index)
+    for station in fresh.index:
+        values, times = carried.window(station)
+        expected_values, expected_times = fresh.window(station)
+        np.testing.assert_array_equal(times, expected_times)
+        np.testing.assert_allclose(values, expected_values, equal_nan=True)
+    assert carried.newest == fresh.newest
+
+
+def test_seed_rows_are_each_stations_newest_hour(refreshed):
+    previous, df = refreshed
+    carry_store(previous, df)
+    layout = resolve_feature_layout(df, model=None)
+    names = layout["feature_names"]
+    stations = sorted(df["station_original"].astype(str).unique())
+
+    X = seed_features(df, layout, [f"station_{s}" for s in stations])
+
+    for row, station in zip(X, stations):
+        last = df[df["station_original"] == station].iloc[-1]
+        expected = [float(name == f"station_{station}") if name.startswith("station_")
+                    else 0.0 if name in layout["drop_cols"] else float(last[name])
+                    for name in names]
+        np.testing.assert_allclose(row, expected, equal_nan=True)